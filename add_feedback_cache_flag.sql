@@ -0,0 +1,11 @@
+-- SQL para habilitar el cache de feedback por respuesta exacta (opt-in por ejercicio)
+-- Ejecutar en SQL Editor de Supabase Dashboard
+
+-- PASO 1: Añadir la columna (por defecto deshabilitado: el feedback sigue siendo personalizado)
+ALTER TABLE exercises ADD COLUMN IF NOT EXISTS enable_feedback_cache BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- PASO 2 (opcional): Habilitarlo en ejercicios de respuesta corta y determinista
+-- UPDATE exercises SET enable_feedback_cache = TRUE WHERE type = 'command';
+
+-- PASO 3: Verificar
+SELECT id, title, type, enable_feedback_cache FROM exercises ORDER BY created_at DESC LIMIT 20;
@@ -2,18 +2,21 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
 from ..models.attempt import AttemptCreate, AttemptOut, AttemptUser
 from ..db.database import get_db, Database
+from ..db.loader import get_request_loader, RequestLoader
 from ..core.security import get_current_user, AuthUser
 from ..validators.dockerfile import validate_dockerfile
 from ..validators.command import validate_command, validate_conceptual
 from ..validators.compose import validate_compose
+import logging
 import uuid
 
 router = APIRouter(prefix="/attempts", tags=["attempts"])
+logger = logging.getLogger("attempts")
 
 @router.post('/', response_model=AttemptOut, status_code=status.HTTP_201_CREATED, summary="Crear intento de ejercicio (valida estructura y determina completion automáticamente)")
-async def create_attempt(payload: AttemptCreate, db: Database = Depends(get_db), current_user: AuthUser = Depends(get_current_user)):
+async def create_attempt(payload: AttemptCreate, db: Database = Depends(get_db), loader: RequestLoader = Depends(get_request_loader), current_user: AuthUser = Depends(get_current_user)):
     # Validar que el ejercicio exista
-    exercise = await db.get_exercise(payload.exercise_id)
+    exercise = await loader.get_exercise(payload.exercise_id)
     if not exercise:
         raise HTTPException(status_code=404, detail="Ejercicio no encontrado")
 
@@ -63,12 +66,13 @@ async def create_attempt(payload: AttemptCreate, db: Database = Depends(get_db),
     created = await db.create_attempt(data)
 
     # Auto-marcado de guía completa si todos los ejercicios de la guía están completados por el usuario
-    guide_id = exercise.get('guide_id')
-    if guide_id:
+    # (sólo un intento completado puede cambiar el estado de la guía)
+    if completed_flag:
         try:
-            await db.ensure_guide_completed(user_id=current_user.id, guide_id=guide_id)
-        except Exception:
-            pass  # no romper el flujo principal
+            await db.record_exercise_completion(user_id=current_user.id, exercise_id=payload.exercise_id, guide_id=exercise.get('guide_id'))
+        except Exception as e:
+            # No romper el flujo principal: el intento ya quedó guardado
+            logger.warning("No se pudo registrar la completitud del ejercicio %s: %s", payload.exercise_id, e)
     # Inyectamos errores (no persistidos) en la respuesta
     attempt_out = AttemptOut(
         **created,
@@ -3,7 +3,9 @@ from typing import List
 from uuid import UUID
 from ..models.exercise import ExerciseCreate, ExerciseOut, ExerciseUpdate
 from ..db.database import get_db, Database
+from ..db.loader import get_request_loader, RequestLoader
 from ..core.security import require_role
+from ..llm_feedback.feedback_cache import get_feedback_cache
 import uuid
 
 router = APIRouter(prefix="/exercises", tags=["exercises"])
@@ -26,25 +28,29 @@ async def list_all_exercises(db: Database = Depends(get_db), only_active: bool =
     return [ExerciseOut(**e) for e in exercises]
 
 @router.get('/{exercise_id}', response_model=ExerciseOut)
-async def get_exercise(exercise_id: UUID, db: Database = Depends(get_db)):
-    exercise = await db.get_exercise(str(exercise_id))
+async def get_exercise(exercise_id: UUID, loader: RequestLoader = Depends(get_request_loader)):
+    exercise = await loader.get_exercise(str(exercise_id))
     if not exercise:
         raise HTTPException(status_code=404, detail="Ejercicio no encontrado")
     return ExerciseOut(**exercise)
 
 @router.patch('/{exercise_id}', response_model=ExerciseOut, dependencies=[Depends(require_role('admin'))], summary="Actualizar ejercicio (permite cambiar flags)")
-async def update_exercise(exercise_id: UUID, payload: ExerciseUpdate, db: Database = Depends(get_db)):
-    existing = await db.get_exercise(str(exercise_id))
+async def update_exercise(exercise_id: UUID, payload: ExerciseUpdate, db: Database = Depends(get_db), loader: RequestLoader = Depends(get_request_loader)):
+    existing = await loader.get_exercise(str(exercise_id))
     if not existing:
         raise HTTPException(status_code=404, detail="Ejercicio no encontrado")
     update_data = {k: v for k, v in payload.model_dump(exclude_unset=True).items()}
     updated = await db.update_exercise(str(exercise_id), update_data)
+    loader.prime_exercise(str(exercise_id), updated)
+    get_feedback_cache().invalidate_exercise(str(exercise_id))
     return ExerciseOut(**updated)
 
 @router.delete('/{exercise_id}', status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(require_role('admin'))])
-async def delete_exercise(exercise_id: UUID, db: Database = Depends(get_db)):
-    existing = await db.get_exercise(str(exercise_id))
+async def delete_exercise(exercise_id: UUID, db: Database = Depends(get_db), loader: RequestLoader = Depends(get_request_loader)):
+    existing = await loader.get_exercise(str(exercise_id))
     if not existing:
         raise HTTPException(status_code=404, detail="Ejercicio no encontrado")
     await db.delete_exercise(str(exercise_id))
+    loader.prime_exercise(str(exercise_id), None)
+    get_feedback_cache().invalidate_exercise(str(exercise_id))
     return None
@@ -1,11 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import List, AsyncIterator
+import json
 from ..validators.command import validate_command
 from ..validators.dockerfile import validate_dockerfile
 from ..validators.compose import validate_compose
 from ..core.security import get_current_user, AuthUser
-from ..db.database import get_db, Database
+from ..db.database import get_db, Database, run_blocking
+from ..db.loader import get_request_loader, RequestLoader
 from ..llm_feedback.feedback_chain import get_feedback_service, FeedbackService
 
 router = APIRouter(prefix="/feedback", tags=["feedback"])
@@ -19,27 +22,19 @@ class FeedbackAttemptOut(BaseModel):
     content_md: str
     metrics: dict
 
-@router.post('/attempt', response_model=FeedbackAttemptOut, summary="Generar feedback (valida estructura antes de invocar LLM si aplica)")
-async def create_attempt_feedback(payload: FeedbackAttemptIn, db: Database = Depends(get_db), current_user: AuthUser = Depends(get_current_user)):
-    """Genera feedback utilizando el LLM solo si la validación estructural (cuando está habilitada) pasa.
-
-    Flujo:
-    1. Verificar ejercicio y flags.
-    2. Si enable_structural_validation y tipo es command/dockerfile => validar.
-       - Si falla => 422 con detalle y sin invocar LLM.
-    3. Invocar servicio LLM para generar feedback y registrar intento.
-    """
-    service: FeedbackService = await get_feedback_service(db)
-    exercise = await db.get_exercise(payload.exercise_id)
+async def _get_llm_exercise(loader: RequestLoader, exercise_id: str) -> dict:
+    exercise = await loader.get_exercise(exercise_id)
     if not exercise:
         raise HTTPException(status_code=404, detail="Ejercicio no encontrado")
     if not exercise.get('enable_llm_feedback'):
         raise HTTPException(status_code=400, detail="Feedback LLM deshabilitado para este ejercicio")
+    return exercise
 
+def _check_structure(exercise: dict, answer: str) -> None:
+    """Validación estructural previa (si está habilitada). Si falla => 422 sin invocar LLM."""
     ex_type = exercise.get('type')
-    # Validación estructural previa si está habilitada
     if exercise.get('enable_structural_validation') and ex_type in ("command", "dockerfile", "compose"):
-        answer = payload.submitted_answer or ""
+        answer = answer or ""
         if ex_type == "command":
             cmd_res = validate_command(answer)
             if not cmd_res.is_valid:
@@ -68,9 +63,53 @@ async def create_attempt_feedback(payload: FeedbackAttemptIn, db: Database = Dep
                     "structure_valid": False
                 })
 
-    result = await service.generate_feedback(user_id=current_user.id, exercise_id=payload.exercise_id, submitted_answer=payload.submitted_answer)
+def _ndjson_response(events: AsyncIterator[dict]) -> StreamingResponse:
+    """Serializa eventos del servicio como NDJSON (una línea JSON por evento)."""
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            async for event in events:
+                yield (json.dumps(event, ensure_ascii=False) + "\n").encode('utf-8')
+        except Exception as e:
+            # Los headers ya se enviaron: el error viaja como último evento
+            yield (json.dumps({'type': 'error', 'detail': str(e)}, ensure_ascii=False) + "\n").encode('utf-8')
+    return StreamingResponse(
+        body(),
+        media_type='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@router.post('/attempt', response_model=FeedbackAttemptOut, summary="Generar feedback (valida estructura antes de invocar LLM si aplica)")
+async def create_attempt_feedback(payload: FeedbackAttemptIn, db: Database = Depends(get_db), loader: RequestLoader = Depends(get_request_loader), current_user: AuthUser = Depends(get_current_user)):
+    """Genera feedback utilizando el LLM solo si la validación estructural (cuando está habilitada) pasa.
+
+    Flujo:
+    1. Verificar ejercicio y flags.
+    2. Si enable_structural_validation y tipo es command/dockerfile => validar.
+       - Si falla => 422 con detalle y sin invocar LLM.
+    3. Invocar servicio LLM para generar feedback y registrar intento.
+    """
+    service: FeedbackService = await get_feedback_service(db)
+    exercise = await _get_llm_exercise(loader, payload.exercise_id)
+    _check_structure(exercise, payload.submitted_answer)
+
+    result = await service.generate_feedback(user_id=current_user.id, exercise_id=payload.exercise_id, submitted_answer=payload.submitted_answer, loader=loader)
     return FeedbackAttemptOut(**result)
 
+@router.post('/attempt/stream', summary="Generar feedback en streaming (NDJSON: eventos delta y done)")
+async def create_attempt_feedback_stream(payload: FeedbackAttemptIn, db: Database = Depends(get_db), loader: RequestLoader = Depends(get_request_loader), current_user: AuthUser = Depends(get_current_user)):
+    """Igual que /attempt pero reenvía los tokens del LLM a medida que llegan.
+
+    Cada línea es un JSON: {"type": "delta", "content": "..."} con texto ya saneado, y al final
+    {"type": "done", "attempt_id": "...", "metrics": {...}} una vez persistido el intento.
+    Los errores de validación (404/400/422) se devuelven antes de abrir el stream.
+    """
+    service: FeedbackService = await get_feedback_service(db)
+    exercise = await _get_llm_exercise(loader, payload.exercise_id)
+    _check_structure(exercise, payload.submitted_answer)
+    # Contexto y prompt se preparan antes de abrir el stream: Server-Timing incluye esas etapas
+    events = await service.stream_feedback(user_id=current_user.id, exercise_id=payload.exercise_id, submitted_answer=payload.submitted_answer, loader=loader)
+    return _ndjson_response(events)
+
 class ChatIn(BaseModel):
     exercise_id: str
     message: str = Field(min_length=1)
@@ -80,16 +119,19 @@ class ChatOut(BaseModel):
     metrics: dict
 
 @router.post('/chat', response_model=ChatOut)
-async def chat(payload: ChatIn, db: Database = Depends(get_db), current_user: AuthUser = Depends(get_current_user)):
+async def chat(payload: ChatIn, db: Database = Depends(get_db), loader: RequestLoader = Depends(get_request_loader), current_user: AuthUser = Depends(get_current_user)):
     service: FeedbackService = await get_feedback_service(db)
-    exercise = await db.get_exercise(payload.exercise_id)
-    if not exercise:
-        raise HTTPException(status_code=404, detail="Ejercicio no encontrado")
-    if not exercise.get('enable_llm_feedback'):
-        raise HTTPException(status_code=400, detail="Feedback LLM deshabilitado para este ejercicio")
-    result = await service.chat(user_id=current_user.id, exercise_id=payload.exercise_id, message=payload.message)
+    await _get_llm_exercise(loader, payload.exercise_id)
+    result = await service.chat(user_id=current_user.id, exercise_id=payload.exercise_id, message=payload.message, loader=loader)
     return ChatOut(**result)
 
+@router.post('/chat/stream', summary="Chat en streaming (NDJSON: eventos delta y done)")
+async def chat_stream(payload: ChatIn, db: Database = Depends(get_db), loader: RequestLoader = Depends(get_request_loader), current_user: AuthUser = Depends(get_current_user)):
+    service: FeedbackService = await get_feedback_service(db)
+    await _get_llm_exercise(loader, payload.exercise_id)
+    events = await service.stream_chat(user_id=current_user.id, exercise_id=payload.exercise_id, message=payload.message, loader=loader)
+    return _ndjson_response(events)
+
 class HistoryItem(BaseModel):
     type: str
     content_md: str
@@ -100,7 +142,7 @@ async def history(exercise_id: str, db: Database = Depends(get_db), current_user
     # Reutiliza vector store tabla para reconstruir historial (orden ascendente)
     service: FeedbackService = await get_feedback_service(db)
     vs = service.vs
-    raw = vs.recent(user_id=current_user.id, exercise_id=exercise_id, limit=200)
+    raw = await run_blocking(vs.recent, user_id=current_user.id, exercise_id=exercise_id, limit=200)
     # vienen ordenados desc -> invertimos
     ordered = list(reversed(raw))
     items = []
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
 from ..models.guide import GuideCreate, GuideOut, GuideUpdate
 from ..db.database import get_db, Database
+from ..db.loader import get_request_loader, RequestLoader
 from ..core.security import require_role
 import uuid
 
@@ -31,34 +32,36 @@ async def list_guides(db: Database = Depends(get_db)):
     return [GuideOut(**g) for g in guides]
 
 @router.get('/{guide_id}', response_model=GuideOut)
-async def get_guide(guide_id: str, db: Database = Depends(get_db)):
-    guide = await db.get_guide(guide_id)
+async def get_guide(guide_id: str, loader: RequestLoader = Depends(get_request_loader)):
+    guide = await loader.get_guide(guide_id)
     if not guide:
         raise HTTPException(status_code=404, detail="Guía no encontrada")
     return GuideOut(**guide)
 
 @router.get('/{guide_id}/exercises-with-progress', response_model=List[ExerciseWithProgressOut], summary="Lista ejercicios de la guía con flags de progreso del usuario actual")
-async def exercises_with_progress(guide_id: str, db: Database = Depends(get_db), current_user: AuthUser = Depends(get_current_user)):
+async def exercises_with_progress(guide_id: str, db: Database = Depends(get_db), loader: RequestLoader = Depends(get_request_loader), current_user: AuthUser = Depends(get_current_user)):
     # Validar guía existe (para 404 coherente)
-    guide = await db.get_guide(guide_id)
+    guide = await loader.get_guide(guide_id)
     if not guide:
         raise HTTPException(status_code=404, detail="Guía no encontrada")
     rows = await db.list_exercises_with_progress(guide_id, current_user.id)
     return [ExerciseWithProgressOut(**r) for r in rows]
 
 @router.patch('/{guide_id}', response_model=GuideOut, dependencies=[Depends(require_role('admin'))])
-async def update_guide(guide_id: str, payload: GuideUpdate, db: Database = Depends(get_db)):
-    existing = await db.get_guide(guide_id)
+async def update_guide(guide_id: str, payload: GuideUpdate, db: Database = Depends(get_db), loader: RequestLoader = Depends(get_request_loader)):
+    existing = await loader.get_guide(guide_id)
     if not existing:
         raise HTTPException(status_code=404, detail="Guía no encontrada")
     update_data = {k: v for k, v in payload.model_dump(exclude_unset=True).items()}
     updated = await db.update_guide(guide_id, update_data)
+    loader.prime_guide(guide_id, updated)
     return GuideOut(**updated)
 
 @router.delete('/{guide_id}', status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(require_role('admin'))])
-async def delete_guide(guide_id: str, db: Database = Depends(get_db)):
-    existing = await db.get_guide(guide_id)
+async def delete_guide(guide_id: str, db: Database = Depends(get_db), loader: RequestLoader = Depends(get_request_loader)):
+    existing = await loader.get_guide(guide_id)
     if not existing:
         raise HTTPException(status_code=404, detail="Guía no encontrada")
     await db.delete_guide(guide_id)
+    loader.prime_guide(guide_id, None)
     return None
@@ -3,8 +3,13 @@ from ..core.security import get_current_user, AuthUser
 from ..db.database import get_db, Database
 from ..llm_feedback.feedback_chain import get_llm_client, get_feedback_service
 from ..llm_feedback.prompt_builder import MAX_PROMPT_CHARS
+from ..llm_feedback.embedding_cache import get_embedding_cache
+from ..llm_feedback.feedback_cache import get_feedback_cache
+from ..db.write_behind import get_write_behind
+from ..core.config import get_settings
 
 router = APIRouter(prefix="/llm", tags=["llm"])
+settings = get_settings()
 
 @router.get('/status')
 async def llm_status(db: Database = Depends(get_db), current_user: AuthUser = Depends(get_current_user)):
@@ -16,9 +21,19 @@ async def llm_status(db: Database = Depends(get_db), current_user: AuthUser = De
     return {
         'model': client.model,
         'temperature': client.temperature,
+        'max_concurrency': settings.LLM_MAX_CONCURRENCY,
+        'timeout_seconds': settings.LLM_TIMEOUT_SECONDS,
+        'timeouts': getattr(client, '_timeouts', 0),
+        'coalesced': getattr(client, '_coalesced', 0),
+        'inflight': len(getattr(client, '_inflight', {})),
         'stub_mode': client._chain is None,
         'api_key_present': api_key_present,
         'similarity_enabled': similarity_enabled,
+        'embedding_cache': get_embedding_cache().stats(),
+        'write_behind': get_write_behind().stats(),
+        'feedback_cache': get_feedback_cache().stats(),
+        'catalog_cache': db.catalog_stats(),
+        'chat_memory': service.memory.stats(),
         'prompt_budget_chars': MAX_PROMPT_CHARS,
         'lazy_attempts': getattr(client, '_lazy_attempts', None),
         'last_lazy_error': getattr(client, '_last_lazy_error', None),
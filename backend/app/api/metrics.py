@@ -2,7 +2,8 @@ from fastapi import APIRouter, Depends
 from typing import List
 from ..core.security import require_role, AuthUser
 from ..db.database import get_db, Database
-from ..models.metrics import LLMMetricOverviewItem, LLMMetricOverviewResponse
+from ..models.metrics import LLMMetricOverviewItem, LLMMetricOverviewResponse, LLMLiveMetricsResponse
+from ..llm_feedback.metrics import get_metrics_collector
 
 router = APIRouter(prefix="/metrics", tags=["metrics"])
 
@@ -43,3 +44,16 @@ async def metrics_overview(
         ))
 
     return LLMMetricOverviewResponse(items=items, count=len(items))
+
+
+@router.get('/live', response_model=LLMLiveMetricsResponse, summary="Agregados en memoria de llamadas LLM de este worker (admin)")
+async def metrics_live(
+    recent: int = 0,
+    _: AuthUser = Depends(require_role('admin')),
+):
+    # Percentiles de latencia, tokens y tasas de flags por modelo/tipo; sin consultar la base
+    collector = get_metrics_collector()
+    snapshot = collector.snapshot()
+    if recent > 0:
+        snapshot['recent'] = collector.dump(limit=recent)
+    return LLMLiveMetricsResponse(**snapshot)
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from ..core.security import get_current_user, AuthUser
 from ..db.database import get_db, Database
+from ..db.loader import get_request_loader, RequestLoader
 from pydantic import BaseModel
 import uuid
 from typing import List, Optional, Any, Dict
@@ -58,8 +59,8 @@ class ProgressOverviewOut(BaseModel):
 
 
 @router.post('/complete', response_model=CompletedGuideOut, status_code=status.HTTP_201_CREATED, summary="Marcar guía como completada")
-async def complete_guide(payload: CompletedGuideIn, db: Database = Depends(get_db), current_user: AuthUser = Depends(get_current_user)):
-    guide = await db.get_guide(payload.guide_id)
+async def complete_guide(payload: CompletedGuideIn, db: Database = Depends(get_db), loader: RequestLoader = Depends(get_request_loader), current_user: AuthUser = Depends(get_current_user)):
+    guide = await loader.get_guide(payload.guide_id)
     if not guide:
         raise HTTPException(status_code=404, detail="Guía no encontrada")
     data = {"id": str(uuid.uuid4()), "guide_id": payload.guide_id, "user_id": current_user.id}
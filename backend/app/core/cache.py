@@ -0,0 +1,50 @@
+"""Cache en memoria LRU con expiración por entrada.
+
+Mismo esquema que el cache de embeddings (OrderedDict + move_to_end) pero con TTL.
+No es thread-safe: pensado para usarse desde el event loop.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
+import time
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+_MISSING = object()
+
+class TTLCache(Generic[K, V]):
+    def __init__(self, maxsize: int, ttl: float | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[K, Tuple[float | None, V]]" = OrderedDict()
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        item = self._data.get(key, _MISSING)  # type: ignore[arg-type]
+        if item is _MISSING:
+            return default
+        expires_at, value = item  # type: ignore[misc]
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        # mover a final (LRU)
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V, ttl: float | None = None) -> None:
+        """Guarda un valor; `ttl` permite vencimientos propios por entrada (None -> ttl por defecto)."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = (time.monotonic() + ttl) if ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
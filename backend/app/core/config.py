@@ -10,17 +10,64 @@ class Settings(BaseSettings):
     SUPABASE_ANON_KEY: str
     SUPABASE_JWT_SECRET: str | None = None  # Se usa para validar HS256 si está disponible
     DEBUG_AUTH: bool = False
-    EMBEDDING_MODEL: str = "text-embedding-004"  # Modelo Gemini embedding por defecto
+    # --- Cache de autenticación ---
+    AUTH_CACHE_ENABLED: bool = True
+    AUTH_CACHE_MAX_ITEMS: int = 4096
+    AUTH_USER_CACHE_TTL_SECONDS: float = 60.0  # Perfiles de users por sub (cambios externos visibles tras este tiempo)
+    AUTH_CLAIMS_CACHE_MAX_SECONDS: float = 3600.0  # Tope de vida de claims verificados (además del exp del token)
+    JWKS_TTL_SECONDS: float = 600.0  # Refresco periódico del JWKS de Supabase
+    JWKS_MIN_REFRESH_SECONDS: float = 30.0  # Intervalo mínimo entre refetch forzados por kid desconocido
+    # --- Base de datos ---
+    DB_MAX_WORKERS: int = 16  # Hilos máximos para llamadas síncronas a Supabase (PostgREST)
+    # --- Escrituras write-behind (vectores de conversación / llm_metrics) ---
+    WRITE_BEHIND_ENABLED: bool = True
+    WRITE_BEHIND_MAX_QUEUE: int = 1000  # Lotes pendientes; con la cola llena se escribe en línea
+    WRITE_BEHIND_BATCH_SIZE: int = 50
+    WRITE_BEHIND_FLUSH_SECONDS: float = 0.5
+    WRITE_BEHIND_MAX_RETRIES: int = 3
+    PROGRESS_RPC_ENABLED: bool = True  # Agregar progreso con la función user_guide_progress (progress_rpc.sql); fallback Python si falla
+    COMPLETION_RPC_ENABLED: bool = True  # Completitud incremental con record_exercise_completion (exercise_completions.sql)
+    # --- Cache de catálogo (guías / ejercicios) ---
+    CATALOG_CACHE_ENABLED: bool = True
+    CATALOG_CACHE_TTL_SECONDS: float = 300.0
+    CATALOG_CACHE_MAX_ITEMS: int = 2048
+    CATALOG_VERSION_CHECK_SECONDS: float = 5.0  # Frecuencia máx. de consulta a catalog_version (multi-worker)
+    EMBEDDING_MODEL: str = "text-embedding-004"  # Modelo Gemini embedding por defecto; 'local-ngram' = embedder local sin red
     EMBEDDING_DIM: int | None = None  # Si None se infiere por modelo
+    EMBEDDING_CACHE_PATH: str | None = ".cache/embeddings.sqlite3"  # Nivel disco compartido entre workers (vacío = sólo memoria)
+    EMBEDDING_CACHE_MEMORY_ITEMS: int = 2048
     LLM_MODEL: str = "gemini-2.0-flash"  # Modelo conversacional por defecto
     LLM_TEMPERATURE: float = 0.4
+    LLM_MAX_CONCURRENCY: int = 8  # Invocaciones LLM simultáneas por worker
+    LLM_TIMEOUT_SECONDS: float = 30.0  # Deadline por llamada (incluye espera en cola); al vencer se responde stub
+    LLM_COALESCE_ENABLED: bool = True  # Prompts idénticos en vuelo comparten una sola llamada (single-flight)
+    METRICS_BUFFER_SIZE: int = 500  # Últimos eventos LLM en memoria por worker (los agregados no crecen)
+    # --- Prometheus (/metrics) ---
+    PROMETHEUS_ENABLED: bool = True
+    PROMETHEUS_MULTIPROC_DIR: str | None = None  # Requerido con varios workers; vaciarlo antes de arrancar
+    METRICS_SCRAPE_TOKEN: str | None = None  # Si se define, /metrics exige 'Authorization: Bearer <token>'
+    EVENT_LOOP_LAG_INTERVAL: float = 0.5  # Segundos entre muestras del retraso del event loop
+    # --- Trazas por etapa (header Server-Timing y quality_flags.stages_ms) ---
+    TRACING_ENABLED: bool = True
+    TRACE_EXPORT_PATH: str | None = None  # Archivo JSON lines en formato OTLP/JSON (vacío = sin export)
     GOOGLE_API_KEY: str | None = None  # Clave para modelos Gemini (opcional)
+    # --- Cache de feedback por respuesta exacta (opt-in por ejercicio: enable_feedback_cache) ---
+    FEEDBACK_CACHE_TTL_SECONDS: float = 86400.0
+    FEEDBACK_CACHE_MAX_ITEMS: int = 2000
+    # --- Memoria de chat: resumen incremental + últimos turnos literales ---
+    CHAT_SUMMARY_ENABLED: bool = True
+    CHAT_MEMORY_RECENT_TURNS: int = 6  # Turnos literales mínimos en el prompt de chat
+    CHAT_SUMMARY_EVERY_TURNS: int = 8  # Turnos acumulados fuera de la ventana que disparan un nuevo resumen
+    CHAT_SUMMARY_MAX_CHARS: int = 1200
+    CHAT_SUMMARY_CACHE_TTL_SECONDS: float = 300.0  # Cache local del resumen (multi-worker: la tabla es la fuente)
     # --- Similaridad / embeddings avanzados ---
     SIMILARITY_TOP_K: int = 4
     SIMILARITY_RECENCY_DECAY: float = 0.04  # lambda por hora (e^{-lambda*t})
     SIMILARITY_MMR_LAMBDA: float = 0.65  # trade-off entre relevancia y diversidad
     SIMILARITY_FETCH_LIMIT: int = 200
     SIMILARITY_ENABLED: bool = True
+    SIMILARITY_BACKEND: str = "local"  # 'local' (ranking en Python) | 'pgvector' (RPC match_conversation_vectors)
+    EMBEDDING_WIRE_FORMAT: str = "b64"  # 'b64' (columna embedding_b64, ver embedding_wire_format.sql) | 'json'
     # --- CORS ---
     FRONTEND_ORIGINS: list[str] = [
         "http://localhost:3000",
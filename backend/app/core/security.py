@@ -1,17 +1,22 @@
-from typing import Annotated, Dict, Any, Optional
+from typing import Annotated, Dict, Any, Optional, Tuple
+import asyncio
+import hashlib
+import logging
 import re
+import time
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 import jwt
 import httpx
-from functools import lru_cache
 from ..core.config import get_settings
 from ..db.database import get_db, Database
+from .cache import TTLCache
 
 # Ajustamos auto_error=False para poder controlar el mensaje y devolver 401 en lugar de 403
 http_bearer = HTTPBearer(auto_error=False)
 settings = get_settings()
+logger = logging.getLogger("auth")
 
 JWKS_URL_SUFFIX = "/auth/v1/.well-known/jwks.json"
 
@@ -21,23 +26,111 @@ class AuthUser(BaseModel):
     email: str
     name: str
 
-@lru_cache
-def _jwks() -> Dict[str, Any]:  # type: ignore[override]
-    # Sin uso directo; placeholder para tipado
-    return {}
+class JWKSManager:
+    """JWKS de Supabase con refresco por TTL y claves públicas ya parseadas por kid.
 
-_cached_jwks: Dict[str, Any] | None = None
+    - Un kid desconocido fuerza un refetch (rotación de claves), como máximo uno cada
+      JWKS_MIN_REFRESH_SECONDS; los requests concurrentes esperan el mismo refetch (lock).
+    - from_jwk se ejecuta una vez por kid y no en cada verificación.
+    - Un único httpx.AsyncClient reutiliza la conexión; se cierra en el lifespan de la app.
+    """
 
-async def _get_jwks() -> Dict[str, Any]:
-    global _cached_jwks
-    if _cached_jwks is None:
-        url = settings.SUPABASE_URL.rstrip('/') + JWKS_URL_SUFFIX
-        async with httpx.AsyncClient(timeout=10) as client:
-            resp = await client.get(url)
-            if resp.status_code != 200:
-                raise HTTPException(status_code=500, detail="No se pudo obtener JWKS de Supabase")
-            _cached_jwks = resp.json()
-    return _cached_jwks
+    def __init__(self, url: str, ttl: float, min_refresh_interval: float) -> None:
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._jwks: Dict[str, Any] | None = None
+        self._fetched_at = 0.0
+        self._keys: Dict[str, Tuple[Any, str]] = {}  # kid -> (clave pública, alg)
+        self._lock = asyncio.Lock()
+        self._client: httpx.AsyncClient | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=10)
+        return self._client
+
+    def _stale(self) -> bool:
+        return self._jwks is None or time.monotonic() - self._fetched_at >= self.ttl
+
+    async def _refresh(self, *, force: bool) -> None:
+        seen = self._fetched_at
+        async with self._lock:
+            if self._fetched_at != seen:
+                return  # otro request ya refrescó mientras esperábamos
+            if not force and not self._stale():
+                return
+            if force and self._jwks is not None and time.monotonic() - self._fetched_at < self.min_refresh_interval:
+                return  # evita martillar el endpoint con kids inválidos
+            try:
+                resp = await self._get_client().get(self.url)
+            except httpx.HTTPError as e:
+                resp = None
+                logger.warning("Error obteniendo JWKS: %s", e)
+            if resp is None or resp.status_code != 200:
+                if self._jwks is None:
+                    raise HTTPException(status_code=500, detail="No se pudo obtener JWKS de Supabase")
+                # Se siguen usando las claves anteriores hasta el próximo intento
+                self._fetched_at = time.monotonic()
+                return
+            jwks = resp.json()
+            kids = {k.get('kid') for k in jwks.get('keys', [])}
+            self._keys = {kid: parsed for kid, parsed in self._keys.items() if kid in kids}
+            self._jwks = jwks
+            self._fetched_at = time.monotonic()
+
+    async def get_key(self, kid: str | None) -> Tuple[Any, str]:
+        if self._stale():
+            await self._refresh(force=False)
+        parsed = self._keys.get(kid) if kid else None
+        if parsed is not None:
+            return parsed
+        jwk_dict = _match_jwk(self._jwks or {}, kid)
+        if not jwk_dict:
+            await self._refresh(force=True)
+            jwk_dict = _match_jwk(self._jwks or {}, kid)
+            if not jwk_dict:
+                raise HTTPException(status_code=401, detail="Clave JWK no encontrada")
+        parsed = (jwt.algorithms.RSAAlgorithm.from_jwk(jwk_dict), jwk_dict.get('alg', 'RS256'))  # type: ignore[attr-defined]
+        self._keys[kid] = parsed
+        return parsed
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+_jwks_manager = JWKSManager(
+    settings.SUPABASE_URL.rstrip('/') + JWKS_URL_SUFFIX,
+    ttl=settings.JWKS_TTL_SECONDS,
+    min_refresh_interval=settings.JWKS_MIN_REFRESH_SECONDS,
+)
+
+def get_jwks_manager() -> JWKSManager:
+    return _jwks_manager
+
+# Claims ya verificados por hash del token: requests repetidos con el mismo bearer
+# no vuelven a decodificar/verificar el JWT. Cada entrada vence con el exp del token.
+_claims_cache: TTLCache[str, Dict[str, Any]] = TTLCache(maxsize=settings.AUTH_CACHE_MAX_ITEMS)
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+async def _verified_claims(token: str) -> Dict[str, Any]:
+    if not settings.AUTH_CACHE_ENABLED:
+        return await _decode_supabase_token(token)
+    key = _token_key(token)
+    cached = _claims_cache.get(key)
+    if cached is not None:
+        return cached
+    payload = await _decode_supabase_token(token)
+    exp = payload.get('exp')
+    if isinstance(exp, (int, float)):
+        # Sin exp no se cachea (no sabríamos cuándo deja de ser válido)
+        ttl = min(exp - time.time(), settings.AUTH_CLAIMS_CACHE_MAX_SECONDS)
+        if ttl > 0:
+            _claims_cache.set(key, payload, ttl=ttl)
+    return payload
 
 def _match_jwk(jwks: Dict[str, Any], kid: str) -> Dict[str, Any] | None:
     for k in jwks.get('keys', []):
@@ -76,16 +169,12 @@ async def _decode_supabase_token(token: str) -> Dict[str, Any]:
             raise HTTPException(status_code=401, detail=f"Token inválido (HS): {e}")
 
     # RS* (cuando Supabase esté configurado para rotar a claves públicas)
-    jwks = await _get_jwks()
-    jwk_dict = _match_jwk(jwks, kid)
-    if not jwk_dict:
-        raise HTTPException(status_code=401, detail="Clave JWK no encontrada")
     try:
-        public_key = jwt.algorithms.RSAAlgorithm.from_jwk(jwk_dict)  # type: ignore[attr-defined]
+        public_key, key_alg = await _jwks_manager.get_key(kid)
         return jwt.decode(
             token,
             public_key,
-            algorithms=[jwk_dict.get('alg', 'RS256')],
+            algorithms=[key_alg],
             audience=None,
             options={
                 "verify_aud": False,
@@ -152,11 +241,11 @@ async def get_current_user(
     if settings.DEBUG_AUTH:
         print(f"[AUTH DEBUG] Decodificando token len={len(token)}")
 
-    payload = await _decode_supabase_token(token)
+    payload = await _verified_claims(token)
     user_id = payload.get('sub') or payload.get('user_id')
     if not user_id:
         raise HTTPException(status_code=401, detail="Token sin sub")
-    # Recuperar info de tabla users (enlazada por email o id)
+    # Recuperar info de tabla users (enlazada por email o id; cacheada por sub en Database)
     user = await db.get_user_by_id(user_id)
     if not user:
         # fallback: crear registro de usuario local si no existe
@@ -0,0 +1,154 @@
+"""Métricas Prometheus/OpenMetrics del backend (expuestas en GET /metrics).
+
+- Requests HTTP: duración por método, plantilla de ruta (p.ej. /api/v1/guides/{guide_id}) y estado,
+  más requests en curso. Middleware ASGI puro: en streaming mide hasta el último fragmento.
+- Base de datos: duración de cada método público de Database y espera en el pool de hilos
+  (separa "esperando a Supabase" de "esperando un hilo libre").
+- VectorStore: duración de cada método público (embeddings, similitud, escrituras).
+- LLM: latencia y tokens por modelo/tipo (feedback|chat; hits de cache como feedback_cache) y conteo
+  de flags de calidad.
+- Event loop: retraso del loop (CPU bloqueando el loop) muestreado cada EVENT_LOOP_LAG_INTERVAL.
+
+Con varios workers de uvicorn definir PROMETHEUS_MULTIPROC_DIR (directorio vacío al arrancar):
+cada proceso escribe sus valores en archivos mmap y /metrics agrega los de todos.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, TypeVar
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import time
+from .config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger("telemetry")
+
+# prometheus_client decide el modo multiproceso al importarse: la variable debe existir antes
+if settings.PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(settings.PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', settings.PROMETHEUS_MULTIPROC_DIR)
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, multiprocess  # noqa: E402
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST  # noqa: E402
+from prometheus_client.openmetrics.exposition import generate_latest as generate_openmetrics, CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE  # noqa: E402
+
+C = TypeVar('C', bound=type)
+
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+_FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+_TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 1500, 2000, 3000, 5000, 8000)
+
+HTTP_REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Duración de requests HTTP', ['method', 'route', 'status'], buckets=_FAST_BUCKETS + (30.0, 60.0))
+HTTP_IN_PROGRESS = Gauge('http_requests_in_progress', 'Requests HTTP en curso', ['method'], multiprocess_mode='livesum')
+DB_CALL_SECONDS = Histogram('db_call_duration_seconds', 'Duración de métodos de Database', ['method', 'outcome'], buckets=_FAST_BUCKETS)
+DB_POOL_WAIT_SECONDS = Histogram('db_pool_wait_seconds', 'Espera por un hilo libre del pool de I/O bloqueante', buckets=_FAST_BUCKETS)
+VECTOR_CALL_SECONDS = Histogram('vector_store_call_duration_seconds', 'Duración de métodos de VectorStore', ['method', 'outcome'], buckets=_FAST_BUCKETS)
+LLM_CALL_SECONDS = Histogram('llm_call_duration_seconds', 'Latencia de llamadas LLM', ['model', 'kind'], buckets=_SLOW_BUCKETS)
+LLM_PROMPT_TOKENS = Histogram('llm_prompt_tokens', 'Tokens aproximados del prompt', ['model', 'kind'], buckets=_TOKEN_BUCKETS)
+LLM_COMPLETION_TOKENS = Histogram('llm_completion_tokens', 'Tokens aproximados de la respuesta', ['model', 'kind'], buckets=_TOKEN_BUCKETS)
+LLM_FLAGS = Counter('llm_quality_flags', 'Llamadas LLM con cada flag de calidad activo', ['model', 'kind', 'flag'])
+EVENT_LOOP_LAG_SECONDS = Histogram('event_loop_lag_seconds', 'Retraso del event loop respecto del intervalo de muestreo', buckets=_FAST_BUCKETS)
+
+def _timed(fn: Callable[..., Any], histogram: Histogram, name: str) -> Callable[..., Any]:
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = await fn(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                histogram.labels(name, outcome).observe(time.perf_counter() - start)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = fn(*args, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            histogram.labels(name, outcome).observe(time.perf_counter() - start)
+    return wrapper
+
+def instrumented(histogram: Histogram) -> Callable[[C], C]:
+    """Decorador de clase: mide cada método público (sync o async) con `histogram` (labels método/outcome)."""
+    def decorate(cls: C) -> C:
+        for name, attr in list(vars(cls).items()):
+            if name.startswith('_') or not inspect.isfunction(attr):
+                continue
+            setattr(cls, name, _timed(attr, histogram, name))
+        return cls
+    return decorate
+
+def observe_pool_wait(seconds: float) -> None:
+    DB_POOL_WAIT_SECONDS.observe(seconds)
+
+def observe_llm(*, model: str, kind: str, latency_ms: float, prompt_tokens: int | None, completion_tokens: int | None, quality_flags: Dict[str, Any]) -> None:
+    LLM_CALL_SECONDS.labels(model, kind).observe(latency_ms / 1000)
+    if prompt_tokens is not None:
+        LLM_PROMPT_TOKENS.labels(model, kind).observe(prompt_tokens)
+    if completion_tokens is not None:
+        LLM_COMPLETION_TOKENS.labels(model, kind).observe(completion_tokens)
+    for flag, value in quality_flags.items():
+        if value is True:
+            LLM_FLAGS.labels(model, kind, flag).inc()
+
+class PrometheusMiddleware:
+    """Middleware ASGI: duración por plantilla de ruta (no por path concreto, para acotar cardinalidad)."""
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        method = scope.get('method', 'GET')
+        status = {'code': 500}
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        HTTP_IN_PROGRESS.labels(method).inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.labels(method).dec()
+            # FastAPI deja la ruta resuelta en el scope tras el matching
+            route = scope.get('route')
+            template = getattr(route, 'path', None) or 'unmatched'
+            HTTP_REQUEST_SECONDS.labels(method, template, str(status['code'])).observe(time.perf_counter() - start)
+
+async def monitor_event_loop(interval: float) -> None:
+    """Mide cuánto se retrasa un sleep(interval): el excedente es tiempo con el loop bloqueado."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - interval))
+
+def render_metrics(accept: str | None) -> tuple[bytes, str]:
+    """Exposición en texto Prometheus (u OpenMetrics si el scraper lo pide), agregando workers si aplica."""
+    registry = REGISTRY
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    if accept and 'application/openmetrics-text' in accept:
+        return generate_openmetrics(registry), OPENMETRICS_CONTENT_TYPE
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_worker_dead() -> None:
+    # Limpia los gauges 'live' del proceso al apagar (sólo modo multiproceso)
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
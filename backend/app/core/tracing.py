@@ -0,0 +1,150 @@
+"""Trazas livianas por request: etapas del pipeline de feedback/chat.
+
+- TracingMiddleware abre una traza por request HTTP (contextvar) y al enviar los headers agrega
+  `Server-Timing` con la duración de cada etapa terminada hasta ese momento más `total`
+  (en streaming los headers salen antes del LLM: ahí sólo figuran las etapas previas).
+- `with span('llm'):` mide una etapa; sin traza activa es un no-op. Las corrutinas lanzadas con
+  gather heredan la traza (contextvars), por eso etapas concurrentes pueden solaparse.
+- stages_ms() resume ms por etapa; FeedbackService lo guarda en llm_metrics.quality_flags.
+- Con TRACE_EXPORT_PATH cada traza se agrega como una línea JSON con el formato OTLP/JSON de
+  OpenTelemetry (resourceSpans), importable por un collector con el receptor de archivos.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+import asyncio
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from .config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger("tracing")
+
+_current: ContextVar[Optional["Trace"]] = ContextVar('trace', default=None)
+_export_lock = threading.Lock()
+
+@dataclass(slots=True)
+class Span:
+    name: str
+    start_ns: int
+    end_ns: int = 0
+    span_id: str = field(default_factory=lambda: secrets.token_hex(8))
+
+@dataclass
+class Trace:
+    name: str
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    trace_id: str = field(default_factory=lambda: secrets.token_hex(16))
+    root: Span = field(default_factory=lambda: Span(name='request', start_ns=time.time_ns()))
+    spans: List[Span] = field(default_factory=list)
+
+    def stages_ms(self) -> Dict[str, float]:
+        """ms por etapa terminada (sumando repeticiones, p.ej. dos búsquedas de similaridad)."""
+        out: Dict[str, float] = {}
+        for s in self.spans:
+            if s.end_ns:
+                out[s.name] = out.get(s.name, 0.0) + (s.end_ns - s.start_ns) / 1e6
+        return {k: round(v, 1) for k, v in out.items()}
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={ms}" for name, ms in self.stages_ms().items()]
+        parts.append(f"total;dur={round((time.time_ns() - self.root.start_ns) / 1e6, 1)}")
+        return ", ".join(parts)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        def attrs(values: Dict[str, Any]) -> List[Dict[str, Any]]:
+            return [{'key': k, 'value': {'stringValue': str(v)}} for k, v in values.items()]
+        spans = [{
+            'traceId': self.trace_id,
+            'spanId': self.root.span_id,
+            'name': self.name,
+            'kind': 2,  # SERVER
+            'startTimeUnixNano': str(self.root.start_ns),
+            'endTimeUnixNano': str(self.root.end_ns),
+            'attributes': attrs(self.attributes),
+        }]
+        for s in self.spans:
+            if s.end_ns:
+                spans.append({
+                    'traceId': self.trace_id,
+                    'spanId': s.span_id,
+                    'parentSpanId': self.root.span_id,
+                    'name': s.name,
+                    'kind': 1,  # INTERNAL
+                    'startTimeUnixNano': str(s.start_ns),
+                    'endTimeUnixNano': str(s.end_ns),
+                })
+        return {'resourceSpans': [{
+            'resource': {'attributes': attrs({'service.name': settings.PROJECT_NAME})},
+            'scopeSpans': [{'scope': {'name': 'app.core.tracing'}, 'spans': spans}],
+        }]}
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+def stages_ms() -> Optional[Dict[str, float]]:
+    trace = _current.get()
+    return trace.stages_ms() if trace is not None else None
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    s = Span(name=name, start_ns=time.time_ns())
+    try:
+        yield
+    finally:
+        s.end_ns = time.time_ns()
+        trace.spans.append(s)
+
+def _export(path: str, line: str) -> None:
+    try:
+        with _export_lock:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as fh:
+                fh.write(line + "\n")
+    except OSError as e:
+        logger.warning("No se pudo exportar la traza a %s: %s", path, e)
+
+class TracingMiddleware:
+    """Middleware ASGI: traza por request, header Server-Timing y export opcional."""
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        trace = Trace(name=f"{scope.get('method', 'GET')} {scope.get('path', '')}", attributes={'http.method': scope.get('method', 'GET')})
+        token = _current.set(trace)
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message['type'] == 'http.response.start':
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', trace.server_timing().encode('latin-1')))
+                message = {**message, 'headers': headers}
+                trace.attributes['http.status_code'] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            trace.root.end_ns = time.time_ns()
+            route = scope.get('route')
+            if route is not None and getattr(route, 'path', None):
+                trace.attributes['http.route'] = route.path
+                trace.name = f"{trace.attributes['http.method']} {route.path}"
+            if settings.TRACE_EXPORT_PATH and trace.spans:
+                line = json.dumps(trace.to_otlp(), separators=(',', ':'))
+                asyncio.get_running_loop().run_in_executor(None, _export, settings.TRACE_EXPORT_PATH, line)
@@ -0,0 +1,71 @@
+"""Cache de proceso para el catálogo (guías y ejercicios).
+
+El catálogo sólo cambia por escrituras admin, así que las lecturas de estudiantes se sirven
+desde memoria:
+- TTL por entrada (CATALOG_CACHE_TTL_SECONDS) como red de seguridad.
+- Invalidación explícita en cada create/update/delete (Database llama a invalidate()).
+- `generation` local: una lectura iniciada antes de una invalidación no vuelve a poblar el cache.
+- Versión remota (tabla catalog_version, ver catalog_cache_version.sql): los triggers la
+  incrementan en cada escritura, y cada worker la consulta como máximo cada
+  CATALOG_VERSION_CHECK_SECONDS para detectar cambios hechos por otros workers.
+"""
+from __future__ import annotations
+from typing import Any, Hashable, Optional
+import time
+from ..core.cache import TTLCache
+
+class CatalogCache:
+    def __init__(self, *, ttl: float, maxsize: int, version_check_interval: float) -> None:
+        self._entries: TTLCache[Hashable, Any] = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.generation = 0
+        self.remote_version: Optional[int] = None
+        self.version_check_interval = version_check_interval
+        self.version_check_enabled = True
+        self._last_version_check = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, generation: int) -> None:
+        # Si hubo invalidación mientras se leía, el valor puede estar desactualizado: no se guarda
+        if generation == self.generation:
+            self._entries.set(key, value)
+
+    def invalidate(self) -> None:
+        """Vacía el catálogo completo (las escrituras admin son raras y afectan también a los listados)."""
+        self.generation += 1
+        self._entries.clear()
+
+    def version_check_due(self) -> bool:
+        if not self.version_check_enabled:
+            return False
+        now = time.monotonic()
+        if now - self._last_version_check < self.version_check_interval:
+            return False
+        # Se marca antes del round trip para que requests concurrentes no repitan la consulta
+        self._last_version_check = now
+        return True
+
+    def observe_remote_version(self, version: Optional[int]) -> None:
+        if version is None:
+            return
+        if self.remote_version is not None and version != self.remote_version:
+            self.invalidate()
+        self.remote_version = version
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'entries': len(self._entries),
+            'generation': self.generation,
+            'remote_version': self.remote_version,
+            'version_check_enabled': self.version_check_enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -1,155 +1,398 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
 from ..core.config import get_settings
+from .catalog_cache import CatalogCache
+from ..core.cache import TTLCache
+from ..core.telemetry import instrumented, observe_pool_wait, DB_CALL_SECONDS
 
 settings = get_settings()
-
-# Wrapper mínimo para operaciones necesarias (síncronas -> usando async interface superficial)
+logger = logging.getLogger("db")
+
+T = TypeVar('T')
+
+# El SDK de Supabase (PostgREST) es síncrono: cada .execute() bloquea hasta recibir la respuesta HTTP.
+# Para no congelar el event loop de uvicorn, las llamadas se delegan a un pool de hilos acotado.
+_executor: ThreadPoolExecutor | None = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.DB_MAX_WORKERS, thread_name_prefix='db')
+    return _executor
+
+async def run_blocking(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Ejecuta una función bloqueante (I/O síncrono) en el pool acotado sin bloquear el event loop."""
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+
+    def call() -> T:
+        # Espera en la cola del pool (saturación) separada del tiempo de la llamada en sí
+        observe_pool_wait(time.perf_counter() - submitted)
+        return fn(*args, **kwargs)
+    return await loop.run_in_executor(_get_executor(), call)
+
+def shutdown_executor() -> None:
+    """Libera los hilos del pool (se invoca al apagar la aplicación)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+def _copy_rows(value: Any) -> Any:
+    # Copias superficiales: quien reciba la fila puede mutarla sin afectar al cache
+    if isinstance(value, list):
+        return [dict(r) for r in value]
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+# Códigos de "objeto inexistente" (PostgREST / Postgres): sólo estos indican una migración pendiente;
+# cualquier otro error (red, timeout, 5xx) es transitorio y no debe apagar un camino para siempre
+MISSING_FUNCTION_CODES = frozenset({'PGRST202', '42883'})
+MISSING_TABLE_CODES = frozenset({'PGRST205', '42P01'})
+MISSING_COLUMN_CODES = frozenset({'PGRST204', '42703'})
+MISSING_CONSTRAINT_CODES = frozenset({'42P10'})  # ON CONFLICT sin restricción única que coincida
+
+def is_missing_object(error: BaseException, codes: frozenset[str]) -> bool:
+    return str(getattr(error, 'code', None) or '') in codes
+
+# Wrapper mínimo para operaciones necesarias (cliente síncrono delegado al pool -> interfaz async real)
+@instrumented(DB_CALL_SECONDS)
 class Database:
     def __init__(self) -> None:
         self._client: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_ANON_KEY)
+        self._catalog: CatalogCache | None = CatalogCache(
+            ttl=settings.CATALOG_CACHE_TTL_SECONDS,
+            maxsize=settings.CATALOG_CACHE_MAX_ITEMS,
+            version_check_interval=settings.CATALOG_VERSION_CHECK_SECONDS,
+        ) if settings.CATALOG_CACHE_ENABLED else None
+        self._version_task: asyncio.Task | None = None
+        # Perfiles por id (get_current_user los consulta en cada request autenticado). El backend no
+        # modifica filas de users (roles se cambian en Supabase): la única invalidación es el TTL.
+        self._users: TTLCache[str, Dict[str, Any]] | None = TTLCache(
+            maxsize=settings.AUTH_CACHE_MAX_ITEMS,
+            ttl=settings.AUTH_USER_CACHE_TTL_SECONDS,
+        ) if settings.AUTH_CACHE_ENABLED else None
+        self._progress_rpc_enabled = settings.PROGRESS_RPC_ENABLED
+        self._completion_rpc_enabled = settings.COMPLETION_RPC_ENABLED
+        self._completions_table_enabled = True
+        self._summaries_enabled = settings.CHAT_SUMMARY_ENABLED
+
+    async def _execute(self, query: Any) -> Any:
+        # Construir el query es barato; sólo el round trip HTTP se envía al pool
+        return await run_blocking(query.execute)
+
+    async def _fetch(self, query: Any) -> List[Dict[str, Any]]:
+        return (await self._execute(query)).data
+
+    # Catálogo (guías/ejercicios) cacheado en memoria
+    async def _catalog_read(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        cache = self._catalog
+        if cache is None:
+            return await fetch()
+        if cache.version_check_due() and (self._version_task is None or self._version_task.done()):
+            # En segundo plano: la lectura actual no espera el round trip de la versión
+            self._version_task = asyncio.ensure_future(self._refresh_catalog_version())
+        cached = cache.get(key)
+        if cached is not None:
+            return _copy_rows(cached)
+        generation = cache.generation
+        value = await fetch()
+        if value is not None:  # filas inexistentes no se cachean
+            cache.set(key, _copy_rows(value), generation)
+        return value
+
+    async def _refresh_catalog_version(self) -> None:
+        cache = self._catalog
+        if cache is None:
+            return
+        try:
+            rows = await self._fetch(self._client.table('catalog_version').select('version').eq('id', 1).limit(1))
+            cache.observe_remote_version(rows[0]['version'] if rows else None)
+        except Exception as e:
+            if is_missing_object(e, MISSING_TABLE_CODES):
+                # Sin la tabla (migración no aplicada) queda sólo TTL + invalidación local
+                cache.version_check_enabled = False
+                logger.warning("Chequeo de catalog_version deshabilitado: %s", e)
+            else:
+                # Error transitorio: se reintenta en el próximo intervalo
+                logger.warning("Chequeo de catalog_version falló: %s", e)
+
+    def invalidate_catalog(self) -> None:
+        if self._catalog is not None:
+            self._catalog.invalidate()
+
+    def catalog_stats(self) -> Optional[Dict[str, Any]]:
+        return self._catalog.stats() if self._catalog is not None else None
 
     # Users
     async def create_user(self, data: Dict[str, Any]) -> Dict[str, Any]:
         # data must not include password_hash; Supabase Auth stores credentials separately
-        res = self._client.table('users').insert(data).execute()
-        return res.data[0]
+        res = await self._execute(self._client.table('users').insert(data))
+        created = res.data[0]
+        if self._users is not None and created.get('id'):
+            self._users.set(created['id'], dict(created))
+        return created
 
     async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
-        res = self._client.table('users').select('*').eq('email', email).limit(1).execute()
+        res = await self._execute(self._client.table('users').select('*').eq('email', email).limit(1))
         return res.data[0] if res.data else None
 
     async def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
-        res = self._client.table('users').select('*').eq('id', user_id).limit(1).execute()
-        return res.data[0] if res.data else None
+        if self._users is not None:
+            cached = self._users.get(user_id)
+            if cached is not None:
+                return dict(cached)
+        res = await self._execute(self._client.table('users').select('*').eq('id', user_id).limit(1))
+        user = res.data[0] if res.data else None
+        if user is not None and self._users is not None:
+            self._users.set(user_id, dict(user))
+        return user
 
     async def list_users(self) -> List[Dict[str, Any]]:
-        res = self._client.table('users').select('*').execute()
+        res = await self._execute(self._client.table('users').select('*'))
         return res.data
 
     # Guides
     async def create_guide(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        res = self._client.table('guides').insert(data).execute()
+        res = await self._execute(self._client.table('guides').insert(data))
+        self.invalidate_catalog()
         return res.data[0]
 
     async def list_guides(self, active_only: bool = True) -> List[Dict[str, Any]]:
-        query = self._client.table('guides').select('*')
-        if active_only:
-            query = query.eq('is_active', True)
-        res = query.order('order', desc=False).execute()
-        return res.data
+        async def fetch() -> List[Dict[str, Any]]:
+            query = self._client.table('guides').select('*')
+            if active_only:
+                query = query.eq('is_active', True)
+            res = await self._execute(query.order('order', desc=False))
+            return res.data
+        return await self._catalog_read(('guides', active_only), fetch)
 
     async def get_guide(self, guide_id: str) -> Optional[Dict[str, Any]]:
-        res = self._client.table('guides').select('*').eq('id', guide_id).limit(1).execute()
-        return res.data[0] if res.data else None
+        async def fetch() -> Optional[Dict[str, Any]]:
+            res = await self._execute(self._client.table('guides').select('*').eq('id', guide_id).limit(1))
+            return res.data[0] if res.data else None
+        return await self._catalog_read(('guide', guide_id), fetch)
 
     async def update_guide(self, guide_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        res = self._client.table('guides').update(data).eq('id', guide_id).execute()
+        res = await self._execute(self._client.table('guides').update(data).eq('id', guide_id))
+        self.invalidate_catalog()
         return res.data[0] if res.data else None
 
     async def delete_guide(self, guide_id: str) -> None:
-        self._client.table('guides').delete().eq('id', guide_id).execute()
+        await self._execute(self._client.table('guides').delete().eq('id', guide_id))
+        self.invalidate_catalog()
 
     # Exercises
     async def create_exercise(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        res = self._client.table('exercises').insert(data).execute()
+        res = await self._execute(self._client.table('exercises').insert(data))
+        self.invalidate_catalog()
         return res.data[0]
 
     async def list_exercises_by_guide(self, guide_id: str) -> List[Dict[str, Any]]:
-        res = self._client.table('exercises').select('*').eq('guide_id', guide_id).eq('is_active', True).execute()
-        return res.data
+        async def fetch() -> List[Dict[str, Any]]:
+            res = await self._execute(self._client.table('exercises').select('*').eq('guide_id', guide_id).eq('is_active', True))
+            return res.data
+        return await self._catalog_read(('exercises_by_guide', guide_id), fetch)
 
     async def list_all_exercises(self, include_inactive: bool = True) -> List[Dict[str, Any]]:
         query = self._client.table('exercises').select('*')
         if not include_inactive:
             query = query.eq('is_active', True)
-        res = query.order('created_at', desc=True).execute()
+        res = await self._execute(query.order('created_at', desc=True))
         return res.data
 
     async def get_exercise(self, exercise_id: str) -> Optional[Dict[str, Any]]:
-        res = self._client.table('exercises').select('*').eq('id', exercise_id).limit(1).execute()
-        return res.data[0] if res.data else None
+        async def fetch() -> Optional[Dict[str, Any]]:
+            res = await self._execute(self._client.table('exercises').select('*').eq('id', exercise_id).limit(1))
+            return res.data[0] if res.data else None
+        return await self._catalog_read(('exercise', exercise_id), fetch)
 
     async def update_exercise(self, exercise_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        res = self._client.table('exercises').update(data).eq('id', exercise_id).execute()
+        res = await self._execute(self._client.table('exercises').update(data).eq('id', exercise_id))
+        self.invalidate_catalog()
         return res.data[0] if res.data else None
 
     async def delete_exercise(self, exercise_id: str) -> None:
-        self._client.table('exercises').delete().eq('id', exercise_id).execute()
+        await self._execute(self._client.table('exercises').delete().eq('id', exercise_id))
+        self.invalidate_catalog()
 
     # Attempts (sin feedback LLM)
     async def create_attempt(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        res = self._client.table('exercise_attempts').insert(data).execute()
+        res = await self._execute(self._client.table('exercise_attempts').insert(data))
         return res.data[0]
 
     async def list_attempts(self, exercise_id: str, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
         query = self._client.table('exercise_attempts').select('*').eq('exercise_id', exercise_id)
         if user_id:
             query = query.eq('user_id', user_id)
-        res = query.order('created_at', desc=True).execute()
+        res = await self._execute(query.order('created_at', desc=True))
         return res.data
 
     async def get_last_feedback(self, exercise_id: str, user_id: str) -> Optional[str]:
-        res = self._client.table('exercise_attempts') \
-            .select('llm_feedback') \
-            .eq('exercise_id', exercise_id) \
-            .eq('user_id', user_id) \
-            .not_.is_('llm_feedback', 'null') \
-            .order('created_at', desc=True) \
-            .limit(1) \
-            .execute()
+        res = await self._execute(self._client.table('exercise_attempts')
+            .select('llm_feedback')
+            .eq('exercise_id', exercise_id)
+            .eq('user_id', user_id)
+            .not_.is_('llm_feedback', 'null')
+            .order('created_at', desc=True)
+            .limit(1))
         if res.data:
             return res.data[0].get('llm_feedback')
         return None
 
     async def mark_guide_completed(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        res = self._client.table('completed_guides').insert(data).execute()
-        return res.data[0]
+        """Inserta completed_guides una sola vez por usuario/guía (devuelve la fila existente si ya estaba)."""
+        try:
+            res = await self._execute(self._client.table('completed_guides').upsert(data, on_conflict='user_id,guide_id', ignore_duplicates=True))
+        except Exception as e:
+            # Sólo sin la restricción única (exercise_completions.sql no aplicado) se usa insert;
+            # ante otro error un insert a ciegas podría duplicar la fila
+            if not is_missing_object(e, MISSING_CONSTRAINT_CODES):
+                raise
+            logger.warning("Upsert completed_guides no disponible, usando insert: %s", e)
+            res = await self._execute(self._client.table('completed_guides').insert(data))
+        if res.data:
+            return res.data[0]
+        existing = await self._fetch(self._client.table('completed_guides').select('*').eq('user_id', data['user_id']).eq('guide_id', data['guide_id']).limit(1))
+        return existing[0]
 
     async def list_completed_guides(self, user_id: str) -> List[Dict[str, Any]]:
-        res = self._client.table('completed_guides').select('*').eq('user_id', user_id).execute()
+        res = await self._execute(self._client.table('completed_guides').select('*').eq('user_id', user_id))
         return res.data
 
     # LLM metrics
     async def create_llm_metric(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        res = self._client.table('llm_metrics').insert(data).execute()
+        res = await self._execute(self._client.table('llm_metrics').insert(data))
         return res.data[0]
 
+    async def create_llm_metrics(self, rows: List[Dict[str, Any]]) -> None:
+        # Inserción en lote (cola write-behind): un solo request, sin devolver filas
+        if rows:
+            await self._execute(self._client.table('llm_metrics').insert(rows, returning='minimal'))
+
     async def list_llm_metrics(self, limit: int = 200) -> List[Dict[str, Any]]:
         # Devuelve las métricas más recientes primero
-        res = self._client.table('llm_metrics').select('*').order('created_at', desc=True).limit(limit).execute()
+        res = await self._execute(self._client.table('llm_metrics').select('*').order('created_at', desc=True).limit(limit))
         return res.data
 
+    # Resúmenes de conversación (conversation_summaries.sql); sin la tabla se degradan a memoria local
+    async def get_conversation_summary(self, user_id: str, exercise_id: str) -> Optional[Dict[str, Any]]:
+        if not self._summaries_enabled:
+            return None
+        try:
+            rows = await self._fetch(self._client.table('exercise_conversation_summaries').select('summary,summarized_until,turns_summarized').eq('user_id', user_id).eq('exercise_id', exercise_id).limit(1))
+        except Exception as e:
+            if is_missing_object(e, MISSING_TABLE_CODES):
+                self._summaries_enabled = False
+                logger.warning("Tabla exercise_conversation_summaries no disponible, resúmenes sólo en memoria: %s", e)
+            else:
+                logger.warning("Lectura de resumen de conversación falló (%s, %s): %s", user_id, exercise_id, e)
+            return None
+        return rows[0] if rows else None
+
+    async def upsert_conversation_summary(self, data: Dict[str, Any]) -> None:
+        if not self._summaries_enabled:
+            return
+        try:
+            await self._execute(self._client.table('exercise_conversation_summaries').upsert(data, on_conflict='user_id,exercise_id', returning='minimal'))
+        except Exception as e:
+            if is_missing_object(e, MISSING_TABLE_CODES):
+                self._summaries_enabled = False
+                logger.warning("Tabla exercise_conversation_summaries no disponible, resúmenes sólo en memoria: %s", e)
+            else:
+                # Error transitorio: el resumen queda en el cache local y se reescribe en la próxima actualización
+                logger.warning("No se pudo guardar el resumen de conversación (%s, %s): %s", data.get('user_id'), data.get('exercise_id'), e)
+
     async def get_users_by_ids(self, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
         if not user_ids:
             return {}
         # Supabase in operator
-        res = self._client.table('users').select('*').in_('id', user_ids).execute()
+        res = await self._execute(self._client.table('users').select('*').in_('id', user_ids))
         return {u['id']: u for u in res.data}
 
     async def get_exercises_by_ids(self, exercise_ids: List[str]) -> Dict[str, Dict[str, Any]]:
-        if not exercise_ids:
-            return {}
-        res = self._client.table('exercises').select('*').in_('id', exercise_ids).execute()
-        return {e['id']: e for e in res.data}
+        return await self._catalog_read_many('exercises', 'exercise', exercise_ids)
+
+    async def get_guides_by_ids(self, guide_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        return await self._catalog_read_many('guides', 'guide', guide_ids)
+
+    async def _catalog_read_many(self, table: str, kind: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        # Sirve desde el cache lo que haya y consulta sólo los ids faltantes
+        out: Dict[str, Dict[str, Any]] = {}
+        missing = list(ids)
+        cache = self._catalog
+        if cache is not None:
+            missing = []
+            for _id in ids:
+                cached = cache.get((kind, _id))
+                if cached is not None:
+                    out[_id] = _copy_rows(cached)
+                else:
+                    missing.append(_id)
+        if not missing:
+            return out
+        generation = cache.generation if cache is not None else 0
+        res = await self._execute(self._client.table(table).select('*').in_('id', missing))
+        for row in res.data:
+            out[row['id']] = row
+            if cache is not None:
+                cache.set((kind, row['id']), _copy_rows(row), generation)
+        return out
 
     # Progress aggregations
+    async def _progress_rpc(self, user_id: str, *, active_only: bool, include_exercises: bool = False) -> Optional[List[Dict[str, Any]]]:
+        """Progreso agregado en Postgres (función user_guide_progress, ver progress_rpc.sql).
+
+        Devuelve None si la RPC no está disponible o falla; en ese caso se usa la agregación en Python.
+        """
+        if not self._progress_rpc_enabled:
+            return None
+        try:
+            return await self._fetch(self._client.rpc('user_guide_progress', {
+                'p_user_id': user_id,
+                'p_active_only': active_only,
+                'p_include_exercises': include_exercises,
+            }))
+        except Exception as e:
+            if is_missing_object(e, MISSING_FUNCTION_CODES):
+                # Función no creada (migración pendiente): no reintentar en cada request
+                self._progress_rpc_enabled = False
+                logger.warning("RPC user_guide_progress no disponible, usando agregación en Python: %s", e)
+            else:
+                # Error transitorio: sólo esta request usa la agregación en Python
+                logger.warning("RPC user_guide_progress falló, agregación en Python para esta request: %s", e)
+            return None
+
     async def list_guides_progress(self, user_id: str) -> List[Dict[str, Any]]:
         """Devuelve por guía: total ejercicios y cuántos completados para el usuario.
         'Completado' se infiere si existe attempt.completed=true para ese ejercicio y usuario.
         """
+        rows = await self._progress_rpc(user_id, active_only=False)
+        if rows is not None:
+            return [{
+                'guide_id': r['guide_id'],
+                'title': r.get('title'),
+                'topic': r.get('topic'),
+                'total_exercises': r.get('total_exercises') or 0,
+                'completed_exercises': r.get('completed_exercises') or 0,
+            } for r in rows]
         # Obtener todas las guías
-        guides = self._client.table('guides').select('id,title,topic').execute().data
+        guides = await self._fetch(self._client.table('guides').select('id,title,topic'))
         guide_ids = [g['id'] for g in guides]
         if not guide_ids:
             return []
         # Ejercicios por guía
-        exercises = self._client.table('exercises').select('id,guide_id').in_('guide_id', guide_ids).eq('is_active', True).execute().data
+        exercises = await self._fetch(self._client.table('exercises').select('id,guide_id').in_('guide_id', guide_ids).eq('is_active', True))
         exercise_ids = [e['id'] for e in exercises]
         # Attempts completados por usuario
         completed_attempts_map: Dict[str, bool] = {}
         if exercise_ids:
-            attempts = self._client.table('exercise_attempts').select('exercise_id,completed').in_('exercise_id', exercise_ids).eq('user_id', user_id).eq('completed', True).execute().data
+            attempts = await self._fetch(self._client.table('exercise_attempts').select('exercise_id,completed').in_('exercise_id', exercise_ids).eq('user_id', user_id).eq('completed', True))
             for a in attempts:
                 completed_attempts_map[a['exercise_id']] = True
         # Agregar
@@ -171,39 +414,81 @@ class Database:
             })
         return out
 
+    async def record_exercise_completion(self, user_id: str, exercise_id: str, guide_id: Optional[str]) -> None:
+        """Registra un ejercicio completado y marca la guía si quedó completa.
+
+        Con la RPC record_exercise_completion (exercise_completions.sql) es una sola llamada
+        incremental; si no existe (o falla) se registra la fila en user_exercise_completions y se
+        recalcula con ensure_guide_completed.
+        """
+        if self._completion_rpc_enabled:
+            try:
+                await self._execute(self._client.rpc('record_exercise_completion', {
+                    'p_user_id': user_id,
+                    'p_exercise_id': exercise_id,
+                }))
+                return
+            except Exception as e:
+                if is_missing_object(e, MISSING_FUNCTION_CODES):
+                    self._completion_rpc_enabled = False
+                    logger.warning("RPC record_exercise_completion no disponible, usando ensure_guide_completed: %s", e)
+                else:
+                    logger.warning("RPC record_exercise_completion falló, recálculo para esta llamada: %s", e)
+        await self._insert_exercise_completion(user_id, exercise_id, guide_id)
+        if guide_id:
+            await self.ensure_guide_completed(user_id=user_id, guide_id=guide_id)
+
+    async def _insert_exercise_completion(self, user_id: str, exercise_id: str, guide_id: Optional[str]) -> None:
+        # user_guide_progress lee esta tabla: el camino sin RPC también debe registrar la completitud
+        if not self._completions_table_enabled:
+            return
+        try:
+            await self._execute(self._client.table('user_exercise_completions').upsert({
+                'user_id': user_id,
+                'exercise_id': exercise_id,
+                'guide_id': guide_id,
+            }, on_conflict='user_id,exercise_id', ignore_duplicates=True, returning='minimal'))
+        except Exception as e:
+            if is_missing_object(e, MISSING_TABLE_CODES):
+                # Sin exercise_completions.sql el progreso se deriva de exercise_attempts
+                self._completions_table_enabled = False
+                logger.warning("Tabla user_exercise_completions no disponible: %s", e)
+            else:
+                logger.warning("No se pudo registrar user_exercise_completions (%s, %s): %s", user_id, exercise_id, e)
+
     async def ensure_guide_completed(self, user_id: str, guide_id: str) -> None:
         """Marca una guía como completada para el usuario si TODOS sus ejercicios activos tienen al menos un attempt completed=true.
 
         Idempotente: si ya existe registro en completed_guides no crea duplicado.
         """
         # Verificar ya marcada
-        existing = self._client.table('completed_guides').select('id').eq('guide_id', guide_id).eq('user_id', user_id).execute().data
+        existing = await self._fetch(self._client.table('completed_guides').select('id').eq('guide_id', guide_id).eq('user_id', user_id))
         if existing:
             return
         # Obtener ejercicios activos de la guía
-        exercises = self._client.table('exercises').select('id').eq('guide_id', guide_id).eq('is_active', True).execute().data
+        exercises = await self._fetch(self._client.table('exercises').select('id').eq('guide_id', guide_id).eq('is_active', True))
         if not exercises:
             return  # Guía sin ejercicios activos -> no marcamos
         exercise_ids = [e['id'] for e in exercises]
         # Attempts completados del usuario para esos ejercicios
-        attempts = self._client.table('exercise_attempts').select('exercise_id,completed').in_('exercise_id', exercise_ids).eq('user_id', user_id).eq('completed', True).execute().data
+        attempts = await self._fetch(self._client.table('exercise_attempts').select('exercise_id,completed').in_('exercise_id', exercise_ids).eq('user_id', user_id).eq('completed', True))
         completed_set = {a['exercise_id'] for a in attempts if a.get('completed')}
         if len(completed_set) == len(exercise_ids):
             # Marcar guía
-            self._client.table('completed_guides').insert({
+            await self.mark_guide_completed({
                 'id': __import__('uuid').uuid4().hex,
                 'guide_id': guide_id,
                 'user_id': user_id,
-            }).execute()
+            })
 
     async def list_exercises_with_progress(self, guide_id: str, user_id: str) -> List[Dict[str, Any]]:
-        exercises = self._client.table('exercises').select('id,title,type,difficulty').eq('guide_id', guide_id).eq('is_active', True).execute().data
+        exercises = await self._fetch(self._client.table('exercises').select('id,title,type,difficulty').eq('guide_id', guide_id).eq('is_active', True))
         exercise_ids = [e['id'] for e in exercises]
         attempts_map: Dict[str, Dict[str, Any]] = {}
         attempts_count: Dict[str, int] = {eid: 0 for eid in exercise_ids}
         completed_map: Dict[str, bool] = {eid: False for eid in exercise_ids}
         if exercise_ids:
-            attempts = self._client.table('exercise_attempts').select('exercise_id,completed').in_('exercise_id', exercise_ids).eq('user_id', user_id).execute().data
+            attempts = await self._fetch(self._client.table('exercise_attempts').select('exercise_id,completed').in_('exercise_id', exercise_ids).eq('user_id', user_id))
             for a in attempts:
                 eid = a['exercise_id']
                 attempts_count[eid] = attempts_count.get(eid, 0) + 1
@@ -231,27 +516,37 @@ class Database:
           guides: [ { guide_id, title, order, total_exercises, completed_exercises, percent, completed, exercises? } ]
         }
         """
+        rows = await self._progress_rpc(user_id, active_only=True, include_exercises=include_exercises)
+        if rows is not None:
+            guides_out: List[Dict[str, Any]] = []
+            for r in rows:
+                total_ex = r.get('total_exercises') or 0
+                completed_ex = r.get('completed_exercises') or 0
+                guide_obj: Dict[str, Any] = {
+                    'guide_id': r['guide_id'],
+                    'title': r.get('title'),
+                    'order': r.get('order'),
+                    'total_exercises': total_ex,
+                    'completed_exercises': completed_ex,
+                    'percent': round((completed_ex / total_ex * 100.0), 2) if total_ex > 0 else 0.0,
+                    'completed': (total_ex > 0 and completed_ex == total_ex)
+                }
+                if include_exercises:
+                    guide_obj['exercises'] = r.get('exercises') or []
+                guides_out.append(guide_obj)
+            return self._progress_overview(guides_out)
         # Guías activas
-        guides = self._client.table('guides').select('id,title,topic,order').eq('is_active', True).order('order', desc=False).execute().data
+        guides = await self._fetch(self._client.table('guides').select('id,title,topic,order').eq('is_active', True).order('order', desc=False))
         if not guides:
-            return {
-                'totals': {
-                    'total_guides': 0,
-                    'completed_guides': 0,
-                    'total_exercises': 0,
-                    'completed_exercises': 0,
-                    'percent_exercises': 0.0
-                },
-                'guides': []
-            }
+            return self._progress_overview([])
         guide_ids = [g['id'] for g in guides]
         # Ejercicios activos de todas las guías
-        exercises = self._client.table('exercises').select('id,guide_id,title').in_('guide_id', guide_ids).eq('is_active', True).execute().data
+        exercises = await self._fetch(self._client.table('exercises').select('id,guide_id,title').in_('guide_id', guide_ids).eq('is_active', True))
         exercise_ids = [e['id'] for e in exercises]
         # Attempts completados del usuario
         completed_exercise_ids: set[str] = set()
         if exercise_ids:
-            attempts = self._client.table('exercise_attempts').select('exercise_id').in_('exercise_id', exercise_ids).eq('user_id', user_id).eq('completed', True).execute().data
+            attempts = await self._fetch(self._client.table('exercise_attempts').select('exercise_id').in_('exercise_id', exercise_ids).eq('user_id', user_id).eq('completed', True))
             for a in attempts:
                 completed_exercise_ids.add(a['exercise_id'])
         # Agrupar ejercicios por guía
@@ -259,13 +554,11 @@ class Database:
         for e in exercises:
             guide_exercises.setdefault(e['guide_id'], []).append(e)
         # Construir salida por guía
-        guides_out: List[Dict[str, Any]] = []
-        total_completed_exercises = 0
+        guides_out = []
         for g in guides:
             ex_list = guide_exercises.get(g['id'], [])
             total_ex = len(ex_list)
             completed_ex = sum(1 for ex in ex_list if ex['id'] in completed_exercise_ids)
-            total_completed_exercises += completed_ex
             percent = round((completed_ex / total_ex * 100.0), 2) if total_ex > 0 else 0.0
             guide_obj: Dict[str, Any] = {
                 'guide_id': g['id'],
@@ -285,12 +578,17 @@ class Database:
                     } for ex in ex_list
                 ]
             guides_out.append(guide_obj)
-        total_exercises = len(exercises)
+        return self._progress_overview(guides_out)
+
+    @staticmethod
+    def _progress_overview(guides_out: List[Dict[str, Any]]) -> Dict[str, Any]:
+        total_exercises = sum(g['total_exercises'] for g in guides_out)
+        total_completed_exercises = sum(g['completed_exercises'] for g in guides_out)
         percent_exercises = round((total_completed_exercises / total_exercises * 100.0), 2) if total_exercises > 0 else 0.0
         completed_guides = sum(1 for g in guides_out if g['completed'])
         overview = {
             'totals': {
-                'total_guides': len(guides),
+                'total_guides': len(guides_out),
                 'completed_guides': completed_guides,
                 'total_exercises': total_exercises,
                 'completed_exercises': total_completed_exercises,
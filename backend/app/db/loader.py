@@ -0,0 +1,102 @@
+"""Identity map por request sobre Database.
+
+Durante un request cada ejercicio/guía se lee como máximo una vez:
+- Búsquedas repetidas o concurrentes del mismo id comparten el mismo future.
+- Las búsquedas emitidas en el mismo tick del event loop se agrupan en una sola
+  consulta `in_` (get_exercises_by_ids / get_guides_by_ids).
+
+Handlers y FeedbackService comparten la instancia vía la dependencia get_request_loader
+(FastAPI la resuelve una sola vez por request).
+"""
+from __future__ import annotations
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+import asyncio
+from fastapi import Depends
+from .database import Database, get_db
+
+Row = Dict[str, Any]
+
+class _BatchLoader:
+    def __init__(
+        self,
+        fetch_one: Callable[[str], Awaitable[Optional[Row]]],
+        fetch_many: Callable[[List[str]], Awaitable[Dict[str, Row]]],
+    ) -> None:
+        self._fetch_one = fetch_one
+        self._fetch_many = fetch_many
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._queue: List[str] = []
+        # Referencias fuertes a los lotes en vuelo (el loop sólo guarda referencias débiles a los tasks)
+        self._tasks: Set[asyncio.Task] = set()
+
+    def load(self, key: str) -> asyncio.Future:
+        fut = self._futures.get(key)
+        if fut is None:
+            loop = asyncio.get_running_loop()
+            fut = loop.create_future()
+            self._futures[key] = fut
+            self._queue.append(key)
+            if len(self._queue) == 1:
+                # Se despacha al final del tick: agrupa todas las claves pedidas mientras tanto
+                loop.call_soon(self._dispatch)
+        return fut
+
+    def prime(self, key: str, row: Optional[Row]) -> None:
+        fut = self._futures.get(key)
+        if fut is not None and not fut.done():
+            fut.set_result(row)  # resuelve también a quienes ya esperaban
+            return
+        fut = asyncio.get_running_loop().create_future()
+        fut.set_result(row)
+        self._futures[key] = fut
+
+    def _dispatch(self) -> None:
+        keys, self._queue = self._queue, []
+        task = asyncio.get_running_loop().create_task(self._run(keys))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, keys: List[str]) -> None:
+        try:
+            if len(keys) == 1:
+                rows = {keys[0]: await self._fetch_one(keys[0])}
+            else:
+                rows = await self._fetch_many(keys)
+        except Exception as e:
+            # Los errores no se cachean: un reintento dentro del request vuelve a consultar
+            for k in keys:
+                fut = self._futures.pop(k, None)
+                if fut is not None and not fut.done():
+                    fut.set_exception(e)
+            return
+        for k in keys:
+            fut = self._futures.get(k)
+            if fut is not None and not fut.done():
+                fut.set_result(rows.get(k))
+
+
+class RequestLoader:
+    def __init__(self, db: Database) -> None:
+        self.db = db
+        self._exercises = _BatchLoader(db.get_exercise, db.get_exercises_by_ids)
+        self._guides = _BatchLoader(db.get_guide, db.get_guides_by_ids)
+
+    async def get_exercise(self, exercise_id: str) -> Optional[Row]:
+        return await self._exercises.load(exercise_id)
+
+    async def get_guide(self, guide_id: str) -> Optional[Row]:
+        return await self._guides.load(guide_id)
+
+    async def get_exercises(self, exercise_ids: List[str]) -> Dict[str, Row]:
+        rows = await asyncio.gather(*(self._exercises.load(eid) for eid in exercise_ids))
+        return {eid: row for eid, row in zip(exercise_ids, rows) if row}
+
+    def prime_exercise(self, exercise_id: str, row: Optional[Row]) -> None:
+        self._exercises.prime(exercise_id, row)
+
+    def prime_guide(self, guide_id: str, row: Optional[Row]) -> None:
+        self._guides.prime(guide_id, row)
+
+
+async def get_request_loader(db: Database = Depends(get_db)) -> RequestLoader:
+    return RequestLoader(db)
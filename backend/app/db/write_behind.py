@@ -0,0 +1,142 @@
+"""Cola write-behind para escrituras que no forman parte de la respuesta.
+
+Los vectores de conversación y las filas de llm_metrics se encolan y un task en segundo plano
+los persiste en lotes:
+- Flush al juntar WRITE_BEHIND_BATCH_SIZE filas o tras WRITE_BEHIND_FLUSH_SECONDS desde la primera.
+- Reintentos con backoff exponencial (WRITE_BEHIND_MAX_RETRIES); luego el lote se descarta y se registra.
+- Cola acotada (WRITE_BEHIND_MAX_QUEUE): si está llena, o la cola no está corriendo (scripts, tests),
+  enqueue devuelve False y quien llama escribe de forma directa.
+- Se inicia y se drena en el lifespan de FastAPI.
+
+Cada tipo de fila ('vectors', 'llm_metrics') tiene un handler async que recibe el lote completo.
+"""
+from __future__ import annotations
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+from contextlib import suppress
+from ..core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger("write_behind")
+
+Handler = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+class WriteBehindQueue:
+    def __init__(self, *, max_size: int, batch_size: int, flush_interval: float, max_retries: int) -> None:
+        self.max_size = max_size
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._handlers: Dict[str, Handler] = {}
+        self._queue: Optional[asyncio.Queue[Tuple[str, List[Dict[str, Any]]]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._accepting = False
+        self.enqueued = 0
+        self.flushed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def register(self, kind: str, handler: Handler) -> None:
+        self._handlers[kind] = handler
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        self._accepting = True
+
+    def enqueue(self, kind: str, rows: List[Dict[str, Any]]) -> bool:
+        """Encola filas; False si no se aceptan (la escritura debe hacerse en línea)."""
+        if not rows:
+            return True
+        if not self._accepting or self._queue is None or kind not in self._handlers:
+            return False
+        try:
+            self._queue.put_nowait((kind, rows))
+        except asyncio.QueueFull:
+            self.rejected += len(rows)
+            return False
+        self.enqueued += len(rows)
+        return True
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        q = self._queue
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await q.get()]
+            rows = len(batch[0][1])
+            deadline = loop.time() + self.flush_interval
+            while rows < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(q.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                rows += len(item[1])
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+    async def _flush(self, batch: List[Tuple[str, List[Dict[str, Any]]]]) -> None:
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for kind, rows in batch:
+            groups.setdefault(kind, []).extend(rows)
+        for kind, rows in groups.items():
+            handler = self._handlers[kind]
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await handler(rows)
+                    self.flushed += len(rows)
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        self.failed += len(rows)
+                        logger.warning("Write-behind descartó %d filas '%s' tras %d intentos: %s", len(rows), kind, attempt + 1, e)
+                    else:
+                        await asyncio.sleep(min(0.2 * 2 ** attempt, 5.0))
+
+    async def drain(self, timeout: float = 10.0) -> None:
+        """Deja de aceptar filas, persiste lo pendiente y detiene el task (apagado de la app)."""
+        self._accepting = False
+        if self._task is None or self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Write-behind: %d lotes sin persistir al apagar", self._queue.qsize())
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+        self._queue = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'running': self._task is not None,
+            'depth': self.depth(),
+            'enqueued': self.enqueued,
+            'flushed': self.flushed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+        }
+
+_write_behind = WriteBehindQueue(
+    max_size=settings.WRITE_BEHIND_MAX_QUEUE,
+    batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=settings.WRITE_BEHIND_FLUSH_SECONDS,
+    max_retries=settings.WRITE_BEHIND_MAX_RETRIES,
+)
+
+def get_write_behind() -> WriteBehindQueue:
+    return _write_behind
@@ -1,6 +1,171 @@
-"""Soporte de diálogo adicional (placeholder ampliable)."""
+"""Memoria de conversación del chat por (usuario, ejercicio).
+
+El prompt de chat lleva un resumen incremental más los últimos turnos literales, de modo que
+su tamaño se mantiene acotado por larga que sea la sesión:
+- Turnos literales: los no resumidos aún (entre CHAT_MEMORY_RECENT_TURNS y
+  CHAT_MEMORY_RECENT_TURNS + CHAT_SUMMARY_EVERY_TURNS), en orden cronológico.
+- Resumen: se actualiza en segundo plano al acumularse CHAT_SUMMARY_EVERY_TURNS turnos fuera de
+  la ventana literal; incorpora esos turnos al resumen previo (LLM, o extractivo si no hay
+  modelo) y avanza `summarized_until`.
+- Persistencia en exercise_conversation_summaries (conversation_summaries.sql) con cache local;
+  sin la tabla, el resumen vive sólo en memoria del proceso.
+"""
 from __future__ import annotations
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+from ..core.cache import TTLCache
+from ..core.config import get_settings
+from ..db.database import Database, run_blocking
+
+settings = get_settings()
+logger = logging.getLogger("dialog")
+
+TURN_CHARS = 300  # Recorte por turno literal en el prompt
+_EPOCH = datetime.min.replace(tzinfo=timezone.utc)
+
+Summarizer = Callable[[str], Awaitable[Optional[str]]]
+
+@dataclass
+class DialogContext:
+    summary: str = ''
+    turns: List[Dict[str, Any]] = field(default_factory=list)  # cronológico (más antiguo primero)
+
+    def render_turns(self) -> str:
+        return "\n".join(f"[{d.get('type')}] {(d.get('content') or '')[:TURN_CHARS]}" for d in self.turns)
+
+def _ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def _unsummarized(rows: List[Dict[str, Any]], until: Optional[datetime]) -> List[Dict[str, Any]]:
+    if until is None:
+        return rows
+    return [r for r in rows if (_ts(r.get('created_at')) or until) > until]
+
+class ConversationMemory:
+    def __init__(self, db: Database, vs: Any, summarize: Summarizer) -> None:
+        self.db = db
+        self.vs = vs
+        self.summarize = summarize
+        self.recent_turns = max(1, settings.CHAT_MEMORY_RECENT_TURNS)
+        self.every = max(1, settings.CHAT_SUMMARY_EVERY_TURNS)
+        self.max_chars = settings.CHAT_SUMMARY_MAX_CHARS
+        self.enabled = settings.CHAT_SUMMARY_ENABLED
+        self._summaries: TTLCache[tuple[str, str], Dict[str, Any]] = TTLCache(maxsize=4096, ttl=settings.CHAT_SUMMARY_CACHE_TTL_SECONDS)
+        self._tasks: Dict[tuple[str, str], asyncio.Task] = {}
+        self.summaries_built = 0
+
+    async def _state(self, user_id: str, exercise_id: str, *, refresh: bool = False) -> Dict[str, Any]:
+        """Resumen vigente; con refresh se relee de la base aunque haya uno en cache.
+
+        La ausencia de resumen no se cachea: otro worker puede guardarlo en cualquier momento.
+        Entre el cache local y la fila guardada gana el que resume más turnos (el local puede ser
+        más nuevo si su escritura falló).
+        """
+        key = (user_id, exercise_id)
+        cached = self._summaries.get(key)
+        if cached is not None and not refresh:
+            return cached
+        stored = await self.db.get_conversation_summary(user_id, exercise_id)
+        if not stored:
+            return cached or {}
+        if cached and (_ts(cached.get('summarized_until')) or _EPOCH) > (_ts(stored.get('summarized_until')) or _EPOCH):
+            return cached
+        self._summaries.set(key, stored)
+        return stored
+
+    async def context(self, *, user_id: str, exercise_id: str) -> DialogContext:
+        """Resumen + turnos no resumidos (un round trip para los turnos, el resumen suele estar en cache)."""
+        if not self.enabled:
+            rows = await run_blocking(self.vs.recent, user_id=user_id, exercise_id=exercise_id, limit=self.recent_turns)
+            return DialogContext(turns=list(reversed(rows)))
+        window = self.recent_turns + self.every
+        state, rows = await asyncio.gather(
+            self._state(user_id, exercise_id),
+            run_blocking(self.vs.recent, user_id=user_id, exercise_id=exercise_id, limit=window),
+        )
+        pending = _unsummarized(rows, _ts(state.get('summarized_until')))
+        if len(pending) >= window:
+            self._schedule(user_id, exercise_id)
+        return DialogContext(summary=state.get('summary') or '', turns=list(reversed(pending)))
+
+    def _schedule(self, user_id: str, exercise_id: str) -> None:
+        key = (user_id, exercise_id)
+        if key in self._tasks:
+            return
+        task = asyncio.get_running_loop().create_task(self._update(user_id, exercise_id))
+        self._tasks[key] = task
+        task.add_done_callback(lambda t, k=key: self._done(k, t))
+
+    def _done(self, key: tuple[str, str], task: asyncio.Task) -> None:
+        self._tasks.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Fallo actualizando resumen de conversación %s: %s", key, task.exception())
+
+    async def _update(self, user_id: str, exercise_id: str) -> None:
+        """Incorpora al resumen los turnos no resumidos que quedaron fuera de la ventana literal."""
+        # Releer antes de decidir: otro worker pudo haber resumido estos turnos
+        state = await self._state(user_id, exercise_id, refresh=True)
+        rows = await run_blocking(self.vs.recent, user_id=user_id, exercise_id=exercise_id, limit=self.recent_turns + 2 * self.every)
+        pending = _unsummarized(rows, _ts(state.get('summarized_until')))
+        fold = list(reversed(pending[self.recent_turns:]))
+        if not fold:
+            return
+        previous = state.get('summary') or ''
+        summary = await self.summarize(self._summary_prompt(previous, fold))
+        if summary:
+            summary = summary.strip()[: self.max_chars]
+        else:
+            summary = self._extractive(previous, fold)
+        new_state = {
+            'user_id': user_id,
+            'exercise_id': exercise_id,
+            'summary': summary,
+            'summarized_until': fold[-1].get('created_at'),
+            'turns_summarized': int(state.get('turns_summarized') or 0) + len(fold),
+            'updated_at': datetime.now(timezone.utc).isoformat(),
+        }
+        self._summaries.set((user_id, exercise_id), new_state)
+        self.summaries_built += 1
+        await self.db.upsert_conversation_summary(new_state)
+
+    def _summary_prompt(self, previous: str, turns: List[Dict[str, Any]]) -> str:
+        lines = "\n".join(f"[{d.get('type')}] {(d.get('content') or '')[:500]}" for d in turns)
+        return (
+            "Actualiza el resumen de una conversación de tutoría sobre un ejercicio técnico.\n"
+            f"Máximo {self.max_chars} caracteres, en español, en viñetas breves.\n"
+            "Conserva: dudas del estudiante, errores recurrentes, conceptos ya explicados y acuerdos.\n"
+            "Omite saludos y detalles irrelevantes. No inventes nada que no esté en los turnos.\n\n"
+            f"Resumen previo:\n{previous or '(vacío)'}\n\n"
+            f"Nuevos turnos (orden cronológico):\n{lines}\n\n"
+            "Resumen actualizado:"
+        )
+
+    def _extractive(self, previous: str, turns: List[Dict[str, Any]]) -> str:
+        # Sin modelo disponible: una línea por turno, conservando lo más reciente dentro del límite
+        lines = [l for l in previous.splitlines() if l.strip()]
+        lines += [f"- [{d.get('type')}] {(d.get('content') or '')[:120]}" for d in turns]
+        out: List[str] = []
+        used = 0
+        for line in reversed(lines):
+            if used + len(line) + 1 > self.max_chars:
+                break
+            out.append(line)
+            used += len(line) + 1
+        return "\n".join(reversed(out))
 
-# Actualmente la lógica principal de chat está en FeedbackService.chat.
-# Este módulo quedaría para futuras extensiones (p.ej. clasificación de intención,
-# control de sesión, políticas de moderación, etc.)
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'cached_summaries': len(self._summaries),
+            'updates_in_flight': len(self._tasks),
+            'summaries_built': self.summaries_built,
+        }
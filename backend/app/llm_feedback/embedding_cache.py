@@ -0,0 +1,120 @@
+"""Cache de embeddings direccionado por contenido.
+
+- Clave: sha256(model, dim, texto); estable entre procesos y reinicios (a diferencia de hash()).
+- Nivel memoria: LRU por proceso delante del disco.
+- Nivel disco: SQLite en modo WAL (EMBEDDING_CACHE_PATH), compartido por todos los workers
+  de uvicorn en el host. Vectores guardados como float32.
+- Contadores de hits (memoria/disco) y misses, expuestos en /llm/status.
+
+embed_text se ejecuta en el pool de hilos (run_blocking), por eso el nivel memoria usa un lock
+y cada hilo abre su propia conexión SQLite.
+"""
+from __future__ import annotations
+from typing import Any, Dict, Optional
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import numpy as np
+from ..core.cache import TTLCache
+from ..core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger("embedding_cache")
+
+class EmbeddingCache:
+    def __init__(self, path: str | None, memory_items: int) -> None:
+        self.path = path or None
+        self._memory: TTLCache[str, np.ndarray] = TTLCache(maxsize=memory_items)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.path:
+            try:
+                self._init_db()
+            except Exception as e:
+                logger.warning("Cache de embeddings en disco deshabilitado (%s): %s", self.path, e)
+                self.path = None
+
+    @staticmethod
+    def key(model: str, dim: int, text: str) -> str:
+        h = hashlib.sha256()
+        h.update(f"{model}\0{dim}\0".encode('utf-8'))
+        h.update(text.encode('utf-8'))
+        return h.hexdigest()
+
+    def _init_db(self) -> None:
+        directory = os.path.dirname(self.path or '')
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path or ':memory:', timeout=5.0)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            v = self._memory.get(key)
+            if v is not None:
+                self.memory_hits += 1
+                return v
+        if self.path:
+            try:
+                row = self._conn().execute("SELECT dim, vec FROM embeddings WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("Lectura de cache de embeddings falló: %s", e)
+                row = None
+            if row is not None:
+                v = np.frombuffer(row[1], dtype=np.float32)
+                if v.shape == (row[0],):
+                    with self._lock:
+                        self._memory.set(key, v)
+                        self.disk_hits += 1
+                    return v
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, vec: np.ndarray, *, persist: bool = True) -> np.ndarray:
+        v = np.ascontiguousarray(vec, dtype=np.float32)
+        v.flags.writeable = False  # compartido entre llamadas: nadie debe mutarlo
+        with self._lock:
+            self._memory.set(key, v)
+        if persist and self.path:
+            try:
+                conn = self._conn()
+                conn.execute("INSERT OR IGNORE INTO embeddings (key, dim, vec) VALUES (?, ?, ?)", (key, int(v.shape[0]), v.tobytes()))
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning("Escritura de cache de embeddings falló: %s", e)
+        return v
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_items': len(self._memory),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None,
+            'disk_path': self.path,
+        }
+
+_embedding_cache: EmbeddingCache | None = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache(settings.EMBEDDING_CACHE_PATH, settings.EMBEDDING_CACHE_MEMORY_ITEMS)
+    return _embedding_cache
@@ -0,0 +1,79 @@
+"""Cache opt-in de feedback por respuesta exacta (exercises.enable_feedback_cache).
+
+Clave: (exercise_id, generación del ejercicio, huella del ejercicio, respuesta normalizada,
+PROMPT_TEMPLATE_VERSION, modelo). La respuesta se normaliza sólo en espacios (los comandos
+distinguen mayúsculas). Editar el ejercicio lo invalida por dos vías:
+- La huella cambia con el contenido (cubre también a otros workers, vía cache de catálogo).
+- invalidate_exercise() incrementa la generación local (lo llama la ruta de edición).
+
+Un hit reutiliza el feedback ya generado: no se arma contexto ni se invoca el LLM, por eso el
+feedback deja de ser personalizado (historial, similaridad); de ahí que sea opt-in.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+import hashlib
+import re
+from ..core.cache import TTLCache
+from ..core.config import get_settings
+from .prompt_builder import PROMPT_TEMPLATE_VERSION
+
+settings = get_settings()
+
+# Campos que alimentan el prompt: si cambian, el feedback cacheado deja de ser válido
+_FINGERPRINT_FIELDS = ('title', 'type', 'content_html', 'expected_answer', 'ai_context', 'difficulty', 'guide_id')
+_WS_RE = re.compile(r'[ \t]+')
+
+@dataclass(frozen=True)
+class CachedFeedback:
+    prompt: str
+    content_md: str
+
+def normalize_answer(answer: str) -> str:
+    lines = [_WS_RE.sub(' ', line).strip() for line in (answer or '').strip().splitlines()]
+    return '\n'.join(line for line in lines if line)
+
+def exercise_fingerprint(exercise: Dict[str, Any]) -> str:
+    h = hashlib.sha256()
+    for field in _FINGERPRINT_FIELDS:
+        h.update(f"{field}={exercise.get(field)!r}\0".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+class FeedbackCache:
+    def __init__(self, *, maxsize: int, ttl: float) -> None:
+        self._entries: TTLCache[str, CachedFeedback] = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, exercise: Dict[str, Any], answer: str, model: str) -> str:
+        exercise_id = str(exercise.get('id'))
+        h = hashlib.sha256()
+        for part in (exercise_id, str(self._generations.get(exercise_id, 0)), exercise_fingerprint(exercise),
+                     str(PROMPT_TEMPLATE_VERSION), model, normalize_answer(answer)):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[CachedFeedback]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key: str, prompt: str, content_md: str) -> None:
+        self._entries.set(key, CachedFeedback(prompt=prompt, content_md=content_md))
+
+    def invalidate_exercise(self, exercise_id: str) -> None:
+        # Las entradas anteriores quedan inalcanzables y salen por LRU/TTL
+        self._generations[exercise_id] = self._generations.get(exercise_id, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+_feedback_cache = FeedbackCache(maxsize=settings.FEEDBACK_CACHE_MAX_ITEMS, ttl=settings.FEEDBACK_CACHE_TTL_SECONDS)
+
+def get_feedback_cache() -> FeedbackCache:
+    return _feedback_cache
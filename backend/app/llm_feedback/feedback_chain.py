@@ -2,16 +2,23 @@
 
 Diseñada para ser intercambiable de modelo (Gemini por defecto)."""
 from __future__ import annotations
-from typing import Optional, Dict, Any, Sequence
+from typing import Optional, Dict, Any, Sequence, AsyncIterator
+import asyncio
+import hashlib
 import time
 import os
 
-from ..db.database import Database
+from ..db.database import Database, run_blocking
+from ..db.loader import RequestLoader
+from ..db.write_behind import get_write_behind
 from ..core.config import get_settings
-from .prompt_builder import build_feedback_prompt, MAX_PROMPT_CHARS
-from .postprocess import normalize_output, basic_quality_flags, sanitize_references
+from ..core.tracing import span, stages_ms
+from .prompt_builder import build_feedback_prompt, MAX_PROMPT_CHARS, TRUNCATION_MARKER, SIMILARITY_HEADER
+from .postprocess import normalize_output, basic_quality_flags, sanitize_references, StreamingPostprocessor
 from .metrics import get_metrics_collector, approximate_token_count
-from .vector_store import get_vector_store
+from .vector_store import get_vector_store, next_created_at
+from .feedback_cache import get_feedback_cache, CachedFeedback
+from .dialog_chain import ConversationMemory
 from langchain_google_genai import ChatGoogleGenerativeAI  # type: ignore
 import logging
 import warnings
@@ -20,11 +27,32 @@ logger = logging.getLogger("llm")
 
 settings = get_settings()
 
+STUB_RESPONSE = ("Retroalimentación (modo stub sin modelo):\n"
+    "- No se evaluó ejecución real.\n"
+    "- Aporta más detalle si buscas análisis profundo.\n"
+    "- (Fin del feedback)")
+ERROR_RESPONSE_PREFIX = "Respuesta no disponible por error interno"
+
+# Límite global de invocaciones LLM simultáneas por worker (se enlaza al loop en el primer uso)
+_llm_semaphore = asyncio.Semaphore(max(1, settings.LLM_MAX_CONCURRENCY))
+
 # Abstracción mínima de cliente LLM. Se puede extender.
 class LangChainLLMWrapper:
-    def __init__(self, model: str, temperature: float) -> None:
+    def __init__(self, model: str, temperature: float, chain: Any | None = None) -> None:
         api_key = settings.GOOGLE_API_KEY
-        if not api_key:
+        self._timeouts = 0
+        # Single-flight: hash del prompt -> task compartido por las llamadas concurrentes idénticas
+        self._inflight: Dict[str, asyncio.Task[str]] = {}
+        self._coalesced = 0
+        if chain is not None:
+            # Modelo inyectado (p.ej. un chat model falso de langchain_core para pruebas locales)
+            self._chain = chain
+            self.model = model
+            self.temperature = temperature
+            self._lazy_attempts = 0
+            self._last_lazy_error = None
+            self._last_lazy_time = None
+        elif not api_key:
             self._chain = None
             self.model = model
             self.temperature = temperature
@@ -100,10 +128,7 @@ class LangChainLLMWrapper:
             self._try_lazy_init()
             if not self._chain:
                 logger.error("Invocación LLM en modo STUB. Devuelvo respuesta placeholder. Modelo=%s", self.model)
-                return ("Retroalimentación (modo stub sin modelo):\n"
-                    "- No se evaluó ejecución real.\n"
-                    "- Aporta más detalle si buscas análisis profundo.\n"
-                    "- (Fin del feedback)")
+                return STUB_RESPONSE
         
         try:
             resp = self._chain.invoke(prompt)
@@ -114,6 +139,115 @@ class LangChainLLMWrapper:
             logger.exception("Error ejecutando LLM model=%s: %s", self.model, e)
             return ("Respuesta no disponible por error interno: {error}. Intenta nuevamente y aporta contexto puntual si puedes.").format(error=e)
 
+    async def agenerate(self, prompt: str) -> str:
+        """Versión asíncrona de generate (ainvoke) para el camino de requests.
+
+        - Concurrencia acotada globalmente por LLM_MAX_CONCURRENCY.
+        - Deadline duro LLM_TIMEOUT_SECONDS (incluye la espera en cola); al vencer devuelve STUB_RESPONSE.
+        - Prompts idénticos concurrentes comparten una llamada (ver agenerate_shared).
+        """
+        text, _ = await self.agenerate_shared(prompt)
+        return text
+
+    async def agenerate_shared(self, prompt: str) -> tuple[str, bool]:
+        """agenerate con single-flight: devuelve (texto, coalesced).
+
+        Si ya hay una llamada en vuelo con el mismo prompt (y modelo) se espera su resultado en
+        lugar de invocar otra vez al proveedor; coalesced=True indica que se reutilizó. El task
+        compartido se protege con shield: si un llamador se cancela (cliente desconectado) los
+        demás siguen esperando la misma respuesta.
+        """
+        if not self._chain:
+            self._try_lazy_init()
+            if not self._chain:
+                logger.error("Invocación LLM en modo STUB. Devuelvo respuesta placeholder. Modelo=%s", self.model)
+                return STUB_RESPONSE, False
+        if not settings.LLM_COALESCE_ENABLED:
+            return await self._ainvoke(prompt), False
+        key = hashlib.sha256(f"{self.model}\0{self.temperature}\0{prompt}".encode('utf-8')).hexdigest()
+        task = self._inflight.get(key)
+        coalesced = task is not None
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._ainvoke(prompt))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t, k=key: self._inflight.pop(k, None))
+        else:
+            self._coalesced += 1
+        return await asyncio.shield(task), coalesced
+
+    async def _ainvoke(self, prompt: str) -> str:
+        chain = self._chain
+        if chain is None:
+            return STUB_RESPONSE
+
+        async def _invoke() -> Any:
+            async with _llm_semaphore:
+                return await chain.ainvoke(prompt)
+
+        try:
+            resp = await asyncio.wait_for(_invoke(), timeout=settings.LLM_TIMEOUT_SECONDS)
+            if hasattr(resp, 'content'):
+                return resp.content  # type: ignore[attr-defined]
+            return str(resp)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            logger.error("Timeout LLM (%.1fs) model=%s. Devuelvo respuesta placeholder.", settings.LLM_TIMEOUT_SECONDS, self.model)
+            return STUB_RESPONSE
+        except Exception as e:
+            logger.exception("Error ejecutando LLM model=%s: %s", self.model, e)
+            return ("Respuesta no disponible por error interno: {error}. Intenta nuevamente y aporta contexto puntual si puedes.").format(error=e)
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        """Streaming de tokens (astream) con el mismo límite de concurrencia y deadline que agenerate.
+
+        Si el deadline vence antes del primer fragmento se emite STUB_RESPONSE; si vence a mitad
+        de respuesta se corta el stream con lo ya emitido.
+        """
+        if not self._chain:
+            self._try_lazy_init()
+            if not self._chain:
+                logger.error("Invocación LLM en modo STUB. Devuelvo respuesta placeholder. Modelo=%s", self.model)
+                yield STUB_RESPONSE
+                return
+        chain = self._chain
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.LLM_TIMEOUT_SECONDS
+        emitted = False
+        acquired = False
+        stream = None
+        try:
+            await asyncio.wait_for(_llm_semaphore.acquire(), timeout=max(0.0, deadline - loop.time()))
+            acquired = True
+            stream = chain.astream(prompt).__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=max(0.0, deadline - loop.time()))
+                except StopAsyncIteration:
+                    break
+                text = chunk.content if hasattr(chunk, 'content') else chunk
+                if not isinstance(text, str):
+                    text = str(text)
+                if text:
+                    emitted = True
+                    yield text
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            logger.error("Timeout LLM streaming (%.1fs) model=%s emitido=%s", settings.LLM_TIMEOUT_SECONDS, self.model, emitted)
+            if not emitted:
+                yield STUB_RESPONSE
+        except Exception as e:
+            logger.exception("Error ejecutando LLM (stream) model=%s: %s", self.model, e)
+            if not emitted:
+                yield ("Respuesta no disponible por error interno: {error}. Intenta nuevamente y aporta contexto puntual si puedes.").format(error=e)
+        finally:
+            if stream is not None and hasattr(stream, 'aclose'):
+                try:
+                    await stream.aclose()
+                except Exception:
+                    pass
+            if acquired:
+                _llm_semaphore.release()
+
 _llm_wrapper = LangChainLLMWrapper(settings.LLM_MODEL, settings.LLM_TEMPERATURE)
 
 def get_llm_client() -> LangChainLLMWrapper:
@@ -124,71 +258,110 @@ class FeedbackService:
         self.db = db
         self.llm = llm_client or get_llm_client()
         self.vs = get_vector_store()
+        self.cache = get_feedback_cache()
+        self.memory = ConversationMemory(db, self.vs, self._summary_text)
+        self.writes = get_write_behind()
+        self.writes.register('vectors', self._write_vectors)
+        self.writes.register('llm_metrics', self.db.create_llm_metrics)
+
+    async def _write_vectors(self, entries: list[Dict[str, Any]]) -> None:
+        await run_blocking(self.vs.add_many, entries)
+
+    async def _persist(self, *, vectors: list[Dict[str, Any]], metric: Dict[str, Any]) -> None:
+        """Vectores y llm_metrics no forman parte de la respuesta: van a la cola write-behind.
+        Si la cola no los acepta (llena o detenida) se escriben en línea como antes."""
+        # created_at al encolar: el orden de los turnos no depende de cuándo se vacía la cola
+        for entry in vectors:
+            entry.setdefault('created_at', next_created_at())
+        with span('vector_insert'):
+            if not self.writes.enqueue('vectors', vectors):
+                await self._write_vectors(vectors)
+        with span('metric_insert'):
+            if not self.writes.enqueue('llm_metrics', [metric]):
+                try:
+                    await self.db.create_llm_metric(metric)
+                except Exception:
+                    pass
 
-    async def generate_feedback(self, *, user_id: str, exercise_id: str, submitted_answer: str) -> Dict[str, Any]:
-        exercise = await self.db.get_exercise(exercise_id)
+    async def _exercise_and_guide(self, exercise_id: str, loader: RequestLoader) -> tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        # La guía depende del ejercicio: se encadena dentro de la misma corrutina.
+        # El loader del request evita releer el ejercicio que el handler ya validó.
+        exercise = await loader.get_exercise(exercise_id)
+        if not exercise or not exercise.get('guide_id'):
+            return exercise, None
+        return exercise, await loader.get_guide(exercise['guide_id'])
+
+    async def _similar_items(self, *, user_id: str, exercise_id: str, query_text: str, limit: int) -> list[Dict[str, Any]]:
+        if not settings.SIMILARITY_ENABLED or not query_text or not hasattr(self.vs, 'similar'):
+            return []
+        try:
+            with span('similarity'):
+                return await run_blocking(self.vs.similar, user_id=user_id, exercise_id=exercise_id, query_text=query_text, limit=limit)
+        except Exception as e:
+            logger.warning(f"Fallo al recuperar similitud: {e}")
+            return []
+
+    async def _prepare_feedback(self, *, user_id: str, exercise_id: str, submitted_answer: str, loader: RequestLoader) -> str:
+        """Reúne contexto y construye el prompt de feedback (compartido por la versión normal y streaming)."""
+        # Lecturas independientes en paralelo (~1 round trip en lugar de 6); 'similarity' se solapa con 'context'
+        with span('context'):
+            (exercise, guide), past_attempts, previous_feedback, recent_dialog, similar_items = await asyncio.gather(
+                self._exercise_and_guide(exercise_id, loader),
+                self.db.list_attempts(exercise_id, user_id=user_id),
+                self.db.get_last_feedback(exercise_id, user_id),
+                run_blocking(self.vs.recent, user_id=user_id, exercise_id=exercise_id, limit=20),
+                self._similar_items(user_id=user_id, exercise_id=exercise_id, query_text=submitted_answer, limit=settings.SIMILARITY_TOP_K),
+            )
         if not exercise:
             raise ValueError("Ejercicio no encontrado")
-        guide = await self.db.get_guide(exercise.get('guide_id')) if exercise.get('guide_id') else None
-        past_attempts = await self.db.list_attempts(exercise_id, user_id=user_id)
-        previous_feedback = await self.db.get_last_feedback(exercise_id, user_id)
-        recent_dialog = self.vs.recent(user_id=user_id, exercise_id=exercise_id, limit=20)
+        if not submitted_answer:
+            # Sin respuesta no hay query útil: usar el título del ejercicio
+            similar_items = await self._similar_items(user_id=user_id, exercise_id=exercise_id, query_text=exercise.get('title') or '', limit=settings.SIMILARITY_TOP_K)
 
         # (Lógica de reutilización eliminada a petición del usuario)
+        # recent devuelve desc; el prompt espera orden cronológico (últimos = más recientes)
+        recent_dialog = list(reversed(recent_dialog))
 
-        prompt = build_feedback_prompt(
-            guide=guide,
-            exercise=exercise,
-            attempts=past_attempts,
-            previous_feedback=previous_feedback,
-            previous_dialog=recent_dialog,
-            user_answer=submitted_answer,
-        )
+        # La similaridad es una sección más del presupuesto del prompt (menor prioridad)
+        with span('prompt'):
+            return build_feedback_prompt(
+                guide=guide,
+                exercise=exercise,
+                attempts=past_attempts,
+                previous_feedback=previous_feedback,
+                previous_dialog=recent_dialog,
+                user_answer=submitted_answer,
+                similar_items=similar_items,
+            )
 
-        # Similaridad (enriquecer)
-        if settings.SIMILARITY_ENABLED:
-            try:
-                similar_items = []
-                if hasattr(self.vs, 'similar'):
-                    similar_items = self.vs.similar(
-                        user_id=user_id,
-                        exercise_id=exercise_id,
-                        query_text=submitted_answer or (exercise.get('title') or ''),
-                        limit=settings.SIMILARITY_TOP_K,
-                    )
-                if similar_items:
-                    lines = []
-                    for it in similar_items:
-                        c = it.get('content') or it.get('submitted_answer') or ''
-                        if not c:
-                            continue
-                        s = it.get('score_hybrid') or it.get('score') or it.get('score_cosine')
-                        if isinstance(s, (int, float)):
-                            s_txt = f"{s:.2f}"
-                        else:
-                            s_txt = '?'
-                        lines.append(f"[Relacionado score={s_txt}] {c[:300]}")
-                    block = "\n".join(lines)
-                    augmented = prompt + "\n\n--- CONTEXTO RELACIONADO (similaridad) ---\n" + block + "\n--- FIN CONTEXTO RELACIONADO ---\n"
-                    if len(augmented) <= int(MAX_PROMPT_CHARS * 1.18):
-                        prompt = augmented
-            except Exception as e:
-                logger.warning(f"Fallo al enriquecer con similitud: {e}")
+    async def _cached_feedback(self, *, exercise_id: str, submitted_answer: str, loader: RequestLoader) -> tuple[Optional[str], Optional[CachedFeedback]]:
+        """(clave, entrada) del cache de feedback; clave None si el ejercicio no lo habilita."""
+        exercise = await loader.get_exercise(exercise_id)
+        if not exercise or not exercise.get('enable_feedback_cache'):
+            return None, None
+        key = self.cache.key(exercise, submitted_answer, self.llm.model)
+        return key, self.cache.get(key)
 
-        start = time.time()
-        raw = self.llm.generate(prompt)
-        processed = normalize_output(raw)
-        # Saneamos por precaución, pero no registramos flag específico
-        processed, _ = sanitize_references(processed)
+    @staticmethod
+    def _cacheable(raw: str) -> bool:
+        # Nunca cachear stub, timeouts ni errores
+        return bool(raw) and raw != STUB_RESPONSE and not raw.startswith(ERROR_RESPONSE_PREFIX)
+
+    async def _finalize_feedback(self, *, user_id: str, exercise_id: str, submitted_answer: str, prompt: str, processed: str, start: float, cache_hit: bool = False, coalesced: bool = False) -> Dict[str, Any]:
+        """Calcula métricas y persiste intento, memoria vectorial y llm_metrics (por llamador,
+        también cuando la respuesta se compartió con otra llamada en vuelo)."""
         quality = basic_quality_flags(processed)
+        quality['cache_hit'] = cache_hit
+        quality['coalesced'] = coalesced
         # Añadimos flags enriquecidos
-        quality['similarity_used'] = '--- CONTEXTO RELACIONADO (similaridad) ---' in prompt
-        quality['truncated'] = len(prompt) > MAX_PROMPT_CHARS
+        quality['similarity_used'] = SIMILARITY_HEADER in prompt
+        quality['truncated'] = TRUNCATION_MARKER in prompt
         quality['stub_mode'] = self.llm._chain is None
         quality['specialization_applied'] = 'Contexto pedagógico específico:' in prompt
         # Conteo aproximado de tokens (palabras + signos)
         prompt_tokens = approximate_token_count(prompt)
         completion_tokens = approximate_token_count(processed)
+        # Un hit de cache no llama al modelo: su propio tipo para no sesgar latencia/tokens del LLM
         metrics = get_metrics_collector().record(
             model=self.llm.model,
             prompt_tokens=prompt_tokens,
@@ -196,6 +369,7 @@ class FeedbackService:
             start_time=start,
             quality_flags=quality,
             output_text=processed,
+            kind='feedback_cache' if cache_hit else 'feedback',
         )
 
         # Almacenar intento y feedback
@@ -208,26 +382,27 @@ class FeedbackService:
             'llm_feedback': processed,
             'completed': False,
         }
-        created = await self.db.create_attempt(attempt_data)
-
-        # Guardar en memoria vectorial
-        self.vs.add(user_id=user_id, exercise_id=exercise_id, attempt_id=created['id'], type_='attempt', content=submitted_answer)
-        self.vs.add(user_id=user_id, exercise_id=exercise_id, attempt_id=created['id'], type_='feedback', content=processed)
+        with span('attempt_insert'):
+            created = await self.db.create_attempt(attempt_data)
+        # Desglose por etapa (Server-Timing); las inserciones diferidas no llegan a incluirse
+        stages = stages_ms()
+        if stages is not None:
+            quality['stages_ms'] = stages
 
-        # Persist metrics
-        try:
-            await self.db.create_llm_metric({
-                'user_id': user_id,
-                'exercise_id': exercise_id,
-                'attempt_id': created['id'],
-                'model': self.llm.model,
-                'prompt_tokens': prompt_tokens,
-                'completion_tokens': completion_tokens,
-                'latency_ms': metrics.latency_ms,
-                'quality_flags': quality,
-            })
-        except Exception:
-            pass
+        # Memoria vectorial + métricas (write-behind)
+        await self._persist(vectors=[
+            {'user_id': user_id, 'exercise_id': exercise_id, 'attempt_id': created['id'], 'type': 'attempt', 'content': submitted_answer},
+            {'user_id': user_id, 'exercise_id': exercise_id, 'attempt_id': created['id'], 'type': 'feedback', 'content': processed},
+        ], metric={
+            'user_id': user_id,
+            'exercise_id': exercise_id,
+            'attempt_id': created['id'],
+            'model': self.llm.model,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'latency_ms': metrics.latency_ms,
+            'quality_flags': quality,
+        })
 
         return {
             'attempt_id': created['id'],
@@ -235,13 +410,76 @@ class FeedbackService:
             'metrics': metrics.to_dict(),
         }
 
-    async def chat(self, *, user_id: str, exercise_id: str, message: str) -> Dict[str, Any]:
-        exercise = await self.db.get_exercise(exercise_id)
+    async def generate_feedback(self, *, user_id: str, exercise_id: str, submitted_answer: str, loader: RequestLoader | None = None) -> Dict[str, Any]:
+        loader = loader or RequestLoader(self.db)
+        cache_key, cached = await self._cached_feedback(exercise_id=exercise_id, submitted_answer=submitted_answer, loader=loader)
+        if cached is not None:
+            return await self._finalize_feedback(user_id=user_id, exercise_id=exercise_id, submitted_answer=submitted_answer, prompt=cached.prompt, processed=cached.content_md, start=time.time(), cache_hit=True)
+        prompt = await self._prepare_feedback(user_id=user_id, exercise_id=exercise_id, submitted_answer=submitted_answer, loader=loader)
+        start = time.time()
+        with span('llm'):
+            raw, coalesced = await self.llm.agenerate_shared(prompt)
+        with span('postprocess'):
+            processed = normalize_output(raw)
+            # Saneamos por precaución, pero no registramos flag específico
+            processed, _ = sanitize_references(processed)
+        if cache_key is not None and self._cacheable(raw):
+            self.cache.set(cache_key, prompt, processed)
+        return await self._finalize_feedback(user_id=user_id, exercise_id=exercise_id, submitted_answer=submitted_answer, prompt=prompt, processed=processed, start=start, coalesced=coalesced)
+
+    async def stream_feedback(self, *, user_id: str, exercise_id: str, submitted_answer: str, loader: RequestLoader | None = None) -> AsyncIterator[Dict[str, Any]]:
+        """Igual que generate_feedback pero emite eventos a medida que llegan tokens del LLM.
+
+        Eventos: {'type': 'delta', 'content'} con texto ya saneado y, al completar el stream
+        (tras persistir intento, vectores y métricas), {'type': 'done', 'attempt_id', 'metrics'}.
+        Un hit del cache de feedback se emite como un único delta. El stream no puebla el cache
+        (un deadline a mitad de respuesta deja texto truncado).
+        Cache, contexto y prompt se resuelven al esperar esta corrutina, antes de abrir la respuesta
+        (así Server-Timing los incluye); el iterador devuelto sólo corre el LLM y la persistencia.
+        """
+        loader = loader or RequestLoader(self.db)
+        _, cached = await self._cached_feedback(exercise_id=exercise_id, submitted_answer=submitted_answer, loader=loader)
+        if cached is not None:
+            return self._cached_feedback_events(user_id=user_id, exercise_id=exercise_id, submitted_answer=submitted_answer, cached=cached)
+        prompt = await self._prepare_feedback(user_id=user_id, exercise_id=exercise_id, submitted_answer=submitted_answer, loader=loader)
+        return self._feedback_events(user_id=user_id, exercise_id=exercise_id, submitted_answer=submitted_answer, prompt=prompt)
+
+    async def _cached_feedback_events(self, *, user_id: str, exercise_id: str, submitted_answer: str, cached: CachedFeedback) -> AsyncIterator[Dict[str, Any]]:
+        yield {'type': 'delta', 'content': cached.content_md}
+        result = await self._finalize_feedback(user_id=user_id, exercise_id=exercise_id, submitted_answer=submitted_answer, prompt=cached.prompt, processed=cached.content_md, start=time.time(), cache_hit=True)
+        yield {'type': 'done', 'attempt_id': result['attempt_id'], 'metrics': result['metrics']}
+
+    async def _feedback_events(self, *, user_id: str, exercise_id: str, submitted_answer: str, prompt: str) -> AsyncIterator[Dict[str, Any]]:
+        start = time.time()
+        post = StreamingPostprocessor()
+        # En streaming 'llm' incluye el postproceso incremental y el envío de cada fragmento
+        with span('llm'):
+            async for chunk in self.llm.astream(prompt):
+                out = post.feed(chunk)
+                if out:
+                    yield {'type': 'delta', 'content': out}
+            tail = post.flush()
+        if tail:
+            yield {'type': 'delta', 'content': tail}
+        result = await self._finalize_feedback(user_id=user_id, exercise_id=exercise_id, submitted_answer=submitted_answer, prompt=prompt, processed=post.text, start=start)
+        yield {'type': 'done', 'attempt_id': result['attempt_id'], 'metrics': result['metrics']}
+
+    async def _summary_text(self, prompt: str) -> Optional[str]:
+        """Resumen de conversación vía LLM; None si no hay modelo o falló (la memoria usa el extractivo)."""
+        raw = await self.llm.agenerate(prompt)
+        return normalize_output(raw) if self._cacheable(raw) else None
+
+    async def _prepare_chat(self, *, user_id: str, exercise_id: str, message: str, loader: RequestLoader) -> str:
+        with span('context'):
+            (exercise, guide), dialog, similar_items = await asyncio.gather(
+                self._exercise_and_guide(exercise_id, loader),
+                self.memory.context(user_id=user_id, exercise_id=exercise_id),
+                self._similar_items(user_id=user_id, exercise_id=exercise_id, query_text=message, limit=max(1, settings.SIMILARITY_TOP_K - 1)),
+            )
         if not exercise:
             raise ValueError("Ejercicio no encontrado")
-        recent_dialog = self.vs.recent(user_id=user_id, exercise_id=exercise_id, limit=30)
-        history_concat = "\n".join(f"[{d['type']}] {d['content'][:300]}" for d in reversed(recent_dialog[-12:]))
-        guide = await self.db.get_guide(exercise.get('guide_id')) if exercise.get('guide_id') else None
+        history_concat = dialog.render_turns() or "(Sin turnos previos)"
+        summary_block = f"Resumen de la conversación previa:\n{dialog.summary}\n" if dialog.summary else ""
         guide_title = guide.get('title') if guide else '(Sin guía)'
         guide_topic = guide.get('topic') if guide else '(Sin tema)'
         # Prompt con control de tema: si la pregunta se desvía totalmente, debe redirigir.
@@ -249,7 +487,8 @@ class FeedbackService:
             "Eres un asistente educativo en español. Mantente ENFOCADO estrictamente en la temática de la guía y el ejercicio.\n"
             f"Guía: {guide_title} | Tema: {guide_topic} | Ejercicio: {exercise.get('title')} (tipo={exercise.get('type')})\n"
             "Si el usuario pregunta algo totalmente ajeno (ej. chistes, política, clima, temas personales, tecnología no relacionada), NO respondas el contenido ajeno: responde educadamente que seguirán enfocados en la guía y su temática.\n"
-            "Historial (resumido, últimos turnos inversos):\n"
+            f"{summary_block}"
+            "Últimos turnos (orden cronológico):\n"
             f"{history_concat}\n\n"
             f"Mensaje del usuario: {message}\n"
             "Instrucciones de respuesta:\n"
@@ -260,59 +499,78 @@ class FeedbackService:
             "- Formato Markdown claro (puedes usar listas concisas)."
         )
         # Similaridad para chat
-        if settings.SIMILARITY_ENABLED:
-            try:
-                similar_items = []
-                if hasattr(self.vs, 'similar'):
-                    similar_items = self.vs.similar(
-                        user_id=user_id,
-                        exercise_id=exercise_id,
-                        query_text=message,
-                        limit=max(1, settings.SIMILARITY_TOP_K - 1),
-                    )
-                if similar_items:
-                    lines = []
-                    for it in similar_items:
-                        c = it.get('content') or ''
-                        if not c:
-                            continue
-                        lines.append(c[:250])
-                    block = "\n".join(lines)
-                    augmented = prompt + "\n\nContextoRelacionado:\n" + block
-                    if len(augmented) < int(MAX_PROMPT_CHARS * 0.5):
-                        prompt = augmented
-            except Exception as e:
-                logger.warning(f"Fallo similitud en chat: {e}")
-        start = time.time()
-        raw = self.llm.generate(prompt)
-        processed = normalize_output(raw)
-        processed, _ = sanitize_references(processed)
+        if similar_items:
+            lines = []
+            for it in similar_items:
+                c = it.get('content') or ''
+                if not c:
+                    continue
+                lines.append(c[:250])
+            block = "\n".join(lines)
+            augmented = prompt + "\n\nContextoRelacionado:\n" + block
+            if len(augmented) < int(MAX_PROMPT_CHARS * 0.5):
+                prompt = augmented
+        return prompt
+
+    async def _finalize_chat(self, *, user_id: str, exercise_id: str, message: str, prompt: str, processed: str, start: float, coalesced: bool = False) -> Dict[str, Any]:
         prompt_tokens = approximate_token_count(prompt)
         completion_tokens = approximate_token_count(processed)
         quality_flags_chat: dict[str, bool] = {
             'similarity_used': 'ContextoRelacionado:' in prompt,
             'stub_mode': self.llm._chain is None,
             'truncated': len(prompt) > MAX_PROMPT_CHARS * 0.5,  # para chat usamos menor budget
+            'coalesced': coalesced,
         }
-        metrics = get_metrics_collector().record(model=self.llm.model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, start_time=start, quality_flags=quality_flags_chat, output_text=processed)
-        try:
-            await self.db.create_llm_metric({
-                'user_id': user_id,
-                'exercise_id': exercise_id,
-                'attempt_id': None,
-                'model': self.llm.model,
-                'prompt_tokens': prompt_tokens,
-                'completion_tokens': completion_tokens,
-                'latency_ms': metrics.latency_ms,
-                'quality_flags': {},
-            })
-        except Exception:
-            pass
-        # Persistir en vector store
-        self.vs.add(user_id=user_id, exercise_id=exercise_id, attempt_id=None, type_='question', content=message)
-        self.vs.add(user_id=user_id, exercise_id=exercise_id, attempt_id=None, type_='answer', content=processed)
+        metrics = get_metrics_collector().record(model=self.llm.model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, start_time=start, quality_flags=quality_flags_chat, output_text=processed, kind='chat')
+        stages = stages_ms()
+        # Persistir en vector store + métricas (write-behind)
+        await self._persist(vectors=[
+            {'user_id': user_id, 'exercise_id': exercise_id, 'attempt_id': None, 'type': 'question', 'content': message},
+            {'user_id': user_id, 'exercise_id': exercise_id, 'attempt_id': None, 'type': 'answer', 'content': processed},
+        ], metric={
+            'user_id': user_id,
+            'exercise_id': exercise_id,
+            'attempt_id': None,
+            'model': self.llm.model,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'latency_ms': metrics.latency_ms,
+            'quality_flags': {'stages_ms': stages} if stages is not None else {},
+        })
         return {'content_md': processed, 'metrics': metrics.to_dict()}
 
+    async def chat(self, *, user_id: str, exercise_id: str, message: str, loader: RequestLoader | None = None) -> Dict[str, Any]:
+        prompt = await self._prepare_chat(user_id=user_id, exercise_id=exercise_id, message=message, loader=loader or RequestLoader(self.db))
+        start = time.time()
+        with span('llm'):
+            raw, coalesced = await self.llm.agenerate_shared(prompt)
+        with span('postprocess'):
+            processed = normalize_output(raw)
+            processed, _ = sanitize_references(processed)
+        return await self._finalize_chat(user_id=user_id, exercise_id=exercise_id, message=message, prompt=prompt, processed=processed, start=start, coalesced=coalesced)
+
+    async def stream_chat(self, *, user_id: str, exercise_id: str, message: str, loader: RequestLoader | None = None) -> AsyncIterator[Dict[str, Any]]:
+        """Versión streaming de chat (mismos eventos que stream_feedback, sin attempt_id).
+
+        Como stream_feedback, el prompt se prepara antes de devolver el iterador de eventos.
+        """
+        prompt = await self._prepare_chat(user_id=user_id, exercise_id=exercise_id, message=message, loader=loader or RequestLoader(self.db))
+        return self._chat_events(user_id=user_id, exercise_id=exercise_id, message=message, prompt=prompt)
+
+    async def _chat_events(self, *, user_id: str, exercise_id: str, message: str, prompt: str) -> AsyncIterator[Dict[str, Any]]:
+        start = time.time()
+        post = StreamingPostprocessor()
+        with span('llm'):
+            async for chunk in self.llm.astream(prompt):
+                out = post.feed(chunk)
+                if out:
+                    yield {'type': 'delta', 'content': out}
+            tail = post.flush()
+        if tail:
+            yield {'type': 'delta', 'content': tail}
+        result = await self._finalize_chat(user_id=user_id, exercise_id=exercise_id, message=message, prompt=prompt, processed=post.text, start=start)
+        yield {'type': 'done', 'metrics': result['metrics']}
+
 _feedback_service_singleton: FeedbackService | None = None
 
 async def get_feedback_service(db: Database) -> FeedbackService:
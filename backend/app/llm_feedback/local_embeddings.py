@@ -0,0 +1,68 @@
+"""Embeddings locales por hashing de n-gramas (sin red ni modelo descargado).
+
+Se usa con EMBEDDING_MODEL='local-ngram' y como fallback cuando el proveedor (Gemini) no está
+disponible, en lugar de vectores aleatorios:
+ - Texto normalizado (minúsculas, sin acentos, espacios colapsados).
+ - Features: palabras, bigramas de palabras y trigramas de caracteres por palabra.
+ - Feature hashing con signo (crc32) sobre `dim` posiciones; TF sublineal (1 + log tf).
+ - Vector normalizado L2: el coseno mide solapamiento léxico entre respuestas.
+
+Determinista entre procesos (crc32, no hash() de Python) y barato: un batch de textos cortos
+se calcula en milisegundos.
+"""
+from __future__ import annotations
+from typing import List
+import re
+import unicodedata
+import zlib
+import numpy as np
+
+LOCAL_MODEL_PREFIX = 'local'
+
+_TOKEN_RE = re.compile(r"[a-z0-9_./:=-]+")
+# Peso relativo por tipo de feature (las palabras completas pesan más que los trigramas)
+_WORD_WEIGHT = 1.0
+_BIGRAM_WEIGHT = 0.7
+_CHAR_WEIGHT = 0.5
+
+def is_local_model(model: str) -> bool:
+    return model.lower().startswith(LOCAL_MODEL_PREFIX)
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+def _features(text: str) -> tuple[List[str], List[float]]:
+    words = _TOKEN_RE.findall(_normalize(text))
+    feats: List[str] = []
+    weights: List[float] = []
+    for w in words:
+        feats.append('w:' + w)
+        weights.append(_WORD_WEIGHT)
+        padded = f' {w} '
+        for i in range(len(padded) - 2):
+            feats.append('c:' + padded[i:i + 3])
+            weights.append(_CHAR_WEIGHT)
+    for a, b in zip(words, words[1:]):
+        feats.append(f'b:{a} {b}')
+        weights.append(_BIGRAM_WEIGHT)
+    return feats, weights
+
+def hashed_ngram_embeddings(texts: List[str], dim: int) -> np.ndarray:
+    """Matriz (len(texts), dim) float32 con una fila normalizada por texto (ceros si no hay tokens)."""
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        feats, weights = _features(text or '')
+        if not feats:
+            continue
+        hashes = np.fromiter((zlib.crc32(f.encode('utf-8')) for f in feats), dtype=np.uint32, count=len(feats))
+        index = (hashes % dim).astype(np.intp)
+        sign = np.where((hashes >> 31) & 1, -1.0, 1.0)
+        # TF sublineal por feature distinta, luego proyección con signo
+        _, inverse, counts = np.unique(hashes, return_inverse=True, return_counts=True)
+        w = np.asarray(weights) * (1.0 + np.log(counts[inverse])) / counts[inverse]
+        vec = np.bincount(index, weights=sign * w, minlength=dim)
+        norm = np.linalg.norm(vec)
+        if norm:
+            out[row] = vec / norm
+    return out
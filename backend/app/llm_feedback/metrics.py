@@ -1,13 +1,23 @@
 """Registro y métricas del módulo de feedback.
 
 En entorno real podrías enviar a un sistema externo (OpenTelemetry, Prometheus, etc.).
-Aquí dejamos hooks ligeros.
+Aquí dejamos hooks ligeros, con memoria acotada por worker:
+- Ring buffer (METRICS_BUFFER_SIZE) con los últimos eventos (dump).
+- Agregados incrementales por (modelo, tipo de llamada): histograma de latencia (p50/p95/p99),
+  totales de tokens y tasas de flags de calidad (stub_mode, truncated, ...).
+record es O(1) (búsqueda binaria sobre buckets fijos); snapshot recorre sólo los buckets.
 """
 from __future__ import annotations
+from bisect import bisect_left
+from collections import deque
 from dataclasses import dataclass, asdict
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import time
 import re
+from ..core.config import get_settings
+from ..core.telemetry import observe_llm
+
+settings = get_settings()
 
 TOKEN_REGEX = re.compile(r"\w+|[^\s\w]")
 
@@ -35,11 +45,72 @@ class LLMCallMetrics:
     def to_dict(self) -> Dict[str, Any]:
         return asdict(self)
 
-class MetricsCollector:
+# Límites superiores (ms) de los buckets de latencia: geométricos x1.25 desde 5ms hasta ~5min
+LATENCY_BUCKETS_MS: tuple[float, ...] = tuple(5.0 * 1.25 ** i for i in range(50))
+
+class _Aggregate:
+    """Agregado incremental de un (modelo, tipo): tamaño fijo sin importar cuántas llamadas haya."""
+    __slots__ = ('count', 'latency_sum', 'latency_max', 'buckets', 'prompt_tokens', 'completion_tokens', 'flags')
+
     def __init__(self) -> None:
-        self._events: list[Dict[str, Any]] = []
+        self.count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)  # último = desborde
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.flags: Dict[str, int] = {}
+
+    def add(self, m: LLMCallMetrics) -> None:
+        self.count += 1
+        self.latency_sum += m.latency_ms
+        self.latency_max = max(self.latency_max, m.latency_ms)
+        self.buckets[bisect_left(LATENCY_BUCKETS_MS, m.latency_ms)] += 1
+        self.prompt_tokens += m.prompt_tokens or 0
+        self.completion_tokens += m.completion_tokens or 0
+        for name, value in m.quality_flags.items():
+            if value is True:
+                self.flags[name] = self.flags.get(name, 0) + 1
+            elif value is False and name not in self.flags:
+                self.flags[name] = 0
 
-    def record(self, *, model: str, prompt_tokens: int | None, completion_tokens: int | None, start_time: float, quality_flags: Dict[str, bool], output_text: str | None = None) -> LLMCallMetrics:
+    def percentile(self, q: float) -> float | None:
+        # Interpolación lineal dentro del bucket que contiene el rango pedido (acotado al máximo observado)
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                lower = LATENCY_BUCKETS_MS[i - 1] if i else 0.0
+                upper = LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.latency_max
+                value = lower + (upper - lower) * (rank - seen) / n
+                return round(min(value, self.latency_max), 1)
+            seen += n
+        return round(self.latency_max, 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'latency_ms': {
+                'p50': self.percentile(0.50),
+                'p95': self.percentile(0.95),
+                'p99': self.percentile(0.99),
+                'mean': round(self.latency_sum / self.count, 1) if self.count else None,
+                'max': round(self.latency_max, 1),
+            },
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'flag_rates': {name: round(n / self.count, 4) for name, n in sorted(self.flags.items())} if self.count else {},
+        }
+
+class MetricsCollector:
+    def __init__(self, buffer_size: int = 500) -> None:
+        self._events: deque[Dict[str, Any]] = deque(maxlen=max(1, buffer_size))
+        self._aggregates: Dict[tuple[str, str], _Aggregate] = {}
+        self._started = time.time()
+
+    def record(self, *, model: str, prompt_tokens: int | None, completion_tokens: int | None, start_time: float, quality_flags: Dict[str, bool], output_text: str | None = None, kind: str = 'feedback') -> LLMCallMetrics:
         latency_ms = (time.time() - start_time) * 1000
         density = None
         lexical = None
@@ -59,14 +130,36 @@ class MetricsCollector:
             except Exception:
                 pass
         m = LLMCallMetrics(model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, latency_ms=latency_ms, quality_flags=quality_flags, density_chars_per_token=density, lexical_diversity=lexical, avg_sentence_length=avg_sent)
-        # asdict porque usamos slots y no hay __dict__ directo
-        self._events.append(asdict(m))
+        # asdict porque usamos slots y no hay __dict__ directo; el deque descarta el más antiguo
+        event = asdict(m)
+        event['kind'] = kind
+        event['ts'] = time.time()
+        self._events.append(event)
+        agg = self._aggregates.get((model, kind))
+        if agg is None:
+            agg = self._aggregates[(model, kind)] = _Aggregate()
+        agg.add(m)
+        observe_llm(model=model, kind=kind, latency_ms=latency_ms, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, quality_flags=quality_flags)
         return m
 
-    def dump(self) -> list[Dict[str, Any]]:
-        return list(self._events)
+    def dump(self, limit: int | None = None) -> list[Dict[str, Any]]:
+        """Últimos eventos (a lo sumo el tamaño del buffer), del más antiguo al más reciente."""
+        events = list(self._events)
+        return events[-limit:] if limit else events
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Agregados desde el arranque del worker, por modelo y tipo de llamada (feedback/feedback_cache/chat)."""
+        groups: List[Dict[str, Any]] = []
+        for (model, kind), agg in sorted(self._aggregates.items()):
+            groups.append({'model': model, 'kind': kind, **agg.snapshot()})
+        return {
+            'since': self._started,
+            'total_calls': sum(a.count for a in self._aggregates.values()),
+            'buffer': {'size': len(self._events), 'capacity': self._events.maxlen},
+            'groups': groups,
+        }
 
-_metrics = MetricsCollector()
+_metrics = MetricsCollector(settings.METRICS_BUFFER_SIZE)
 
 def get_metrics_collector() -> MetricsCollector:
     return _metrics
@@ -46,8 +46,10 @@ def basic_quality_flags(markdown: str) -> Dict[str, bool]:
 
 REF_HEADER_RE = re.compile(r'^##\s+(Referencias|Recursos|Fuentes)\b', re.IGNORECASE | re.MULTILINE)
 URL_RE = re.compile(r'https?://\S+')
-MD_LINK_RE = re.compile(r'\[([^\]]+)\]\((https?://[^)]+)\)')
-CITATION_RE = re.compile(r'(\s*)\[(?:\d+|[a-z]{1,3})\](?=[\s\.,;:!?]|$)', re.IGNORECASE)
+# Reglas locales a una línea (no cruzan '\n'): StreamingPostprocessor las aplica línea por línea
+MD_LINK_RE = re.compile(r'\[([^\]\n]+)\]\((https?://[^)\s]+)\)')
+CITATION_RE = re.compile(r'([ \t]*)\[(?:\d+|[a-z]{1,3})\](?=[\s\.,;:!?]|$)', re.IGNORECASE | re.MULTILINE)
+TRAILING_WS_RE = re.compile(r'[ \t]+$', re.MULTILINE)
 
 def sanitize_references(markdown: str) -> Tuple[str, bool]:
     """Elimina secciones de referencias y enlaces externos.
@@ -60,7 +62,14 @@ def sanitize_references(markdown: str) -> Tuple[str, bool]:
     Devuelve el texto saneado y flag si hubo cambios.
     """
     original = markdown
-    text = markdown
+    text = _strip_references(markdown)
+    # Normalizar espacios en blanco generados tras eliminación (finales de línea y saltos múltiples)
+    text = TRAILING_WS_RE.sub('', text)
+    text = re.sub(r'\n{3,}', '\n\n', text).strip()
+    changed = text != original
+    return text, changed
+
+def _strip_references(text: str) -> str:
     # Eliminar líneas de secciones de referencias completas (solo header)
     text = REF_HEADER_RE.sub('', text)
     # Sustituir links markdown conservando el texto ancla
@@ -69,7 +78,136 @@ def sanitize_references(markdown: str) -> Tuple[str, bool]:
     text = URL_RE.sub('', text)
     # Eliminar citas tipo [1]
     text = CITATION_RE.sub('', text)
-    # Normalizar espacios en blanco múltiples generados tras eliminación
-    text = re.sub(r'\n{3,}', '\n\n', text).strip()
-    changed = text != original
-    return text, changed
+    return text
+
+def _is_optional_section(line: str) -> bool:
+    return any(line.startswith(sec) for sec in OPTIONAL_SECTIONS)
+
+class StreamingPostprocessor:
+    """Versión incremental de normalize_output + sanitize_references para respuestas en streaming.
+
+    Todas las reglas de ambas funciones son locales a una línea, así que se aplican por línea:
+    - Una línea se emite al completarse; de una línea abierta sólo se adelanta el prefijo hasta
+      el último espacio antes de cualquier '[' (las URLs, links y citas nunca quedan partidas).
+    - Líneas que empiezan con '#' esperan completas (encabezados / sección de referencias).
+    - Un encabezado opcional se retiene hasta ver la línea siguiente (se descarta si está vacío).
+    - Se colapsan líneas en blanco y se omiten las iniciales/finales (equivale a strip()).
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._parts: list[str] = []
+        self._pending_header: str | None = None
+        self._pending_blank = False
+        self._started = False  # ya se emitió contenido
+        self._raw_started = False  # ya llegó una línea no vacía del LLM (aunque el saneado la dejara vacía)
+        self._line_open = False  # parte de la línea actual ya fue emitida
+        self._held_ws = ""  # espacios finales retenidos de la línea abierta (se descartan si la línea termina)
+
+    @property
+    def text(self) -> str:
+        """Texto completo emitido hasta ahora (lo que se persiste al terminar)."""
+        return "".join(self._parts)
+
+    def feed(self, chunk: str) -> str:
+        """Agrega un fragmento del LLM y devuelve el texto saneado listo para enviar (puede ser '')."""
+        self._buffer += chunk
+        out: list[str] = []
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            out.append(self._end_line(line))
+        out.append(self._emit_safe_prefix())
+        return self._record("".join(out))
+
+    def flush(self) -> str:
+        """Cierra el stream: procesa la última línea y descarta un encabezado final vacío."""
+        out = ""
+        if self._buffer or self._line_open:
+            line, self._buffer = self._buffer, ""
+            out = self._end_line(line)
+        self._pending_header = None
+        return self._record(out)
+
+    def _record(self, text: str) -> str:
+        if text:
+            self._parts.append(text)
+        return text
+
+    def _sep(self) -> str:
+        if not self._started:
+            self._started = True
+            self._pending_blank = False
+            return ""
+        sep = "\n\n" if self._pending_blank else "\n"
+        self._pending_blank = False
+        return sep
+
+    def _resolve_header(self, next_line: str) -> str:
+        # Regla de normalize_output: el encabezado sobrevive si la línea siguiente tiene contenido propio
+        header, self._pending_header = self._pending_header, None
+        stripped = next_line.strip()
+        if header is None or not stripped or _is_optional_section(stripped):
+            return ""
+        return self._sep() + _strip_references(header).rstrip()
+
+    def _end_line(self, line: str) -> str:
+        if self._line_open:
+            self._line_open = False
+            # Los espacios retenidos se sanean junto con el resto: una cita ' [1]' se lleva también
+            # el espacio previo (como en batch: 'ver https://x.y [1].' -> 'ver.')
+            rest = _strip_references(self._held_ws + line).rstrip()
+            self._held_ws = ""
+            return rest
+        line = line.rstrip()
+        if not self._raw_started:
+            # strip() inicial de normalize_output: sólo la primera línea con contenido del LLM
+            line = line.lstrip()
+            self._raw_started = bool(line)
+        out = self._resolve_header(line) if self._pending_header is not None else ""
+        if _is_optional_section(line):
+            self._pending_header = line
+            return out
+        content = _strip_references(line).rstrip()
+        if not self._started:
+            # strip() final de sanitize_references: el saneado puede dejar espacios al inicio
+            content = content.lstrip()
+        if not content:
+            if self._started:
+                self._pending_blank = True
+            return out
+        return out + self._sep() + content
+
+    def _emit_safe_prefix(self) -> str:
+        buf = self._buffer
+        if not buf:
+            return ""
+        if not self._line_open:
+            head = buf.lstrip()
+            if not head or head.startswith('#'):
+                return ""
+        limit = buf.find('[')
+        if limit == -1:
+            limit = len(buf)
+        cut = max(buf.rfind(' ', 0, limit), buf.rfind('\t', 0, limit))
+        if cut <= 0:
+            return ""
+        if self._line_open:
+            self._buffer = buf[cut:]
+            return self._hold_trailing_ws(_strip_references(self._held_ws + buf[:cut]))
+        sanitized = _strip_references(buf[:cut])
+        if not self._started and self._pending_header is None:
+            sanitized = sanitized.lstrip()
+        if not sanitized.strip():
+            return ""
+        self._buffer = buf[cut:]
+        # Como normalize_output, el encabezado se decide con la línea original (antes del saneado)
+        out = self._resolve_header(buf[:cut]) if self._pending_header is not None else ""
+        self._line_open = True
+        self._raw_started = True
+        return out + self._sep() + self._hold_trailing_ws(sanitized)
+
+    def _hold_trailing_ws(self, piece: str) -> str:
+        # Los espacios finales sólo se emiten si la línea continúa (equivale al rstrip por línea)
+        body = piece.rstrip()
+        self._held_ws = piece[len(body):]
+        return body
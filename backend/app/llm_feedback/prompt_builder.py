@@ -6,8 +6,10 @@ Responsabilidad:
 """
 from __future__ import annotations
 from typing import Sequence, Any
+from string import Formatter
 
 MAX_PROMPT_CHARS = 6000  # Presupuesto aproximado (ajustable)
+PROMPT_TEMPLATE_VERSION = 2  # Incrementar al cambiar el template o su armado (invalida el cache de feedback)
 
 SPECIALIZATION_SNIPPETS = {
     'command': (
@@ -53,7 +55,7 @@ Preguntas previas del usuario:
 Respuestas previas del asistente:
 {previous_answers}
 
-[Respuesta actual del usuario]
+{similar_context}[Respuesta actual del usuario]
 {user_answer}
 
 Produce feedback ÚTIL en Markdown. Usa solo encabezados con contenido real, por ejemplo:
@@ -70,68 +72,144 @@ Lineamientos:
 - Si el user pregunta algo específico en el diálogo posterior, responde correctamente si tiene que ver con el ejercicio o la guía, si es muy alejado, ofrece una respuesta más general y al final dile que siga con los otros ejercicios.
 """.strip()
 
+TRUNCATION_MARKER = "...[TRUNCADO]"
+SIMILARITY_HEADER = "--- CONTEXTO RELACIONADO (similaridad) ---"
+SIMILARITY_FOOTER = "--- FIN CONTEXTO RELACIONADO ---"
+
+# Secciones variables en orden de prioridad con su mínimo garantizado (chars).
+# Primera pasada: cada sección recibe hasta su mínimo; segunda: el sobrante se reparte en el mismo orden.
+_SECTION_PRIORITY: tuple[tuple[str, int], ...] = (
+    ('user_answer', 2000),
+    ('exercise_content', 1200),
+    ('expected_answer', 600),
+    ('previous_feedback', 800),
+    ('attempt_summaries', 500),
+    ('previous_questions', 300),
+    ('previous_answers', 300),
+    ('similar_context', 600),
+)
+_SHORT_FIELD_CHARS = 200  # Títulos, tema, tipo, dificultad: cortos, no participan del reparto
+
+# Caracteres fijos del template (todo lo que no es placeholder), medidos una sola vez
+_TEMPLATE_FIXED_CHARS = sum(len(literal) for literal, *_ in Formatter().parse(PROMPT_TEMPLATE))
+
 def _truncate(text: str, budget: int) -> str:
     if len(text) <= budget:
         return text
     # Cortar en límite y añadir marcador
-    return text[: budget - 60] + "\n...[TRUNCADO]" if budget > 60 else text[:budget]
-
-
-def build_feedback_prompt(*, guide: dict[str, Any] | None, exercise: dict[str, Any], attempts: Sequence[dict[str, Any]], previous_feedback: str | None, previous_dialog: Sequence[dict[str, str]], user_answer: str) -> str:
-    guide_title = guide.get("title") if guide else "(Sin guía)"
-    guide_topic = guide.get("topic") if guide else "(Sin tema)"
-    attempt_summaries = "\n".join(f"- {a.get('submitted_answer','')[:120]}" for a in attempts[-5:]) or "(Sin intentos previos)"
-    prev_feedback = previous_feedback or "(Sin feedback previo)"
-    user_questions = [d["content"] for d in previous_dialog if d.get("type") == "question"]
-    assistant_answers = [d["content"] for d in previous_dialog if d.get("type") == "answer"]
-    pq = "\n".join(f"- {q[:120]}" for q in user_questions[-5:]) or "(Sin preguntas)"
-    pa = "\n".join(f"- {r[:120]}" for r in assistant_answers[-5:]) or "(Sin respuestas)"
+    cut = budget - len(TRUNCATION_MARKER) - 1
+    return text[:cut] + "\n" + TRUNCATION_MARKER if cut > 0 else text[:budget]
 
+def _fit_lines(lines: Sequence[str], budget: int, *, keep_last: bool) -> str:
+    """Conserva líneas completas (las últimas o las primeras) que entren en el presupuesto."""
+    text = "\n".join(lines)
+    if len(text) <= budget:
+        return text
+    marker = "- " + TRUNCATION_MARKER
+    room = budget - len(marker) - 1
+    ordered = list(reversed(lines)) if keep_last else list(lines)
+    kept: list[str] = []
+    used = 0
+    for line in ordered:
+        if used + len(line) + 1 > room:
+            break
+        kept.append(line)
+        used += len(line) + 1
+    if keep_last:
+        kept.reverse()
+        return "\n".join([marker, *kept]) if room >= 0 else ""
+    return "\n".join([*kept, marker]) if room >= 0 else ""
+
+def _similarity_lines(similar_items: Sequence[dict[str, Any]]) -> list[str]:
+    lines = []
+    for it in similar_items:
+        c = it.get('content') or it.get('submitted_answer') or ''
+        if not c:
+            continue
+        s = it.get('score_hybrid') or it.get('score') or it.get('score_cosine')
+        s_txt = f"{s:.2f}" if isinstance(s, (int, float)) else '?'
+        lines.append(f"[Relacionado score={s_txt}] {c[:300]}")
+    return lines
+
+def _similar_section(lines: Sequence[str], budget: int) -> str:
+    """Bloque de similaridad con encabezado; vacío si no entra ni una línea (ordenadas por score)."""
+    if not lines:
+        return ""
+    wrapper = len(SIMILARITY_HEADER) + len(SIMILARITY_FOOTER) + 3  # saltos de línea del bloque
+    kept: list[str] = []
+    used = wrapper
+    for line in lines:
+        if used + len(line) + 1 > budget:
+            break
+        kept.append(line)
+        used += len(line) + 1
+    if not kept:
+        return ""
+    return SIMILARITY_HEADER + "\n" + "\n".join(kept) + "\n" + SIMILARITY_FOOTER + "\n\n"
+
+def _allocate(lengths: dict[str, int], budget: int) -> dict[str, int]:
+    alloc: dict[str, int] = {}
+    remaining = max(0, budget)
+    for name, floor in _SECTION_PRIORITY:
+        take = min(lengths[name], floor, remaining)
+        alloc[name] = take
+        remaining -= take
+    for name, _ in _SECTION_PRIORITY:
+        extra = min(lengths[name] - alloc[name], remaining)
+        alloc[name] += extra
+        remaining -= extra
+    return alloc
+
+
+def build_feedback_prompt(*, guide: dict[str, Any] | None, exercise: dict[str, Any], attempts: Sequence[dict[str, Any]], previous_feedback: str | None, previous_dialog: Sequence[dict[str, str]], user_answer: str, similar_items: Sequence[dict[str, Any]] = ()) -> str:
+    """Arma el prompt en una sola pasada dentro de MAX_PROMPT_CHARS.
+
+    Mide cada sección una vez, reparte el presupuesto por prioridad (respuesta > ejercicio >
+    historial de feedback > similaridad) y formatea el template una única vez. Las secciones
+    recortadas llevan TRUNCATION_MARKER; las instrucciones finales y la respuesta del usuario
+    nunca se cortan por un slice global.
+    """
+    short = lambda v: str(v)[:_SHORT_FIELD_CHARS]  # noqa: E731
+    guide_title = short(guide.get("title")) if guide else "(Sin guía)"
+    guide_topic = short(guide.get("topic")) if guide else "(Sin tema)"
     exercise_type = exercise.get("type")
     specialization = SPECIALIZATION_SNIPPETS.get(exercise_type, "Enfatiza exactitud, claridad y utilidad pedagógica.")
-
-    base_prompt = PROMPT_TEMPLATE.format(
-        specialization=specialization,
-        guide_title=guide_title,
-        guide_topic=guide_topic,
-        exercise_title=exercise.get("title"),
-        exercise_type=exercise_type,
-        exercise_difficulty=exercise.get("difficulty"),
-        exercise_content=exercise.get("content_html") or exercise.get("ai_context") or "(Sin descripción)",
-        expected_answer=exercise.get("expected_answer") or "(No definida)",
-        attempt_summaries=attempt_summaries,
-        previous_feedback=prev_feedback,
-        previous_questions=pq,
-        previous_answers=pa,
-        user_answer=user_answer or "(Vacío)"
-    )
-
-    if len(base_prompt) <= MAX_PROMPT_CHARS:
-        return base_prompt
-
-    # Estrategia de truncado progresivo
-    # 1. Reducir historial de preguntas/respuestas
-    reduced_pq = _truncate(pq, 400)
-    reduced_pa = _truncate(pa, 400)
-    reduced_attempts = _truncate(attempt_summaries, 600)
-    reduced_prev_feedback = _truncate(prev_feedback, 800)
-    reduced_content = _truncate(exercise.get("content_html") or exercise.get("ai_context") or "(Sin descripción)", 1200)
-
-    truncated_prompt = PROMPT_TEMPLATE.format(
-        specialization=specialization,
-        guide_title=guide_title,
-        guide_topic=guide_topic,
-        exercise_title=exercise.get("title"),
-        exercise_type=exercise_type,
-        exercise_difficulty=exercise.get("difficulty"),
-        exercise_content=reduced_content,
-        expected_answer=exercise.get("expected_answer") or "(No definida)",
-        attempt_summaries=reduced_attempts,
-        previous_feedback=reduced_prev_feedback,
-        previous_questions=reduced_pq,
-        previous_answers=reduced_pa,
-        user_answer=(user_answer or "(Vacío)")[:800]
-    )
-    if len(truncated_prompt) > MAX_PROMPT_CHARS:
-        truncated_prompt = truncated_prompt[: MAX_PROMPT_CHARS - 80] + "\n...[TRUNCADO FINAL]"
-    return truncated_prompt
+    fixed = {
+        'specialization': specialization,
+        'guide_title': guide_title,
+        'guide_topic': guide_topic,
+        'exercise_title': short(exercise.get("title")),
+        'exercise_type': short(exercise_type),
+        'exercise_difficulty': short(exercise.get("difficulty")),
+    }
+
+    attempt_lines = [f"- {a.get('submitted_answer','')[:120]}" for a in attempts[-5:]]
+    question_lines = [f"- {d['content'][:120]}" for d in previous_dialog if d.get("type") == "question"][-5:]
+    answer_lines = [f"- {d['content'][:120]}" for d in previous_dialog if d.get("type") == "answer"][-5:]
+    similar_lines = _similarity_lines(similar_items)
+    texts = {
+        'user_answer': user_answer or "(Vacío)",
+        'exercise_content': exercise.get("content_html") or exercise.get("ai_context") or "(Sin descripción)",
+        'expected_answer': exercise.get("expected_answer") or "(No definida)",
+        'previous_feedback': previous_feedback or "(Sin feedback previo)",
+        'attempt_summaries': "\n".join(attempt_lines) or "(Sin intentos previos)",
+        'previous_questions': "\n".join(question_lines) or "(Sin preguntas)",
+        'previous_answers': "\n".join(answer_lines) or "(Sin respuestas)",
+    }
+    lengths = {name: len(text) for name, text in texts.items()}
+    lengths['similar_context'] = len(_similar_section(similar_lines, MAX_PROMPT_CHARS))
+
+    budget = MAX_PROMPT_CHARS - _TEMPLATE_FIXED_CHARS - sum(len(v) for v in fixed.values())
+    alloc = _allocate(lengths, budget)
+
+    sections = {
+        'user_answer': _truncate(texts['user_answer'], alloc['user_answer']),
+        'exercise_content': _truncate(texts['exercise_content'], alloc['exercise_content']),
+        'expected_answer': _truncate(texts['expected_answer'], alloc['expected_answer']),
+        'previous_feedback': _truncate(texts['previous_feedback'], alloc['previous_feedback']),
+        'attempt_summaries': _fit_lines(attempt_lines, alloc['attempt_summaries'], keep_last=True) if attempt_lines else _truncate(texts['attempt_summaries'], alloc['attempt_summaries']),
+        'previous_questions': _fit_lines(question_lines, alloc['previous_questions'], keep_last=True) if question_lines else _truncate(texts['previous_questions'], alloc['previous_questions']),
+        'previous_answers': _fit_lines(answer_lines, alloc['previous_answers'], keep_last=True) if answer_lines else _truncate(texts['previous_answers'], alloc['previous_answers']),
+        'similar_context': _similar_section(similar_lines, alloc['similar_context']),
+    }
+    return PROMPT_TEMPLATE.format(**fixed, **sections)
@@ -1,26 +1,56 @@
 """Memoria vectorial para conversaciones y feedback.
 
 Mejoras implementadas:
- - Embeddings reales opcionales (Gemini) si hay API key, con fallback determinista.
+ - Embeddings reales opcionales (Gemini) si hay API key; sin proveedor (o con
+   EMBEDDING_MODEL='local-ngram') n-gramas hasheados locales (local_embeddings.py).
  - Similaridad coseno local.
  - Recency decay exponencial configurable.
  - Ranking MMR (Maximal Marginal Relevance) para diversidad.
  - Parámetros configurables en settings (SIMILARITY_*).
 
+Backends de similaridad (SIMILARITY_BACKEND):
+ - 'local': descarga hasta SIMILARITY_FETCH_LIMIT filas y rankea en Python.
+ - 'pgvector': coseno + recency en Postgres (RPC match_conversation_vectors, ver
+   match_conversation_vectors.sql); sólo vuelven los candidatos para MMR.
+
 Escalabilidad futura:
- - Migrar a pgvector y ejecutar ranking directamente en Postgres.
  - Reemplazar fallback por modelo open-source (e.g. bge-small) si se integra pipeline.
 """
 from __future__ import annotations
-from typing import List, Dict, Any, Optional, Tuple, OrderedDict as _OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 import os
+import json
+import base64
+import logging
+import threading
 import numpy as np
-from collections import OrderedDict
 from supabase import create_client
 from ..core.config import get_settings
-from datetime import datetime, timezone
+from ..core.telemetry import instrumented, VECTOR_CALL_SECONDS
+from ..db.database import is_missing_object, MISSING_COLUMN_CODES, MISSING_FUNCTION_CODES
+from .embedding_cache import get_embedding_cache
+from .local_embeddings import hashed_ngram_embeddings, is_local_model
+from datetime import datetime, timedelta, timezone
 
 settings = get_settings()
+logger = logging.getLogger("vector_store")
+
+_last_created_at: datetime | None = None
+_created_at_lock = threading.Lock()
+
+def next_created_at() -> str:
+    """created_at estrictamente creciente en el proceso (al menos +1µs sobre el anterior).
+
+    Los turnos se insertan en lote: con el DEFAULT now() de Postgres toda la transacción comparte
+    el mismo instante y el orden por created_at (historial, diálogo, resumen) queda indefinido.
+    """
+    global _last_created_at
+    with _created_at_lock:
+        now = datetime.now(timezone.utc)
+        if _last_created_at is not None and now <= _last_created_at:
+            now = _last_created_at + timedelta(microseconds=1)
+        _last_created_at = now
+        return now.isoformat()
 
 # Placeholder de embeddings: en real usarías un modelo (OpenAI, HF, etc.)
 # Aquí representamos una función que retorna un vector fijo o pseudo-embedding
@@ -35,27 +65,8 @@ def infer_dim(model_name: str) -> int:
         return 384
     return 1536
 
-_EMBED_CACHE: "OrderedDict[str, list[float]]" = OrderedDict()
-_EMBED_CACHE_MAX = 256
-
-def _cache_get(key: str) -> list[float] | None:
-    v = _EMBED_CACHE.get(key)
-    if v is not None:
-        # mover a final (LRU)
-        _EMBED_CACHE.move_to_end(key)
-    return v
-
-def _cache_put(key: str, value: list[float]) -> None:
-    _EMBED_CACHE[key] = value
-    _EMBED_CACHE.move_to_end(key)
-    if len(_EMBED_CACHE) > _EMBED_CACHE_MAX:
-        _EMBED_CACHE.popitem(last=False)
-
-def embed_text(text: str, dim: int, model: str) -> list[float]:
-    cache_key = f"{model}:{dim}:{hash(text)}"
-    cached = _cache_get(cache_key)
-    if cached is not None:
-        return cached
+def _provider_embeddings(texts: List[str], dim: int, model: str) -> Optional[List[np.ndarray]]:
+    """Embeddings del proveedor para varios textos en una sola llamada (None si no hay proveedor)."""
     # Intentar Gemini embeddings si disponible
     api_key = os.getenv('GOOGLE_API_KEY')
     if api_key and model.startswith('text-embedding'):
@@ -64,88 +75,234 @@ def embed_text(text: str, dim: int, model: str) -> list[float]:
             genai.configure(api_key=api_key)
             # API hipotética para embeddings Gemini (puede ajustarse según SDK real)
             if hasattr(genai, 'embed_content'):
-                resp = genai.embed_content(model=model, content=text)
-                emb = resp['embedding']['values']  # estructura típica
-                return emb[:dim]
+                # Con una lista de textos devuelve una lista de vectores en el mismo orden
+                resp = genai.embed_content(model=model, content=texts if len(texts) > 1 else texts[0])
+                embs = resp['embedding']  # estructura típica
+                if len(texts) == 1:
+                    embs = [embs['values'] if isinstance(embs, dict) else embs]
+                if len(embs) == len(texts):
+                    return [np.asarray(e[:dim], dtype=np.float32) for e in embs]
         except Exception:
             pass
-    # Fallback pseudo embedding determinista
-    rng = np.random.default_rng(abs(hash((model, text))) % (2**32))
-    vec = rng.normal(0, 0.1, size=dim).astype(float).tolist()
-    _cache_put(cache_key, vec)
-    return vec
-
-def _recency_weight(created_at: str | None, decay_lambda: float) -> float:
-    if not created_at:
-        return 1.0
+    return None
+
+def embed_vectors(texts: List[str], dim: int, model: str) -> List[np.ndarray]:
+    """Embeddings float32 (de solo lectura) para varios textos: cache primero, misses en un solo batch."""
+    cache = get_embedding_cache()
+    keys = [cache.key(model, dim, t) for t in texts]
+    out: List[Optional[np.ndarray]] = [cache.get(k) for k in keys]
+    missing: Dict[str, str] = {}
+    for k, t, v in zip(keys, texts, out):
+        if v is None:
+            missing.setdefault(k, t)
+    if missing:
+        computed: Dict[str, np.ndarray] = {}
+        provided = None if is_local_model(model) else _provider_embeddings(list(missing.values()), dim, model)
+        if provided is not None:
+            for k, vec in zip(missing, provided):
+                computed[k] = cache.put(k, vec)
+        else:
+            # Embedder local (EMBEDDING_MODEL='local-ngram' o fallback sin proveedor). Calcularlo es más
+            # barato que el disco y, como fallback, no debe sobrevivir a que aparezca la API key: sólo memoria.
+            local = hashed_ngram_embeddings(list(missing.values()), dim)
+            for k, vec in zip(missing, local):
+                computed[k] = cache.put(k, vec, persist=False)
+        out = [v if v is not None else computed[k] for k, v in zip(keys, out)]
+    return out  # type: ignore[return-value]
+
+def embed_vector(text: str, dim: int, model: str) -> np.ndarray:
+    return embed_vectors([text], dim, model)[0]
+
+def embed_text(text: str, dim: int, model: str) -> list[float]:
+    return embed_vector(text, dim, model).tolist()
+
+def _parse_embedding(raw: Any) -> list[float] | None:
+    # PostgREST serializa columnas vector como texto "[0.1,0.2,...]"
+    if isinstance(raw, str):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+    return raw
+
+def _embedding_row(item: Dict[str, Any], dim: int) -> np.ndarray | None:
+    """Embedding del item como vector float32; None si falta o no es válido.
+
+    Acepta 'embedding_b64' (float4 big-endian en base64, ver embedding_wire_format.sql),
+    decodificado con np.frombuffer sin pasar por listas de floats, o 'embedding' (texto/lista JSON).
+    """
+    packed = item.get('embedding_b64')
     try:
-        dt = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-    except Exception:
-        return 1.0
-    age_hours = (datetime.now(timezone.utc) - dt).total_seconds() / 3600.0
-    return float(np.exp(-decay_lambda * age_hours))
+        if packed:
+            v = np.frombuffer(base64.b64decode(packed), dtype='>f4')
+        else:
+            raw = item.get('embedding')
+            if raw is None:
+                return None
+            v = np.asarray(_parse_embedding(raw), dtype=np.float32)
+    except (TypeError, ValueError):
+        return None
+    return v if v.shape == (dim,) else None
+
+def _stack_embeddings(items: List[Dict[str, Any]], dim: int) -> Tuple[np.ndarray, List[int]]:
+    """Matriz contigua (n, dim) float32 con los embeddings válidos y los índices de item que representan."""
+    rows: List[np.ndarray] = []
+    index: List[int] = []
+    for i, it in enumerate(items):
+        v = _embedding_row(it, dim)
+        if v is not None:
+            rows.append(v)
+            index.append(i)
+    if not rows:
+        return np.empty((0, dim), dtype=np.float32), index
+    # np.stack convierte una sola vez big-endian -> float32 nativo
+    return np.stack(rows).astype(np.float32, copy=False), index
+
+def _age_hours(created: List[str | None]) -> np.ndarray:
+    """Antigüedad en horas de cada timestamp (NaN si falta o no se puede parsear).
+
+    Supabase devuelve timestamptz en UTC ('+00:00'): esos se parsean en bloque como datetime64;
+    el resto (otros offsets) pasa por fromisoformat.
+    """
+    out = np.full(len(created), np.nan)
+    fast_idx: List[int] = []
+    fast_val: List[str] = []
+    slow: List[Tuple[int, str]] = []
+    for i, s in enumerate(created):
+        if not s:
+            continue
+        if s.endswith('+00:00'):
+            fast_idx.append(i)
+            fast_val.append(s[:-6])
+        elif s.endswith('Z'):
+            fast_idx.append(i)
+            fast_val.append(s[:-1])
+        else:
+            slow.append((i, s))
+    if fast_val:
+        now = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), 'us')
+        try:
+            ts = np.array(fast_val, dtype='datetime64[us]')
+            out[fast_idx] = (now - ts) / np.timedelta64(1, 'h')
+        except ValueError:
+            slow.extend((i, created[i]) for i in fast_idx)  # type: ignore[misc]
+    if slow:
+        now_dt = datetime.now(timezone.utc)
+        for i, s in slow:
+            try:
+                dt = datetime.fromisoformat(s.replace('Z', '+00:00'))
+                if dt.tzinfo is None:
+                    dt = dt.replace(tzinfo=timezone.utc)
+                out[i] = (now_dt - dt).total_seconds() / 3600.0
+            except Exception:
+                pass
+    return out
+
+def _recency_weights(created: List[str | None], decay_lambda: float) -> np.ndarray:
+    # Peso exponencial e^{-lambda*t}; sin timestamp válido el peso es 1
+    age = _age_hours(created)
+    return np.where(np.isnan(age), 1.0, np.exp(-decay_lambda * np.nan_to_num(age)))
 
 
 def _mmr_rerank(candidates: List[Tuple[float, Dict[str, Any]]], query_vec: np.ndarray, lambda_: float, top_k: int) -> List[Dict[str, Any]]:
+    """MMR incremental sobre la matriz de candidatos normalizada.
+
+    mmr = lambda * relevancia - (1 - lambda) * max(coseno con seleccionados); sin seleccionados
+    (o candidato sin embedding) la penalización es 0. Se mantiene un vector con la máxima
+    similitud a lo ya seleccionado y se actualiza con un producto matriz-vector por selección.
+    """
     if not candidates:
         return []
+    n = len(candidates)
+    relevance = np.array([float(s) for s, _ in candidates])
+    dim = query_vec.shape[0]
+    unit = np.zeros((n, dim), dtype=np.float32)
+    has_vec = np.zeros(n, dtype=bool)
+    for i, (_, item) in enumerate(candidates):
+        emb = item.get('_embedding')
+        if emb is None:
+            continue
+        v = np.asarray(emb, dtype=np.float32)
+        norm = np.linalg.norm(v) if v.shape == (dim,) else 0.0
+        if norm:
+            unit[i] = v / norm
+            has_vec[i] = True
+    max_sim = np.full(n, -np.inf)  # -inf => aún sin penalización
+    available = np.ones(n, dtype=bool)
     selected: List[Dict[str, Any]] = []
-    selected_vecs: List[np.ndarray] = []
-    remaining = candidates.copy()
-    while remaining and len(selected) < top_k:
-        best_idx = 0
-        best_score = -1e9
-        for idx, (sim, item) in enumerate(remaining):
-            # score relevancia principal
-            relevance = sim
-            diversity_penalty = 0.0
-            if selected_vecs:
-                iv = np.array(item.get('_embedding', []), dtype=float)
-                if iv.size and all(v.size for v in selected_vecs):
-                    sim_to_selected = [float(np.dot(iv, v) / (np.linalg.norm(iv) * np.linalg.norm(v))) for v in selected_vecs if np.linalg.norm(iv) and np.linalg.norm(v)]
-                    if sim_to_selected:
-                        diversity_penalty = max(sim_to_selected)
-            mmr_score = lambda_ * relevance - (1 - lambda_) * diversity_penalty
-            if mmr_score > best_score:
-                best_score = mmr_score
-                best_idx = idx
-        chosen = remaining.pop(best_idx)
-        chosen_item = dict(chosen[1])
-        chosen_item['mmr_score'] = best_score
+    for _ in range(min(top_k, n)):
+        penalty = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        scores = lambda_ * relevance - (1 - lambda_) * penalty
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))  # primer máximo: mismo desempate que el recorrido secuencial
+        available[best] = False
+        chosen_item = dict(candidates[best][1])
+        chosen_item['mmr_score'] = float(scores[best])
         selected.append(chosen_item)
-        emb = chosen_item.get('_embedding')
-        if emb:
-            selected_vecs.append(np.array(emb, dtype=float))
+        if has_vec[best]:
+            sims = unit @ unit[best]
+            np.maximum(max_sim, np.where(has_vec, sims, -np.inf), out=max_sim)
     return selected
 
+# Proyecciones: el historial/diálogo no necesita embeddings; el scoring agrega el embedding compacto
+DIALOG_COLUMNS = 'type,content,created_at'
+SCORING_COLUMNS = 'id,attempt_id,type,content,created_at'
 
+@instrumented(VECTOR_CALL_SECONDS)
 class VectorStore:
     def __init__(self, embedding_dim: int | None = None, model: str | None = None) -> None:
         self.model = model or settings.EMBEDDING_MODEL
         base_dim = embedding_dim or settings.EMBEDDING_DIM or infer_dim(self.model)
         self.dim = base_dim
         self.client = create_client(settings.SUPABASE_URL, settings.SUPABASE_ANON_KEY)
+        self.backend = settings.SIMILARITY_BACKEND
+        self.wire_format = settings.EMBEDDING_WIRE_FORMAT
 
     def add(self, *, user_id: str, exercise_id: str, attempt_id: Optional[str], type_: str, content: str) -> None:
-        embedding = embed_text(content, self.dim, self.model)
-        self.client.table('exercise_conversation_vectors').insert({
-            'user_id': user_id,
-            'exercise_id': exercise_id,
-            'attempt_id': attempt_id,
-            'type': type_,
-            'content': content,
-            'embedding': embedding,
-        }).execute()
+        self.add_many([{'user_id': user_id, 'exercise_id': exercise_id, 'attempt_id': attempt_id, 'type': type_, 'content': content}])
+
+    def add_many(self, entries: List[Dict[str, Any]]) -> None:
+        """Inserta varios registros (user_id, exercise_id, attempt_id, type, content, created_at).
+
+        Un solo batch de embeddings y un solo INSERT en PostgREST. Sin created_at se asigna uno al
+        insertar (next_created_at), respetando el orden de `entries`.
+        """
+        if not entries:
+            return
+        embeddings = embed_vectors([e['content'] for e in entries], self.dim, self.model)
+        rows = [{
+            'user_id': e['user_id'],
+            'exercise_id': e['exercise_id'],
+            'attempt_id': e.get('attempt_id'),
+            'type': e['type'],
+            'content': e['content'],
+            'created_at': e.get('created_at') or next_created_at(),
+            'embedding': emb.tolist(),
+        } for e, emb in zip(entries, embeddings)]
+        self.client.table('exercise_conversation_vectors').insert(rows, returning='minimal').execute()
 
     def recent(self, *, user_id: str, exercise_id: str, limit: int = 20) -> List[Dict[str, Any]]:
-        res = self.client.table('exercise_conversation_vectors').select('*').eq('user_id', user_id).eq('exercise_id', exercise_id).order('created_at', desc=True).limit(limit).execute()
+        """Últimos turnos (desc) sin embeddings: sólo lo que usan el historial y los prompts."""
+        res = self.client.table('exercise_conversation_vectors').select(DIALOG_COLUMNS).eq('user_id', user_id).eq('exercise_id', exercise_id).order('created_at', desc=True).limit(limit).execute()
         return res.data or []
 
     def fetch_all(self, *, user_id: str, exercise_id: str, limit: int = 200) -> List[Dict[str, Any]]:
         """Recupera hasta N registros para cálculo local de similitud.
-        Escala suficiente para bajo volumen actual; más adelante se migrará a consulta SQL con <-> en Postgres.
+        Escala suficiente para bajo volumen actual; con volumen mayor usar SIMILARITY_BACKEND=pgvector.
         """
-        res = self.client.table('exercise_conversation_vectors').select('*').eq('user_id', user_id).eq('exercise_id', exercise_id).order('created_at', desc=True).limit(limit).execute()
+        if self.wire_format == 'b64':
+            try:
+                res = self.client.table('exercise_conversation_vectors').select(f"{SCORING_COLUMNS},embedding_b64").eq('user_id', user_id).eq('exercise_id', exercise_id).order('created_at', desc=True).limit(limit).execute()
+                return res.data or []
+            except Exception as e:
+                if is_missing_object(e, MISSING_COLUMN_CODES):
+                    # Columna calculada no creada: volver a JSON para el resto del proceso
+                    self.wire_format = 'json'
+                    logger.warning("embedding_b64 no disponible, usando embeddings JSON: %s", e)
+                else:
+                    # Error transitorio: sólo esta lectura usa JSON
+                    logger.warning("Lectura con embedding_b64 falló, reintentando con JSON: %s", e)
+        res = self.client.table('exercise_conversation_vectors').select(f"{SCORING_COLUMNS},embedding").eq('user_id', user_id).eq('exercise_id', exercise_id).order('created_at', desc=True).limit(limit).execute()
         return res.data or []
 
     def similar(self, *, user_id: str, exercise_id: str, query_text: str, limit: int = 10) -> List[Dict[str, Any]]:
@@ -157,33 +314,18 @@ class VectorStore:
          4. Ajuste por recency (peso multiplicativo exponencial).
          5. Orden inicial por score hibrido.
          6. Re-ranking MMR para diversidad.
+        Con backend 'pgvector' los pasos 1-5 corren en Postgres y sólo vuelven 4xK candidatos.
         Fallback: recent() si algo falla.
         """
         try:
-            all_items = self.fetch_all(user_id=user_id, exercise_id=exercise_id, limit=settings.SIMILARITY_FETCH_LIMIT)
-            if not all_items:
-                return []
-            q_emb = np.array(embed_text(query_text, self.dim, self.model))
+            q_emb = embed_vector(query_text, self.dim, self.model)
             if not q_emb.size or np.linalg.norm(q_emb) == 0:
                 return []
-            decay_lambda = settings.SIMILARITY_RECENCY_DECAY
-            scored: List[Tuple[float, Dict[str, Any]]] = []
-            for it in all_items:
-                emb = it.get('embedding')
-                if not emb:
-                    continue
-                v = np.array(emb, dtype=float)
-                if not v.size or np.linalg.norm(v) == 0:
-                    continue
-                sim = float(np.dot(q_emb, v) / (np.linalg.norm(q_emb) * np.linalg.norm(v)))
-                rec_weight = _recency_weight(it.get('created_at'), decay_lambda)
-                hybrid = sim * rec_weight
-                # Guardamos embedding temporal para MMR
-                it['_embedding'] = v.tolist()
-                it['score_cosine'] = sim
-                it['recency_weight'] = rec_weight
-                it['score_hybrid'] = hybrid
-                scored.append((hybrid, it))
+            scored = None
+            if self.backend == 'pgvector':
+                scored = self._score_pgvector(user_id=user_id, exercise_id=exercise_id, q_emb=q_emb, limit=limit)
+            if scored is None:
+                scored = self._score_local(user_id=user_id, exercise_id=exercise_id, q_emb=q_emb, limit=limit)
             if not scored:
                 return []
             scored.sort(key=lambda x: x[0], reverse=True)
@@ -193,10 +335,70 @@ class VectorStore:
             # Limpieza: remover embedding temporal para no persistirlo si se serializa
             for it in mmr:
                 it.pop('_embedding', None)
+                it.pop('embedding', None)
+                it.pop('embedding_b64', None)
             return mmr
         except Exception:
             return self.recent(user_id=user_id, exercise_id=exercise_id, limit=limit)
 
+    def _score_pgvector(self, *, user_id: str, exercise_id: str, q_emb: np.ndarray, limit: int) -> Optional[List[Tuple[float, Dict[str, Any]]]]:
+        """Top 4xK por score híbrido calculado en Postgres. None si la RPC no está disponible o falla."""
+        try:
+            res = self.client.rpc('match_conversation_vectors', {
+                'p_user_id': user_id,
+                'p_exercise_id': exercise_id,
+                'p_query': q_emb.tolist(),
+                'p_match_count': max(limit * 4, limit),
+                'p_candidate_pool': settings.SIMILARITY_FETCH_LIMIT,
+                'p_decay_lambda': settings.SIMILARITY_RECENCY_DECAY,
+            }).execute()
+        except Exception as e:
+            if is_missing_object(e, MISSING_FUNCTION_CODES):
+                # Migración no aplicada: volver al ranking local para el resto del proceso
+                self.backend = 'local'
+                logger.warning("RPC match_conversation_vectors no disponible, usando similaridad local: %s", e)
+            else:
+                # Error transitorio: sólo esta búsqueda usa el ranking local
+                logger.warning("RPC match_conversation_vectors falló, similaridad local para esta búsqueda: %s", e)
+            return None
+        scored: List[Tuple[float, Dict[str, Any]]] = []
+        for it in res.data or []:
+            it['_embedding'] = _embedding_row(it, q_emb.shape[0])
+            scored.append((float(it['score_hybrid']), it))
+        return scored
+
+    def _score_local(self, *, user_id: str, exercise_id: str, q_emb: np.ndarray, limit: int) -> List[Tuple[float, Dict[str, Any]]]:
+        """Score híbrido vectorizado: una matmul para coseno, recency en bloque y argpartition para el top 4xK."""
+        all_items = self.fetch_all(user_id=user_id, exercise_id=exercise_id, limit=settings.SIMILARITY_FETCH_LIMIT)
+        if not all_items:
+            return []
+        matrix, index = _stack_embeddings(all_items, q_emb.shape[0])
+        norms = np.linalg.norm(matrix, axis=1)
+        keep = norms > 0
+        if not keep.any():
+            return []
+        if not keep.all():
+            matrix, norms = matrix[keep], norms[keep]
+            index = [i for i, k in zip(index, keep) if k]
+        items = [all_items[i] for i in index]
+        q = q_emb.astype(np.float32)
+        sims = (matrix @ q) / (norms * np.linalg.norm(q))
+        weights = _recency_weights([it.get('created_at') for it in items], settings.SIMILARITY_RECENCY_DECAY)
+        hybrid = sims * weights
+        k = min(max(limit * 4, limit), len(items))
+        top = np.argpartition(-hybrid, k - 1)[:k] if k < len(items) else np.arange(len(items))
+        top = top[np.argsort(-hybrid[top], kind='stable')]
+        scored: List[Tuple[float, Dict[str, Any]]] = []
+        for j in top:
+            it = items[j]
+            # Guardamos embedding temporal para MMR (fila de la matriz, sin copiar)
+            it['_embedding'] = matrix[j]
+            it['score_cosine'] = float(sims[j])
+            it['recency_weight'] = float(weights[j])
+            it['score_hybrid'] = float(hybrid[j])
+            scored.append((float(hybrid[j]), it))
+        return scored
+
 _vector_store = VectorStore()
 
 def get_vector_store() -> VectorStore:
@@ -1,12 +1,36 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager, suppress
+import asyncio
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from .core.config import get_settings
+from .db.database import shutdown_executor
+from .core.security import get_jwks_manager
+from .db.write_behind import get_write_behind
+from .core.telemetry import PrometheusMiddleware, monitor_event_loop, render_metrics, mark_worker_dead
+from .core.tracing import TracingMiddleware
 from .api import users, guides, exercises, attempts, progress, feedback
 from .api import llm_status, metrics
 
 settings = get_settings()
 
-app = FastAPI(title=settings.PROJECT_NAME, version="0.1.0")
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    if settings.WRITE_BEHIND_ENABLED:
+        get_write_behind().start()
+    loop_monitor = asyncio.get_running_loop().create_task(monitor_event_loop(settings.EVENT_LOOP_LAG_INTERVAL)) if settings.PROMETHEUS_ENABLED else None
+    yield
+    if loop_monitor is not None:
+        loop_monitor.cancel()
+        with suppress(asyncio.CancelledError):
+            await loop_monitor
+    # Apagado ordenado: persistir escrituras pendientes (usa el pool) antes de liberar el pool
+    # de hilos de la base de datos y el cliente HTTP del JWKS
+    await get_write_behind().drain()
+    shutdown_executor()
+    await get_jwks_manager().aclose()
+    mark_worker_dead()
+
+app = FastAPI(title=settings.PROJECT_NAME, version="0.1.0", lifespan=lifespan)
 
 # CORS (permite llamadas desde el frontend local)
 app.add_middleware(
@@ -15,8 +39,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Métricas por plantilla de ruta (se registra después de CORS: queda como capa más externa)
+if settings.PROMETHEUS_ENABLED:
+    app.add_middleware(PrometheusMiddleware)
+# Traza por request: etapas del pipeline LLM en el header Server-Timing
+if settings.TRACING_ENABLED:
+    app.add_middleware(TracingMiddleware)
+
 # Routers
 app.include_router(users.router, prefix=settings.API_V1_STR)
 app.include_router(guides.router, prefix=settings.API_V1_STR)
@@ -30,3 +62,12 @@ app.include_router(metrics.router, prefix=settings.API_V1_STR)
 @app.get('/', tags=["health"], summary="Health check")
 async def root():
     return {"status": "ok"}
+
+@app.get('/metrics', include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    if not settings.PROMETHEUS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if settings.METRICS_SCRAPE_TOKEN and request.headers.get('authorization') != f"Bearer {settings.METRICS_SCRAPE_TOKEN}":
+        raise HTTPException(status_code=401, detail="Token de scraping inválido")
+    body, content_type = render_metrics(request.headers.get('accept'))
+    return Response(content=body, media_type=content_type)
@@ -14,6 +14,7 @@ class ExerciseBase(BaseModel):
     is_active: bool = True
     enable_structural_validation: bool = True
     enable_llm_feedback: bool = True
+    enable_feedback_cache: bool = False  # Reutilizar feedback ante respuestas idénticas (no personalizado)
 
 class ExerciseCreate(ExerciseBase):
     pass
@@ -28,6 +29,7 @@ class ExerciseUpdate(BaseModel):
     is_active: bool | None = None
     enable_structural_validation: bool | None = None
     enable_llm_feedback: bool | None = None
+    enable_feedback_cache: bool | None = None
 
 class ExerciseOut(ExerciseBase):
     id: str
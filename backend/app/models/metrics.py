@@ -24,3 +24,29 @@ class LLMMetricOverviewItem(LLMMetricBase):
 class LLMMetricOverviewResponse(BaseModel):
     items: list[LLMMetricOverviewItem]
     count: int
+
+
+class LLMLatencySummary(BaseModel):
+    p50: float | None = None
+    p95: float | None = None
+    p99: float | None = None
+    mean: float | None = None
+    max: float | None = None
+
+
+class LLMAggregate(BaseModel):
+    model: str
+    kind: str  # feedback | feedback_cache | chat
+    count: int
+    latency_ms: LLMLatencySummary
+    prompt_tokens: int
+    completion_tokens: int
+    flag_rates: dict[str, float]
+
+
+class LLMLiveMetricsResponse(BaseModel):
+    since: float  # epoch de arranque del worker
+    total_calls: int
+    buffer: dict[str, int]
+    groups: list[LLMAggregate]
+    recent: list[dict[str, Any]] | None = None
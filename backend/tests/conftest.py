@@ -0,0 +1,8 @@
+"""Configuración común de los tests: sin credenciales reales ni llamadas a Gemini/Supabase."""
+import os
+
+# Antes de importar app.*: get_settings() se evalúa al importar los módulos
+# (las variables de entorno tienen prioridad sobre backend/.env)
+os.environ['SUPABASE_URL'] = 'http://localhost:54321'
+os.environ['SUPABASE_ANON_KEY'] = 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.test'  # formato JWT que exige el cliente
+os.environ['GOOGLE_API_KEY'] = ''
@@ -0,0 +1,181 @@
+"""LangChainLLMWrapper contra modelos falsos locales (sin red): deadline, semáforo, stub y single-flight."""
+import asyncio
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from app.llm_feedback import feedback_chain
+from app.llm_feedback.feedback_chain import ERROR_RESPONSE_PREFIX, STUB_RESPONSE, LangChainLLMWrapper
+
+
+class SlowModel:
+    """Chat model mínimo: responde tras `delay` segundos y registra la concurrencia observada."""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False) -> None:
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def ainvoke(self, prompt: str) -> str:
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError("modelo caído")
+            return f"respuesta:{prompt}"
+        finally:
+            self.active -= 1
+
+    async def astream(self, prompt: str):
+        await asyncio.sleep(self.delay)
+        yield "tarde"
+
+
+@pytest.fixture(autouse=True)
+def llm_settings(monkeypatch):
+    # El semáforo se enlaza al loop del primer uso: uno nuevo por test (cada test usa asyncio.run)
+    monkeypatch.setattr(feedback_chain, '_llm_semaphore', asyncio.Semaphore(2))
+    monkeypatch.setattr(feedback_chain.settings, 'LLM_TIMEOUT_SECONDS', 1.0)
+    monkeypatch.setattr(feedback_chain.settings, 'LLM_COALESCE_ENABLED', True)
+
+
+def test_fake_chat_model_roundtrip():
+    llm = LangChainLLMWrapper('fake', 0.0, chain=FakeListChatModel(responses=["## Fortalezas\nBien."]))
+
+    async def run():
+        text = await llm.agenerate("prompt")
+        chunks = [c async for c in llm.astream("prompt")]
+        return text, "".join(chunks)
+
+    text, streamed = asyncio.run(run())
+    assert text == "## Fortalezas\nBien."
+    assert streamed == "## Fortalezas\nBien."
+
+
+def test_deadline_returns_stub(monkeypatch):
+    monkeypatch.setattr(feedback_chain.settings, 'LLM_TIMEOUT_SECONDS', 0.05)
+    model = SlowModel(delay=1.0)
+    llm = LangChainLLMWrapper('fake', 0.0, chain=model)
+
+    async def run():
+        text = await llm.agenerate("lento")
+        chunks = [c async for c in llm.astream("lento")]
+        return text, chunks
+
+    text, chunks = asyncio.run(run())
+    assert text == STUB_RESPONSE
+    assert chunks == [STUB_RESPONSE]
+    assert llm._timeouts == 2
+
+
+def test_deadline_includes_queue_wait(monkeypatch):
+    # Con el semáforo ocupado por llamadas lentas, la espera en cola también consume el deadline
+    monkeypatch.setattr(feedback_chain, '_llm_semaphore', asyncio.Semaphore(1))
+    monkeypatch.setattr(feedback_chain.settings, 'LLM_TIMEOUT_SECONDS', 0.15)
+    model = SlowModel(delay=0.1)
+    llm = LangChainLLMWrapper('fake', 0.0, chain=model)
+
+    async def run():
+        return await asyncio.gather(llm.agenerate("a"), llm.agenerate("b"))
+
+    first, second = asyncio.run(run())
+    assert first == "respuesta:a"
+    assert second == STUB_RESPONSE
+
+
+def test_semaphore_caps_concurrent_calls():
+    model = SlowModel(delay=0.05)
+    llm = LangChainLLMWrapper('fake', 0.0, chain=model)
+
+    async def run():
+        return await asyncio.gather(*(llm.agenerate(f"p{i}") for i in range(6)))
+
+    results = asyncio.run(run())
+    assert results == [f"respuesta:p{i}" for i in range(6)]
+    assert model.calls == 6
+    assert model.max_active == 2
+
+
+def test_model_failure_falls_back_to_error_response():
+    llm = LangChainLLMWrapper('fake', 0.0, chain=SlowModel(fail=True))
+    text = asyncio.run(llm.agenerate("x"))
+    assert text.startswith(ERROR_RESPONSE_PREFIX)
+
+
+def test_stream_failure_before_first_chunk_falls_back_to_error_response():
+    model = FakeListChatModel(responses=["hola"], error_on_chunk_number=0)
+    llm = LangChainLLMWrapper('fake', 0.0, chain=model)
+
+    async def run():
+        return [c async for c in llm.astream("x")]
+
+    chunks = asyncio.run(run())
+    assert len(chunks) == 1 and chunks[0].startswith(ERROR_RESPONSE_PREFIX)
+
+
+def test_without_model_returns_stub(monkeypatch):
+    monkeypatch.setattr(feedback_chain.settings, 'GOOGLE_API_KEY', None)
+    llm = LangChainLLMWrapper('fake', 0.0)
+    assert llm._chain is None
+
+    async def run():
+        text, coalesced = await llm.agenerate_shared("x")
+        chunks = [c async for c in llm.astream("x")]
+        return text, coalesced, chunks
+
+    text, coalesced, chunks = asyncio.run(run())
+    assert (text, coalesced) == (STUB_RESPONSE, False)
+    assert chunks == [STUB_RESPONSE]
+
+
+def test_single_flight_shares_one_call():
+    model = SlowModel(delay=0.05)
+    llm = LangChainLLMWrapper('fake', 0.0, chain=model)
+
+    async def run():
+        return await asyncio.gather(*(llm.agenerate_shared("igual") for _ in range(5)), llm.agenerate_shared("otro"))
+
+    results = asyncio.run(run())
+    assert model.calls == 2
+    assert [text for text, _ in results] == ["respuesta:igual"] * 5 + ["respuesta:otro"]
+    assert sorted(coalesced for _, coalesced in results[:5]) == [False, True, True, True, True]
+    assert results[5][1] is False
+    assert llm._coalesced == 4
+    assert llm._inflight == {}
+
+
+def test_single_flight_survives_cancelled_waiter():
+    model = SlowModel(delay=0.1)
+    llm = LangChainLLMWrapper('fake', 0.0, chain=model)
+
+    async def run():
+        first = asyncio.ensure_future(llm.agenerate_shared("igual"))
+        second = asyncio.ensure_future(llm.agenerate_shared("igual"))
+        await asyncio.sleep(0.02)
+        first.cancel()  # p.ej. cliente desconectado
+        result = await second
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return result
+
+    text, coalesced = asyncio.run(run())
+    assert (text, coalesced) == ("respuesta:igual", True)
+    assert model.calls == 1
+    assert llm._inflight == {}
+
+
+def test_single_flight_disabled_calls_each_time(monkeypatch):
+    monkeypatch.setattr(feedback_chain.settings, 'LLM_COALESCE_ENABLED', False)
+    model = SlowModel(delay=0.02)
+    llm = LangChainLLMWrapper('fake', 0.0, chain=model)
+
+    async def run():
+        return await asyncio.gather(*(llm.agenerate_shared("igual") for _ in range(3)))
+
+    results = asyncio.run(run())
+    assert model.calls == 3
+    assert all(not coalesced for _, coalesced in results)
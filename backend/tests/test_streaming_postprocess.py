@@ -0,0 +1,75 @@
+"""StreamingPostprocessor debe entregar lo mismo que normalize_output + sanitize_references en batch,
+sin importar cómo llegue partido el output del LLM."""
+import random
+
+import pytest
+
+from app.llm_feedback.postprocess import StreamingPostprocessor, normalize_output, sanitize_references
+
+CASES = [
+    "## Fortalezas\nBuen uso de capas.\n\n## Errores\n\n## Consejos de mejora\n- Usa multi-stage.",
+    "ver https://docs.docker.com/engine para más detalles",
+    "Revisa [la guía](https://a.b/c) antes de seguir.",
+    "cita [1]. otra cita [a], fin",
+    # La URL se elimina y la cita se lleva también el espacio previo: batch da 'ver.'
+    "ver https://x.y [1].",
+    "ver https://x.y [1]. Luego sigue\ncon otra línea https://q.r [2]",
+    "\n  ## Referencias extra\n## Fortalezas\n- item uno\n\n",
+    "https://x.y\n  texto tras una línea vacía tras el saneado",
+    "## Errores\nhttps://a/\t## Errores(## Fortalezas\nresto",
+    "línea con espacios finales   \n\n\n\n## Pregunta de seguimiento\n¿Qué cambiarías?",
+    "## Referencias\n- [1] https://docs.docker.com\n## Fortalezas",
+]
+
+# Piezas para generar respuestas aleatorias con encabezados, links, URLs y citas mezclados
+PIECES = [
+    "## Fortalezas", "## Errores", "## Referencias", "## Consejos de mejora", "Buen uso de capas",
+    "ver https://docs.docker.com/x para más", "[docs](https://a.b/c) aquí", "cita [1].", "  indent", "", "",
+    "texto [a] y más", "- item uno", "\t tab  ", "https://x.y", "a [b] c", "ver https://x.y [1].",
+]
+
+
+def batch(text: str) -> str:
+    return sanitize_references(normalize_output(text))[0]
+
+
+def stream(text: str, sizes: list[int]) -> str:
+    post = StreamingPostprocessor()
+    out: list[str] = []
+    i = 0
+    for n in sizes:
+        out.append(post.feed(text[i:i + n]))
+        i += n
+    out.append(post.flush())
+    joined = "".join(out)
+    # Lo que se persiste (text) es exactamente lo que se envió al cliente
+    assert joined == post.text
+    return joined
+
+
+def random_sizes(length: int, rng: random.Random) -> list[int]:
+    sizes: list[int] = []
+    while sum(sizes) < length:
+        sizes.append(rng.randint(1, 12))
+    return sizes
+
+
+@pytest.mark.parametrize('text', CASES)
+def test_every_fixed_chunk_size_matches_batch(text):
+    expected = batch(text)
+    for n in range(1, len(text) + 1):
+        assert stream(text, [n] * (len(text) // n + 1)) == expected, f"fragmentos de {n}"
+
+
+def test_reference_citation_after_removed_url():
+    assert batch("ver https://x.y [1].") == "ver."
+    assert stream("ver https://x.y [1].", [4, 12, 4]) == "ver."
+
+
+def test_random_responses_and_chunkings_match_batch():
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = "\n".join(rng.choice(PIECES) for _ in range(rng.randint(1, 8)))
+        if rng.random() < 0.3:
+            text = "\n  " + text + "\n\n"
+        assert stream(text, random_sizes(len(text), rng)) == batch(text), repr(text)
@@ -0,0 +1,37 @@
+-- SQL para el cache de catálogo (guías / ejercicios) del backend
+-- Ejecutar en SQL Editor de Supabase Dashboard
+-- Cada worker consulta catalog_version periódicamente (CATALOG_VERSION_CHECK_SECONDS)
+-- y vacía su cache en memoria cuando el número cambia.
+
+-- PASO 1: Tabla de una sola fila con la versión actual del catálogo
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO catalog_version (id, version) VALUES (1, 0)
+ON CONFLICT (id) DO NOTHING;
+
+-- PASO 2: Función que incrementa la versión ante cualquier escritura
+CREATE OR REPLACE FUNCTION bump_catalog_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = NOW() WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- PASO 3: Triggers por sentencia sobre guides y exercises
+DROP TRIGGER IF EXISTS trg_guides_catalog_version ON guides;
+CREATE TRIGGER trg_guides_catalog_version
+AFTER INSERT OR UPDATE OR DELETE ON guides
+FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+
+DROP TRIGGER IF EXISTS trg_exercises_catalog_version ON exercises;
+CREATE TRIGGER trg_exercises_catalog_version
+AFTER INSERT OR UPDATE OR DELETE ON exercises
+FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+
+-- PASO 4: Verificar
+SELECT * FROM catalog_version;
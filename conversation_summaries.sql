@@ -0,0 +1,19 @@
+-- SQL para la memoria de chat (resumen incremental por usuario/ejercicio)
+-- Ejecutar en SQL Editor de Supabase Dashboard
+-- El backend actualiza el resumen en segundo plano cada CHAT_SUMMARY_EVERY_TURNS turnos;
+-- si la tabla no existe los resúmenes viven sólo en memoria de cada worker.
+
+-- PASO 1: Un resumen por par usuario/ejercicio
+CREATE TABLE IF NOT EXISTS exercise_conversation_summaries (
+    user_id UUID NOT NULL REFERENCES users(id),
+    exercise_id UUID NOT NULL REFERENCES exercises(id),
+    summary TEXT NOT NULL DEFAULT '',
+    summarized_until TIMESTAMPTZ,           -- created_at del último turno incorporado al resumen
+    turns_summarized INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, exercise_id)
+);
+
+-- PASO 2: Verificar
+SELECT user_id, exercise_id, turns_summarized, summarized_until, updated_at
+FROM exercise_conversation_summaries ORDER BY updated_at DESC LIMIT 20;
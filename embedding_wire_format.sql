@@ -0,0 +1,65 @@
+-- SQL para transportar embeddings en formato compacto (float32 big-endian en base64)
+-- Ejecutar en SQL Editor de Supabase Dashboard (después de match_conversation_vectors.sql)
+-- JSON: ~20 caracteres por dimensión; base64 de float4: ~5.3 caracteres por dimensión.
+-- El backend decodifica con np.frombuffer(base64, '>f4') (EMBEDDING_WIRE_FORMAT=b64).
+
+-- PASO 1: Codificación (vector_send = int16 dim + int16 reservado + float4 big-endian)
+CREATE OR REPLACE FUNCTION embedding_b64(v vector)
+RETURNS TEXT
+LANGUAGE sql IMMUTABLE STRICT AS $$
+    SELECT translate(encode(substring(vector_send(v) FROM 5), 'base64'), E'\n', '');
+$$;
+
+-- PASO 2: Columna calculada para PostgREST: select('...,embedding_b64')
+CREATE OR REPLACE FUNCTION embedding_b64(r exercise_conversation_vectors)
+RETURNS TEXT
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT embedding_b64(r.embedding);
+$$;
+
+-- PASO 3: La RPC de similaridad devuelve el embedding compacto (cambia el tipo de retorno)
+DROP FUNCTION IF EXISTS match_conversation_vectors(UUID, UUID, vector, INT, INT, DOUBLE PRECISION);
+CREATE OR REPLACE FUNCTION match_conversation_vectors(
+    p_user_id UUID,
+    p_exercise_id UUID,
+    p_query vector,
+    p_match_count INT DEFAULT 16,
+    p_candidate_pool INT DEFAULT 200,
+    p_decay_lambda DOUBLE PRECISION DEFAULT 0.04
+)
+RETURNS TABLE (
+    id UUID,
+    user_id UUID,
+    exercise_id UUID,
+    attempt_id UUID,
+    type TEXT,
+    content TEXT,
+    created_at TIMESTAMPTZ,
+    embedding_b64 TEXT,
+    score_cosine DOUBLE PRECISION,
+    recency_weight DOUBLE PRECISION,
+    score_hybrid DOUBLE PRECISION
+)
+LANGUAGE sql STABLE AS $$
+    WITH candidates AS (
+        SELECT v.*, 1 - (v.embedding <=> p_query) AS cosine
+        FROM exercise_conversation_vectors v
+        WHERE v.user_id = p_user_id
+          AND v.exercise_id = p_exercise_id
+          AND v.embedding IS NOT NULL
+        ORDER BY v.embedding <=> p_query
+        LIMIT p_candidate_pool
+    ), weighted AS (
+        SELECT c.*,
+               COALESCE(EXP(-p_decay_lambda * EXTRACT(EPOCH FROM (NOW() - c.created_at)) / 3600.0), 1) AS rw
+        FROM candidates c
+    )
+    SELECT w.id, w.user_id, w.exercise_id, w.attempt_id, w.type, w.content, w.created_at, embedding_b64(w.embedding),
+           w.cosine, w.rw, w.cosine * w.rw
+    FROM weighted w
+    ORDER BY w.cosine * w.rw DESC
+    LIMIT p_match_count;
+$$;
+
+-- PASO 4: Verificar
+-- SELECT id, length(embedding_b64(embedding)) FROM exercise_conversation_vectors LIMIT 5;
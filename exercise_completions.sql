@@ -0,0 +1,120 @@
+-- SQL para el seguimiento incremental de ejercicios/guías completadas
+-- Ejecutar en SQL Editor de Supabase Dashboard
+-- IMPORTANTE: Ejecutar cada bloque por separado
+-- El backend llama a record_exercise_completion sólo cuando un intento queda completed=true;
+-- si la función no existe vuelve al recálculo completo (ensure_guide_completed).
+
+-- PASO 1: Ejercicios distintos completados por usuario (una fila por par usuario/ejercicio)
+CREATE TABLE IF NOT EXISTS user_exercise_completions (
+    user_id UUID NOT NULL REFERENCES users(id),
+    exercise_id UUID NOT NULL REFERENCES exercises(id),
+    guide_id UUID REFERENCES guides(id),
+    completed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, exercise_id)
+);
+CREATE INDEX IF NOT EXISTS idx_user_exercise_completions_guide
+    ON user_exercise_completions (user_id, guide_id);
+
+-- PASO 2: Poblar con los intentos completados existentes
+INSERT INTO user_exercise_completions (user_id, exercise_id, guide_id, completed_at)
+SELECT a.user_id, a.exercise_id, e.guide_id, MIN(a.created_at)
+FROM exercise_attempts a
+JOIN exercises e ON e.id = a.exercise_id
+WHERE a.completed AND a.user_id IS NOT NULL
+GROUP BY a.user_id, a.exercise_id, e.guide_id
+ON CONFLICT (user_id, exercise_id) DO NOTHING;
+
+-- PASO 3: completed_guides único por usuario/guía (elimina duplicados previos conservando el más antiguo)
+DELETE FROM completed_guides c
+USING completed_guides d
+WHERE c.user_id = d.user_id
+  AND c.guide_id = d.guide_id
+  AND (c.completed_at, c.id) > (d.completed_at, d.id);
+
+ALTER TABLE completed_guides
+    ADD CONSTRAINT completed_guides_user_guide_key UNIQUE (user_id, guide_id);
+
+-- PASO 4: Registrar una completitud; devuelve TRUE si la guía quedó completada
+CREATE OR REPLACE FUNCTION record_exercise_completion(p_user_id UUID, p_exercise_id UUID)
+RETURNS BOOLEAN
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_guide_id UUID;
+    v_inserted INT;
+    v_total INT;
+    v_done INT;
+BEGIN
+    SELECT guide_id INTO v_guide_id FROM exercises WHERE id = p_exercise_id;
+    -- Serializa completitudes concurrentes del mismo usuario/guía (el conteo ve las inserciones previas)
+    PERFORM pg_advisory_xact_lock(hashtext(p_user_id::TEXT || ':' || COALESCE(v_guide_id::TEXT, '')));
+
+    INSERT INTO user_exercise_completions (user_id, exercise_id, guide_id)
+    VALUES (p_user_id, p_exercise_id, v_guide_id)
+    ON CONFLICT (user_id, exercise_id) DO NOTHING;
+    GET DIAGNOSTICS v_inserted = ROW_COUNT;
+
+    IF v_guide_id IS NULL THEN
+        RETURN FALSE;
+    END IF;
+    IF v_inserted = 0 THEN
+        -- El ejercicio ya estaba completado: el estado de la guía no cambia
+        RETURN EXISTS (SELECT 1 FROM completed_guides WHERE user_id = p_user_id AND guide_id = v_guide_id);
+    END IF;
+
+    SELECT COUNT(*) INTO v_total FROM exercises WHERE guide_id = v_guide_id AND is_active;
+    SELECT COUNT(*) INTO v_done
+    FROM user_exercise_completions c
+    JOIN exercises e ON e.id = c.exercise_id
+    WHERE c.user_id = p_user_id AND c.guide_id = v_guide_id AND e.is_active;
+
+    IF v_total > 0 AND v_done >= v_total THEN
+        INSERT INTO completed_guides (guide_id, user_id)
+        VALUES (v_guide_id, p_user_id)
+        ON CONFLICT (user_id, guide_id) DO NOTHING;
+        RETURN TRUE;
+    END IF;
+    RETURN FALSE;
+END;
+$$;
+
+-- PASO 5: user_guide_progress (progress_rpc.sql) leyendo la nueva tabla en lugar de exercise_attempts
+CREATE OR REPLACE FUNCTION user_guide_progress(
+    p_user_id UUID,
+    p_active_only BOOLEAN DEFAULT TRUE,
+    p_include_exercises BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (
+    guide_id UUID,
+    title TEXT,
+    topic TEXT,
+    "order" INT,
+    total_exercises INT,
+    completed_exercises INT,
+    exercises JSONB
+)
+LANGUAGE sql STABLE AS $$
+    WITH ex AS (
+        SELECT e.id, e.guide_id, e.title, (c.exercise_id IS NOT NULL) AS completed
+        FROM exercises e
+        LEFT JOIN user_exercise_completions c ON c.exercise_id = e.id AND c.user_id = p_user_id
+        WHERE e.is_active
+    )
+    SELECT g.id,
+           g.title,
+           g.topic,
+           g."order",
+           COUNT(ex.id)::INT,
+           (COUNT(ex.id) FILTER (WHERE ex.completed))::INT,
+           CASE WHEN p_include_exercises THEN
+               COALESCE(
+                   JSONB_AGG(JSONB_BUILD_OBJECT('exercise_id', ex.id, 'title', ex.title, 'completed', ex.completed))
+                       FILTER (WHERE ex.id IS NOT NULL),
+                   '[]'::JSONB
+               )
+           END
+    FROM guides g
+    LEFT JOIN ex ON ex.guide_id = g.id
+    WHERE NOT p_active_only OR g.is_active
+    GROUP BY g.id
+    ORDER BY g."order";
+$$;
@@ -0,0 +1,65 @@
+-- SQL para la búsqueda de similaridad en Postgres (pgvector)
+-- Ejecutar en SQL Editor de Supabase Dashboard
+-- Se usa con SIMILARITY_BACKEND=pgvector; con 'local' (default) el ranking sigue en Python.
+-- La dimensión del índice debe coincidir con la columna embedding (EMBEDDING_DIM, 1536 por defecto).
+
+-- PASO 1: Extensión e índices
+CREATE EXTENSION IF NOT EXISTS vector;
+
+-- Filtro por usuario/ejercicio (también lo usan recent() y /feedback/history)
+CREATE INDEX IF NOT EXISTS idx_conv_vectors_user_exercise_created
+    ON exercise_conversation_vectors (user_id, exercise_id, created_at DESC);
+
+-- Índice ANN para distancia coseno
+CREATE INDEX IF NOT EXISTS idx_conv_vectors_embedding_hnsw
+    ON exercise_conversation_vectors USING hnsw (embedding vector_cosine_ops);
+
+-- PASO 2: Top-k híbrido (coseno * recency) para un usuario/ejercicio
+-- 1) Candidatos más cercanos por coseno (p_candidate_pool, vía HNSW).
+-- 2) Peso de recency exp(-lambda * horas) y orden por score híbrido.
+-- 3) Sólo p_match_count filas vuelven al backend (embedding incluido para MMR).
+CREATE OR REPLACE FUNCTION match_conversation_vectors(
+    p_user_id UUID,
+    p_exercise_id UUID,
+    p_query vector,
+    p_match_count INT DEFAULT 16,
+    p_candidate_pool INT DEFAULT 200,
+    p_decay_lambda DOUBLE PRECISION DEFAULT 0.04
+)
+RETURNS TABLE (
+    id UUID,
+    user_id UUID,
+    exercise_id UUID,
+    attempt_id UUID,
+    type TEXT,
+    content TEXT,
+    created_at TIMESTAMPTZ,
+    embedding vector,
+    score_cosine DOUBLE PRECISION,
+    recency_weight DOUBLE PRECISION,
+    score_hybrid DOUBLE PRECISION
+)
+LANGUAGE sql STABLE AS $$
+    WITH candidates AS (
+        SELECT v.*, 1 - (v.embedding <=> p_query) AS cosine
+        FROM exercise_conversation_vectors v
+        WHERE v.user_id = p_user_id
+          AND v.exercise_id = p_exercise_id
+          AND v.embedding IS NOT NULL
+        ORDER BY v.embedding <=> p_query
+        LIMIT p_candidate_pool
+    ), weighted AS (
+        SELECT c.*,
+               COALESCE(EXP(-p_decay_lambda * EXTRACT(EPOCH FROM (NOW() - c.created_at)) / 3600.0), 1) AS rw
+        FROM candidates c
+    )
+    SELECT w.id, w.user_id, w.exercise_id, w.attempt_id, w.type, w.content, w.created_at, w.embedding,
+           w.cosine, w.rw, w.cosine * w.rw
+    FROM weighted w
+    ORDER BY w.cosine * w.rw DESC
+    LIMIT p_match_count;
+$$;
+
+-- Opcional (pgvector >= 0.8): el filtro por usuario/ejercicio con HNSW puede devolver menos
+-- candidatos de los pedidos; el scan iterativo lo evita.
+-- ALTER DATABASE postgres SET hnsw.iterative_scan = relaxed_order;
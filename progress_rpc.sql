@@ -0,0 +1,56 @@
+-- SQL para agregar el progreso por guía en Postgres (una sola llamada RPC desde el backend)
+-- Ejecutar en SQL Editor de Supabase Dashboard
+-- El backend usa la función si existe (PROGRESS_RPC_ENABLED=true); si no, vuelve a la agregación en Python.
+
+-- PASO 1: Índice parcial para buscar intentos completados por usuario
+CREATE INDEX IF NOT EXISTS idx_exercise_attempts_user_completed
+    ON exercise_attempts (user_id, exercise_id)
+    WHERE completed;
+
+-- PASO 2: Función de progreso (totales por guía y, opcionalmente, detalle por ejercicio)
+CREATE OR REPLACE FUNCTION user_guide_progress(
+    p_user_id UUID,
+    p_active_only BOOLEAN DEFAULT TRUE,
+    p_include_exercises BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (
+    guide_id UUID,
+    title TEXT,
+    topic TEXT,
+    "order" INT,
+    total_exercises INT,
+    completed_exercises INT,
+    exercises JSONB
+)
+LANGUAGE sql STABLE AS $$
+    WITH ex AS (
+        SELECT e.id, e.guide_id, e.title,
+               EXISTS (
+                   SELECT 1 FROM exercise_attempts a
+                   WHERE a.exercise_id = e.id AND a.user_id = p_user_id AND a.completed
+               ) AS completed
+        FROM exercises e
+        WHERE e.is_active
+    )
+    SELECT g.id,
+           g.title,
+           g.topic,
+           g."order",
+           COUNT(ex.id)::INT,
+           (COUNT(ex.id) FILTER (WHERE ex.completed))::INT,
+           CASE WHEN p_include_exercises THEN
+               COALESCE(
+                   JSONB_AGG(JSONB_BUILD_OBJECT('exercise_id', ex.id, 'title', ex.title, 'completed', ex.completed))
+                       FILTER (WHERE ex.id IS NOT NULL),
+                   '[]'::JSONB
+               )
+           END
+    FROM guides g
+    LEFT JOIN ex ON ex.guide_id = g.id
+    WHERE NOT p_active_only OR g.is_active
+    GROUP BY g.id
+    ORDER BY g."order";
+$$;
+
+-- PASO 3: Verificar (reemplazar por un id de usuario real)
+-- SELECT * FROM user_guide_progress('00000000-0000-0000-0000-000000000000', TRUE, TRUE);